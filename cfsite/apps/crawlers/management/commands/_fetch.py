@@ -0,0 +1,143 @@
+import errno
+import hashlib
+import json
+import os
+import sys
+import threading
+import urllib2
+from urllib2 import HTTPError, URLError
+from collections import deque
+from django.conf import settings
+from cfsite.apps.crawlers.management.commands._errors import SourceRetrievalError
+
+def fetch_in_order(fetch_fn, args, fan_out): # generator function
+    """
+    Calls fetch_fn on each of args, up to fan_out calls running at the same
+    time in their own threads, and yields the results in the order of args.
+
+    Meant for the pages of the paginated sources: the pages are fetched
+    while the previous ones are parsed and saved, and no more than fan_out
+    of them are held in memory at once. An exception raised by fetch_fn is
+    raised again here, when its result is due. Calls still running when the
+    caller stops iterating are left to finish on their own.
+    """
+    args = iter(args)
+    pending = deque()
+
+    def start_next():
+        for arg in args:
+            result = {}
+            def run():
+                try:
+                    result['value'] = fetch_fn(arg)
+                except Exception:
+                    result['error'] = sys.exc_info()
+            thread = threading.Thread(target=run)
+            thread.daemon = True
+            thread.start()
+            pending.append((thread, result))
+            return
+
+    for unused_i in range(max(fan_out, 1)):
+        start_next()
+    while pending:
+        (thread, result) = pending.popleft()
+        thread.join()
+        if 'error' in result:
+            (exc_type, exc_value, exc_traceback) = result['error']
+            raise exc_type, exc_value, exc_traceback
+        start_next()
+        yield result['value']
+
+def fetch_if_changed(opener, url):
+    """
+    Fetches url, unless it did not change since it was last remembered.
+    Returns a ConditionalResponse.
+
+    The ETag, Last-Modified date and digest of the body of each url
+    remembered are kept in CRAWLER_HTTP_CACHE_DIR, one file per url. The
+    request is conditional on them, and a body identical to the one
+    remembered counts as unchanged, for servers which ignore the
+    conditions. Sources only remember a response once its events are
+    saved, so that an import which fails is tried again in full.
+    """
+    path = _get_cache_path(url)
+    entry = _load_cache_entry(path) if path else None
+    req = urllib2.Request(url)
+    if entry and entry.get('etag'):
+        req.add_header('If-None-Match', entry['etag'])
+    if entry and entry.get('last_modified'):
+        req.add_header('If-Modified-Since', entry['last_modified'])
+    try:
+        f = opener.open(req)
+    except HTTPError as e:
+        if e.code == 304 and entry:
+            return ConditionalResponse(path, None, entry)
+        raise SourceRetrievalError(e.reason)
+    except URLError as e:
+        raise SourceRetrievalError(e.reason)
+
+    body = f.read()
+    digest = hashlib.sha1(body).hexdigest()
+    if entry and entry.get('digest') == digest:
+        return ConditionalResponse(path, None, entry)
+    return ConditionalResponse(path, body, {
+        'etag': f.info().getheader('ETag'),
+        'last_modified': f.info().getheader('Last-Modified'),
+        'digest': digest,
+        })
+
+class ConditionalResponse(object):
+    """
+    Response of fetch_if_changed. body is None if the url did not change
+    since it was last remembered, info is then the info remembered along
+    with it.
+    """
+    def __init__(self, path, body, entry):
+        self.path = path
+        self.body = body
+        self.info = entry.get('info')
+        self._entry = entry
+
+    def remember(self, info=None):
+        """
+        Remembers the response, and info about it (any JSON serializable
+        value) for when it is fetched unchanged next time.
+        """
+        if not self.path or self.body is None:
+            return
+        entry = dict(self._entry, info=info)
+        try:
+            os.makedirs(os.path.dirname(self.path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Written aside then renamed, so that a crash never leaves half an
+        # entry behind.
+        tmp_path = '%s.%d.tmp' % (self.path, threading.current_thread().ident)
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.rename(tmp_path, self.path)
+        self.info = info
+
+def _get_cache_path(url):
+    """
+    Returns the path of the cache file of url, or None if the cache is
+    disabled.
+    """
+    if not settings.CRAWLER_HTTP_CACHE_DIR:
+        return None
+    return os.path.join(settings.CRAWLER_HTTP_CACHE_DIR,
+                        hashlib.sha1(url).hexdigest() + '.json')
+
+def _load_cache_entry(path):
+    """
+    Returns the cache entry at path, or None if there is none (or it cannot
+    be read, the url is then fetched again in full).
+    """
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (IOError, ValueError):
+        return None
+    return entry if isinstance(entry, dict) else None
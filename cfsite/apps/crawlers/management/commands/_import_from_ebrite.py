@@ -1,12 +1,12 @@
 import os
+import math
 import urllib2
-from urllib2 import URLError
-import json
 import json
 import re
 from datetime import datetime
+from django.conf import settings
 from cfsite.apps.events.models import CONF, ART, MEET, FAM, CLASS, SPORT, FOOD, MUSIC
-from cfsite.apps.crawlers.management.commands._errors import SourceRetrievalError
+from cfsite.apps.crawlers.management.commands._fetch import fetch_in_order, fetch_if_changed
 
 _EBRITE_KEY = "JO34L4OP3GCXGEC2XJ"
 _EVENTS_PER_PAGE = 100
@@ -34,65 +34,109 @@ _EBRITE_TO_CF_CATEGORIES = {'conferences':CONF,
 def _price_str_to_float(price_str):
     return float(re.sub(u',',u'', price_str))
 
-def get_and_parse_eventbrite_JSON(): # generator function
+def get_and_parse_eventbrite_JSON(stderr=None): # generator function
     """
     Get next page's worth of JSON from eventbrite and extract
     start time, name, category, (<--mandatory, if missing, disregard event)
     end time, price, address, description, website (<--optional, ok if missing)
     Return a list of dicts that contain this info, one dict per event
+
+    The first page tells how many events there are: the other pages are
+    then fetched CRAWLER_PAGE_FAN_OUT at a time, and still parsed in order.
+    Events skipped because of unexpected info are reported to stderr, if
+    given (the stderr of the command).
     """
-    curr_page = 0
-    num_shown_so_far = 0
-    total_items = 0
     opener = urllib2.build_opener()
-    while (curr_page == 0) or (num_shown_so_far < total_items):
-        events_list = []
-        curr_page +=1
-        req = urllib2.Request(("https://www.eventbrite.com/json/event_search"
-                               "?app_key=%s&city=Palo+Alto&region=CA&max=%d&page=%d"
-                               % (_EBRITE_KEY, _EVENTS_PER_PAGE, curr_page)))
-        try:
-            f = opener.open(req)
-        except URLError as e:
-            raise SourceRetrievalError(e.reason)
-
-        ebrite_events_dict = json.load(f)
-        if u'error' in ebrite_events_dict:
+    (response, ebrite_events_dict) = _get_eventbrite_page(opener, 1)
+    if ebrite_events_dict is None: # unchanged since last imported
+        summary = response.info
+    else:
+        summary = _get_eventbrite_summary(ebrite_events_dict)
+    if summary is None:
+        return
+    (total_items, num_showing) = summary
+    if ebrite_events_dict is not None:
+        yield _parse_eventbrite_page(ebrite_events_dict, num_showing, stderr)
+        response.remember(summary) # needed to page through, when unchanged
+    if not num_showing:
+        return
+
+    # Eventbrite may show fewer events per page than asked for.
+    page_count = int(math.ceil(float(total_items) / num_showing))
+    pages = fetch_in_order(lambda page: _get_eventbrite_page(opener, page),
+                           range(2, page_count + 1),
+                           settings.CRAWLER_PAGE_FAN_OUT)
+    for (response, ebrite_events_dict) in pages:
+        if ebrite_events_dict is None:
+            continue # unchanged since last imported
+        summary = _get_eventbrite_summary(ebrite_events_dict)
+        if summary is None:
             break
+        yield _parse_eventbrite_page(ebrite_events_dict, summary[1], stderr)
+        response.remember()
 
+def _get_eventbrite_page(opener, page):
+    """
+    Fetches a page of events from eventbrite, pages starting at 1.
+    Returns the response (see fetch_if_changed) and the decoded JSON, or
+    None instead of the JSON if the page did not change since its events
+    were imported.
+    """
+    response = fetch_if_changed(opener, (
+        "https://www.eventbrite.com/json/event_search"
+        "?app_key=%s&city=Palo+Alto&region=CA&max=%d&page=%d"
+        % (_EBRITE_KEY, _EVENTS_PER_PAGE, page)))
+    if response.body is None:
+        return (response, None)
+    return (response, json.loads(response.body))
+
+def _get_eventbrite_summary(ebrite_events_dict):
+    """
+    Returns the total number of events and the number of events shown
+    by a page from eventbrite, or None if the page is an error.
+    """
+    if u'error' in ebrite_events_dict:
+        return None
+    try:
+        summary = ebrite_events_dict[u'events'][0][u'summary']
+        return (summary[u'total_items'], summary[u'num_showing'])
+    except (KeyError, IndexError):
+        return None
+
+def _parse_eventbrite_page(ebrite_events_dict, num_showing, stderr=None):
+    """
+    Returns the list of events, as dicts, of a page from eventbrite.
+    Events missing mandatory info are skipped. Events whose optional info
+    is not what we expect are skipped too, with a warning written to
+    stderr, if given.
+    """
+    events_list = []
+    for i in range(1,num_showing+1): # start from 1 because 0th is a summary dict
+        ev_dict =  ebrite_events_dict[u'events'][i][u'event']
         try:
-            total_items = ebrite_events_dict[u'events'][0][u'summary'][u'total_items']
-            num_showing = ebrite_events_dict[u'events'][0][u'summary'][u'num_showing']
-            num_shown_so_far += num_showing
-        except KeyError:
-            break
-
-        for i in range(1,num_showing+1): # start from 1 because 0th is a summary dict
-            ev_dict =  ebrite_events_dict[u'events'][i][u'event']
-            try:
-                name = ev_dict[u'title']
-                categories = _get_cfsite_categories(ev_dict[u'category'].split(','))
-                start_datetime = _convert_to_datetime(ev_dict[u'start_date'])
-            except KeyError: # if any of 3 mandatory fields are missing, skip event
-                continue
-            cf_ev_dict = {'name':name, 'categories':categories, # 'location':loc,
-                          'start_datetime':start_datetime}
-            try:
-                """
-                Most KeyErrors should be avoided since we check if the key
-                exists first, but we do make one assumption about what key
-                *should* be there (if we have a list of tickets, the dicts inside
-                should have key 'ticket')
-                """
-                _ebrite_extract_optional_fields(ev_dict, cf_ev_dict)
-            except KeyError:
-                print(sys.stderr, 'Error extracting optional info from event. Skipping.')
-                traceback.print_exc(file=sys.stderr)
-                continue
-
-            events_list.append(cf_ev_dict)
-
-        yield events_list
+            name = ev_dict[u'title']
+            categories = _get_cfsite_categories(ev_dict[u'category'].split(','))
+            start_datetime = _convert_to_datetime(ev_dict[u'start_date'])
+        except KeyError: # if any of 3 mandatory fields are missing, skip event
+            continue
+        cf_ev_dict = {'name':name, 'categories':categories, # 'location':loc,
+                      'start_datetime':start_datetime}
+        try:
+            """
+            Most KeyErrors should be avoided since we check if the key
+            exists first, but we do make one assumption about what key
+            *should* be there (if we have a list of tickets, the dicts inside
+            should have key 'ticket')
+            """
+            _ebrite_extract_optional_fields(ev_dict, cf_ev_dict)
+        except (KeyError, ValueError) as e:
+            if stderr is not None:
+                stderr.write('Skipping eventbrite event %r, unexpected '
+                             'optional info: %r' % (name, e))
+            continue
+
+        events_list.append(cf_ev_dict)
+    return events_list
 
 def _ebrite_extract_optional_fields(ev_dict, cf_ev_dict):
     # Going to do a lot of checks for keys, in case of malformed / missing data:
@@ -119,6 +163,14 @@ def _ebrite_extract_optional_fields(ev_dict, cf_ev_dict):
     if u'venue' in ev_dict and u'address' in ev_dict[u'venue']:
         cf_ev_dict['address'] = ev_dict[u'venue'][u'address']
 
+    if u'venue' in ev_dict and u'latitude' in ev_dict[u'venue'] \
+            and u'longitude' in ev_dict[u'venue']:
+        try:
+            cf_ev_dict['latitude'] = float(ev_dict[u'venue'][u'latitude'])
+            cf_ev_dict['longitude'] = float(ev_dict[u'venue'][u'longitude'])
+        except (TypeError, ValueError):
+            cf_ev_dict.pop('latitude', None) # malformed coordinates, ignore
+
 def _discard_tickets_without_price(tickets):
     """
     Takes in a list of tickets {u'ticket': {u'description': u'', ...}}
@@ -1,28 +1,29 @@
 import os
 import urllib2
-from urllib2 import URLError
 import json
 import re
-from xml.dom import minidom
+from StringIO import StringIO
+from xml.etree import cElementTree as ElementTree
 from datetime import datetime
 from cfsite.apps.events.models import MEET, SPORT, ART, FAM
 from cfsite.apps.crawlers.management.commands._errors import SourceRetrievalError
+from cfsite.apps.crawlers.management.commands._fetch import fetch_if_changed
 
 DAYS = ['Mondays','Tuesdays','Wednesdays','Thursdays','Fridays','Saturdays','Sundays']
+_EVENTS_PER_BATCH = 100
 
-def _get_basic_info_assume_pubDate_reliable(event_xml, process_datetime_fn):
+def _get_basic_info_assume_pubDate_reliable(item, process_datetime_fn):
     """
-    Takes in xml for an event and a functional that will be used to cleanup 
-    data in the 'pubDate' element.
+    Takes in an item of the feed (see _iter_items) and a functional that
+    will be used to cleanup data in the 'pubDate' element.
 
     Returns dictionary with name, start_datetime, and description on success, 
     returns None if unable to obtain any one of these mandatory pieces of info
     """
-    try: 
-        name = event_xml.getElementsByTagName('title')[0].firstChild.data
-        description = event_xml.getElementsByTagName('description')[0].firstChild.data
-        start_datetime_str = event_xml.getElementsByTagName('pubDate')[0].firstChild.data
-    except IndexError:
+    name = item.get('title')
+    description = item.get('description')
+    start_datetime_str = item.get('pubDate')
+    if not name or not description or not start_datetime_str:
         return None
 
     try:
@@ -34,11 +35,10 @@ def _get_basic_info_assume_pubDate_reliable(event_xml, process_datetime_fn):
                   'description': description}
     return cf_ev_dict
 
-def _get_basic_info_unreliable_pubDate(event_xml, get_datetime_fn):
-    try: 
-        name = event_xml.getElementsByTagName('title')[0].firstChild.data
-        description = event_xml.getElementsByTagName('description')[0].firstChild.data
-    except IndexError:
+def _get_basic_info_unreliable_pubDate(item, get_datetime_fn):
+    name = item.get('title')
+    description = item.get('description')
+    if not name or not description:
         return None
 
     try:
@@ -50,20 +50,23 @@ def _get_basic_info_unreliable_pubDate(event_xml, get_datetime_fn):
                   'description': description}
     return cf_ev_dict
 
-def get_and_parse_paloaltoplayers():
-    xmldoc = _get_xml_doc("http://www.paplayers.org/feed/my-calendar-rss")
+def get_and_parse_paloaltoplayers(): # generator function
+    (response, items) = _get_feed_items("http://www.paplayers.org/feed/my-calendar-rss")
+    if items is None:
+        return # unchanged since last imported
 
-    itemlist = xmldoc.getElementsByTagName('item')
-    event_list = []
-    for item in itemlist:
+    for event_list in _in_batches(_parse_paloaltoplayers(items)):
+        yield event_list
+    response.remember()
+
+def _parse_paloaltoplayers(items): # generator function
+    for item in items:
         cf_ev_dict = _get_basic_info_unreliable_pubDate(item, _extract_datetime_paloaltoplayers)
         if not cf_ev_dict:
             continue
         cf_ev_dict['categories'] = [ART]
         _get_optional_link(item, cf_ev_dict)
-        event_list.append(cf_ev_dict)
-
-    yield event_list
+        yield cf_ev_dict
 
 def _extract_datetime_paloaltoplayers(description):
     """
@@ -116,19 +119,22 @@ def _extract_datetime_paloaltoplayers(description):
         raise ValueError('Could not find time string in expected format')
 
 def get_and_parse_cityofpaloalto(): # generator function
-    xmldoc = _get_xml_doc("http://www.cityofpaloalto.org/custom/whatsnew_rss1.asp")
+    (response, items) = _get_feed_items("http://www.cityofpaloalto.org/custom/whatsnew_rss1.asp")
+    if items is None:
+        return # unchanged since last imported
 
-    itemlist = xmldoc.getElementsByTagName('item')
-    event_list = []
-    for item in itemlist:
+    for event_list in _in_batches(_parse_cityofpaloalto(items)):
+        yield event_list
+    response.remember()
+
+def _parse_cityofpaloalto(items): # generator function
+    for item in items:
         cf_ev_dict = _get_basic_info_assume_pubDate_reliable(item, _convert_to_datetime_cityofpaloalto)
         if not cf_ev_dict:
             continue
         cf_ev_dict['categories'] = [FAM]
         _get_optional_link(item, cf_ev_dict)
-        event_list.append(cf_ev_dict)
-
-    yield event_list
+        yield cf_ev_dict
 
 def _convert_to_datetime_cityofpaloalto(start_datetime_str):
     """
@@ -151,27 +157,28 @@ def get_and_parse_stanford_sport(): # generator function
     website (<--optional, ok if missing)
     Return a list of dicts that contain this info, one dict per event
     """
-    xmldoc = _get_xml_doc("http://www.gostanford.com/rss.dbml?db_oem_id=30600&media=schedules")
+    (response, items) = _get_feed_items("http://www.gostanford.com/rss.dbml?db_oem_id=30600&media=schedules")
+    if items is None:
+        return # unchanged since last imported
 
-    itemlist = xmldoc.getElementsByTagName('item')
-    event_list = []
-    for item in itemlist:
+    for event_list in _in_batches(_parse_stanford_sport(items)):
+        yield event_list
+    response.remember()
+
+def _parse_stanford_sport(items): # generator function
+    for item in items:
         cf_ev_dict = _get_basic_info_assume_pubDate_reliable(item, _convert_to_datetime_stanford_sport)
         if not cf_ev_dict or not "Stanford, CA" in cf_ev_dict['description']: # only show home games
             continue 
         cf_ev_dict['categories'] = [SPORT]
         _get_optional_link(item, cf_ev_dict)
 
-        event_list.append(cf_ev_dict)
-
-    yield event_list
+        yield cf_ev_dict
 
-def _get_optional_link(event_xml, cf_ev_dict):
-    try:
-        url = event_xml.getElementsByTagName('link')[0].firstChild.data
-        cf_ev_dict['url'] = url
-    except IndexError:
-        pass # don't do anything since url was an optional field
+def _get_optional_link(item, cf_ev_dict):
+    if item.get('link'):
+        cf_ev_dict['url'] = item['link']
+    # otherwise don't do anything since url was an optional field
 
 def _convert_to_datetime_stanford_sport(start_datetime_str):
     """
@@ -194,20 +201,66 @@ def _convert_to_datetime_stanford_general(date_str, time_str):
     """
     return datetime.strptime(date_str + ' ' + time_str, "%B %d, %Y %I:%M %p")
 
-def _get_xml_doc(url):
+def _get_feed_items(url):
     """
-    Takes a in a url (string) that there is an xml document at.
+    Takes a in a url (string) that there is an rss feed at.
 
-    Returns the xml.
+    Returns the response (see fetch_if_changed) and an iterator over the
+    items of the feed (see _iter_items), or None instead of the items if
+    the feed did not change since the events it lists were imported.
     """
-    opener = urllib2.build_opener()
-    req = urllib2.Request(url)
-    try:
-        f = opener.open(req)
-    except URLError as e:
-        raise SourceRetrievalError(e.reason)
-    
-    return minidom.parse(f)
+    response = fetch_if_changed(urllib2.build_opener(), url)
+    if response.body is None:
+        return (response, None)
+    return (response, _iter_items(StringIO(response.body)))
+
+def _iter_items(f): # generator function
+    """
+    Reads the rss feed in file f incrementally, and yields each of its
+    items as soon as it is read, as a dict mapping the tags of the
+    elements in the item (without their namespace) to their text. The
+    first element wins when a tag repeats.
+
+    Items are dropped from the tree once read, so that memory use does not
+    grow with the size of the feed.
+    """
+    parents = []
+    for (event, elem) in ElementTree.iterparse(f, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if _local_name(elem.tag) != 'item':
+            continue
+        item = {}
+        for child in elem.iter():
+            if child is not elem:
+                item.setdefault(_local_name(child.tag), child.text)
+        elem.clear()
+        if parents:
+            parents[-1].remove(elem)
+        yield item
+
+def _local_name(tag):
+    """
+    Takes an ElementTree tag, such as {http://purl.org/rss/1.0/}item,
+    returns it without its namespace.
+    """
+    return tag.rsplit('}', 1)[-1]
+
+def _in_batches(cf_ev_dicts): # generator function
+    """
+    Yields the events of cf_ev_dicts in lists of _EVENTS_PER_BATCH, the
+    last one possibly shorter.
+    """
+    event_list = []
+    for cf_ev_dict in cf_ev_dicts:
+        event_list.append(cf_ev_dict)
+        if len(event_list) == _EVENTS_PER_BATCH:
+            yield event_list
+            event_list = []
+    if event_list:
+        yield event_list
 
 def get_and_parse_stanford_general(): # generator function
     """
@@ -217,20 +270,23 @@ def get_and_parse_stanford_general(): # generator function
     Return a list of dicts that contain this info, one dict per event
     """
     
-    xmldoc = _get_xml_doc("http://events.stanford.edu/xml/byCategory/0/rss.xml")
+    (response, items) = _get_feed_items("http://events.stanford.edu/xml/byCategory/0/rss.xml")
+    if items is None:
+        return # unchanged since last imported
 
-    itemlist = xmldoc.getElementsByTagName('item')
-    
+    for event_list in _in_batches(_parse_stanford_general(items)):
+        yield event_list
+    response.remember()
+
+def _parse_stanford_general(items): # generator function
     start_date_pattern = re.compile("(January|February|March|April|May|June|July|August"
                                     "|September|October|November|December)\W\d{1,2}[,\W]+\d{4}")
 
     start_time_pattern = re.compile("\d{1,2}:\d{2}\W(AM|PM)")
-    event_list = []
-    for item in itemlist:
-        try: 
-            name = item.getElementsByTagName('title')[0].firstChild.data
-            description = item.getElementsByTagName('description')[0].firstChild.data
-        except IndexError:
+    for item in items:
+        name = item.get('title')
+        description = item.get('description')
+        if not name or not description:
             continue # move onto the next event
         categories = [ART] # do something smarter with the description
 
@@ -251,6 +307,4 @@ def get_and_parse_stanford_general(): # generator function
 
         _get_optional_link(item, cf_ev_dict)
 
-        event_list.append(cf_ev_dict)
-
-    yield event_list
+        yield cf_ev_dict
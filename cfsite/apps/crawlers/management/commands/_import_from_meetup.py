@@ -1,63 +1,106 @@
 import os
+import math
 import urllib2
-from urllib2 import URLError
 import json
 from datetime import datetime
+from django.conf import settings
 from cfsite.apps.events.models import MEET
-from cfsite.apps.crawlers.management.commands._errors import SourceRetrievalError
+from cfsite.apps.crawlers.management.commands._fetch import fetch_in_order, fetch_if_changed
 
 _MEETUP_KEY = "6865607a3c4b4d7d52946910646fc"
 _EVENTS_PER_PAGE = 100
 
-def get_and_parse_meetup_JSON(): # generator function
+def get_and_parse_meetup_JSON(stderr=None): # generator function
     """
     Get next page's worth of JSON from meetup and extract
     start time, name, category, (<--mandatory, if missing, disregard event)
     end time, price, address, description, website (<--optional, ok if missing)
     Return a list of dicts that contain this info, one dict per event
-    """
 
-    curr_page = 0 # meetup's page offsets start 0, not 1!
-    num_shown_so_far = 0
-    total_items = 0
+    The first page tells how many events there are: the other pages are
+    then fetched CRAWLER_PAGE_FAN_OUT at a time, and still parsed in order.
+    Events skipped because of unexpected info are reported to stderr, if
+    given (the stderr of the command).
+    """
     opener = urllib2.build_opener()
-    while (curr_page == 0) or (num_shown_so_far < total_items):
-        events_list = []
-        req = urllib2.Request(("https://api.meetup.com/2/open_events.json?"
-                               "radius=0.0&city=Palo+Alto&country=us&state=CA"
-                               "&status=upcoming&key=%s&page=%d&offset=%d"
-                               % (_MEETUP_KEY, _EVENTS_PER_PAGE, curr_page)))
-        try:
-        	f = opener.open(req)
-        except URLError as e:
-        	raise SourceRetrievalError(e.reason)
-        	
-        meetup_events_dict = json.load(f)
-        if 'problem' in meetup_events_dict:
+    (response, meetup_events_dict) = _get_meetup_page(opener, 0) # meetup's page offsets start 0, not 1!
+    if meetup_events_dict is None: # unchanged since last imported
+        total_items = response.info
+    else:
+        total_items = _get_meetup_total_count(meetup_events_dict)
+    if total_items is None:
+        return
+    if meetup_events_dict is not None:
+        yield _parse_meetup_page(meetup_events_dict, stderr)
+        response.remember(total_items) # needed to page through, when unchanged
+
+    page_count = int(math.ceil(float(total_items) / _EVENTS_PER_PAGE))
+    pages = fetch_in_order(lambda page: _get_meetup_page(opener, page),
+                           range(1, page_count),
+                           settings.CRAWLER_PAGE_FAN_OUT)
+    for (response, meetup_events_dict) in pages:
+        if meetup_events_dict is None:
+            continue # unchanged since last imported
+        if _get_meetup_total_count(meetup_events_dict) is None:
             break
+        yield _parse_meetup_page(meetup_events_dict, stderr)
+        response.remember()
 
+def _get_meetup_page(opener, page):
+    """
+    Fetches a page of events from meetup, pages starting at 0.
+    Returns the response (see fetch_if_changed) and the decoded JSON, or
+    None instead of the JSON if the page did not change since its events
+    were imported.
+    """
+    response = fetch_if_changed(opener, (
+        "https://api.meetup.com/2/open_events.json?"
+        "radius=0.0&city=Palo+Alto&country=us&state=CA"
+        "&status=upcoming&key=%s&page=%d&offset=%d"
+        % (_MEETUP_KEY, _EVENTS_PER_PAGE, page)))
+    if response.body is None:
+        return (response, None)
+    return (response, json.loads(response.body))
+
+def _get_meetup_total_count(meetup_events_dict):
+    """
+    Returns the total number of events told by a page from meetup,
+    or None if the page is an error.
+    """
+    if 'problem' in meetup_events_dict:
+        return None
+    try:
+        return meetup_events_dict['meta']['total_count']
+    except KeyError:
+        return None
+
+def _parse_meetup_page(meetup_events_dict, stderr=None):
+    """
+    Returns the list of events, as dicts, of a page from meetup.
+    Events missing mandatory info are skipped. Events whose optional info
+    is not what we expect are skipped too, with a warning written to
+    stderr, if given.
+    """
+    events_list = []
+    for ev_dict in meetup_events_dict.get('results', []):
         try:
-            total_items = meetup_events_dict['meta']['total_count']
-            num_showing = meetup_events_dict['meta']['count']
-            num_shown_so_far += num_showing
+            name = ev_dict['name']
+            categories = [MEET] # TODO categorize better
+            start_datetime = datetime.fromtimestamp(
+                float(ev_dict['time'])/1000.0)
         except KeyError:
-            break
-
-        for ev_dict in meetup_events_dict['results']:
-            try:
-                name = ev_dict['name']
-                categories = [MEET] # TODO categorize better
-                start_datetime = datetime.fromtimestamp(
-                    float(ev_dict['time'])/1000.0)
-            except KeyError:
-                continue
-            cf_ev_dict = {'name':name, 'categories':categories,
-                          'start_datetime':start_datetime}
+            continue
+        cf_ev_dict = {'name':name, 'categories':categories,
+                      'start_datetime':start_datetime}
+        try:
             _meetup_extract_optional_fields(ev_dict, cf_ev_dict)
-            events_list.append(cf_ev_dict)
-
-        curr_page +=1
-        yield events_list
+        except (KeyError, TypeError, ValueError) as e:
+            if stderr is not None:
+                stderr.write('Skipping meetup event %r, unexpected '
+                             'optional info: %r' % (name, e))
+            continue
+        events_list.append(cf_ev_dict)
+    return events_list
 
 def _meetup_extract_optional_fields(ev_dict, cf_ev_dict):
     # No KeyErrors should occur
@@ -86,4 +129,9 @@ def _meetup_extract_optional_fields(ev_dict, cf_ev_dict):
             if 'address_3' in ev_dict['venue']:
                 address += ev_dict['venue']['address_3']
             if len(address) > 0:
-                cf_ev_dict['address'] = address
\ No newline at end of file
+                cf_ev_dict['address'] = address
+            if 'lat' in ev_dict['venue'] and 'lon' in ev_dict['venue']:
+                # Meetup sends 0, 0 for venues it could not locate
+                if ev_dict['venue']['lat'] or ev_dict['venue']['lon']:
+                    cf_ev_dict['latitude'] = float(ev_dict['venue']['lat'])
+                    cf_ev_dict['longitude'] = float(ev_dict['venue']['lon'])
\ No newline at end of file
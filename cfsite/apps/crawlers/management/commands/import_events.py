@@ -1,9 +1,11 @@
 # for command and option parsing
+import threading
+from Queue import Queue
 from optparse import make_option
 from django.core.management.base import BaseCommand, CommandError
 
 # for event retrieval and saving
-from cfsite.apps.events.models import Event, Location, Category, MAX_DESCRIPTION_LEN, MAX_NAME_LEN
+from cfsite.apps.events.models import Event, Location, Category, GeocodedAddress, MAX_DESCRIPTION_LEN, MAX_NAME_LEN
 from cfsite.apps.crawlers.deduplication import SimpleDeduplicator
 from cfsite.apps.crawlers.management.commands._import_from_feeds \
     import get_and_parse_stanford_general, get_and_parse_stanford_sport, get_and_parse_cityofpaloalto, \
@@ -26,6 +28,9 @@ class Command(BaseCommand):
     """
     help = 'Pulls events from various apis and feeds and adds to database'
 
+    # Number of sources fetched and parsed at the same time by default.
+    DEFAULT_WORKERS = 6
+
     SOURCE_TYPES = ['api', 'feed']
     API_SOURCES = ['ebrite','meetup']
     FEED_SOURCES = ['stanford-general', 'stanford-sport', 'cityofpaloalto', 'paloaltoplayers']
@@ -49,13 +54,22 @@ class Command(BaseCommand):
             type='string',
             help='Which sources to pull from. '
                  'Choices are %s' % (' '.join(FEED_SOURCES)),
-            )
+            ),
+        make_option('--workers',
+            action='store',
+            type='int',
+            default=DEFAULT_WORKERS,
+            help='How many sources to pull from at the same time. '
+                 'Defaults to %d' % DEFAULT_WORKERS),
         )
 
     def handle(self, *args, **options):
         source_list = options.get('sources')
         source_type = options.get('source_type')
         source_generators = self.SOURCES # default to all sources
+        workers = options.get('workers') or self.DEFAULT_WORKERS
+        if workers < 1:
+            raise CommandError("--workers must be at least 1")
         if source_list and source_type:
             raise SourceRetrievalError("Cannot simultaneously specify both sources and source_type")
         elif source_list:
@@ -69,14 +83,20 @@ class Command(BaseCommand):
             else:
                 raise SourceRetrievalError("Unrecognized source_type: %s" % source_type)
 
-        self._import_events(self._get_sources_generators(source_generators))
+        self._import_events(self._get_sources_generators(source_generators),
+                            workers)
 
     def _get_sources_generators(self, sources_str_list):
         """
         Takes a list of strings specifying the sources.
-        Returns a list of generators that yield data from those sources.
+        Returns a list of (source name, generator) pairs, the generators
+        yielding data from those sources. The API sources write the events
+        they skip to self.stderr.
         """
-        return [self.SOURCE_TO_GEN[source_str]() for source_str in sources_str_list]
+        return [(source_str, self.SOURCE_TO_GEN[source_str](stderr=self.stderr)
+                 if source_str in self.API_SOURCES
+                 else self.SOURCE_TO_GEN[source_str]())
+                for source_str in sources_str_list]
 
     def _validate_and_parse_into_list(self,sources_str):
         """
@@ -125,6 +145,7 @@ class Command(BaseCommand):
                 self.stdout.write('Description len: %s' % len(ev.description))
             if 'address' in event_dict:
                 ev.address = event_dict['address']
+            self._set_coordinates(ev, event_dict)
 
             if (SimpleDeduplicator.is_duplicate(ev)):
                 self.stdout.write('Skipping duplicate...')
@@ -138,12 +159,86 @@ class Command(BaseCommand):
                 except DataError:
                     pass # could not save event, probably some field is too long for our db. skip
 
-    def _import_events(self, sources_generators):
-        for gen in sources_generators:
-            try:
-                while True:
-                    self._save_event_model(next(gen))
-            except StopIteration:
-                self.stdout.write('...Finished pulling from one data source') # TODO (susanctu): in future, maybe we want to print some stats
+    def _set_coordinates(self, ev, event_dict):
+        """
+        Sets the coordinates of an event. Coordinates sent by the source are
+        recorded in the local geocoding table, so that other events at the
+        same address (from sources without coordinates) can be geocoded
+        from it, offline.
+        """
+        address = event_dict.get('address')
+        if 'latitude' in event_dict and 'longitude' in event_dict:
+            ev.latitude = event_dict['latitude']
+            ev.longitude = event_dict['longitude']
+            if address:
+                GeocodedAddress.objects.remember(address, ev.latitude, ev.longitude,
+                                                 source='import_events')
+        elif address:
+            coordinates = GeocodedAddress.objects.geocode(address)
+            if coordinates:
+                (ev.latitude, ev.longitude) = coordinates
+
+    def _import_events(self, sources_generators, workers=DEFAULT_WORKERS):
+        """
+        Pulls events from all the sources, at most workers of them at the
+        same time, and saves them as they come.
+
+        Sources are fetched and parsed by a pool of threads, since they
+        spend most of their time waiting for the network: a full import
+        takes about as long as the slowest source. The events are only
+        saved by the calling thread, one batch at a time, so that the
+        deduplication always sees the events saved before and the
+        database connection is never shared. A source only resumes once
+        its last batch is saved, since it may then remember that its
+        events were imported (see _fetch.fetch_if_changed).
+        Raises CommandError once all the other sources are imported if
+        any source failed.
+        """
+        sources = Queue()
+        for (name, gen) in sources_generators:
+            sources.put((name, gen))
+        batches = Queue()
 
+        def fetch():
+            while True:
+                (name, gen) = sources.get()
+                if gen is None:
+                    return
+                error = None
+                try:
+                    for event_list in gen:
+                        saved = threading.Event()
+                        batches.put((name, event_list, saved))
+                        saved.wait()
+                except Exception as e:
+                    error = e
+                batches.put((name, None, error))
 
+        threads = [threading.Thread(target=fetch)
+                   for unused_i in range(min(workers, len(sources_generators)))]
+        for thread in threads:
+            sources.put((None, None))
+            thread.daemon = True
+            thread.start()
+
+        failed_sources = []
+        remaining = len(sources_generators)
+        while remaining:
+            # Batches come with an event to set once saved, the end of
+            # sources with the error they failed with, if any.
+            (name, event_list, saved_or_error) = batches.get()
+            if event_list is not None:
+                self._save_event_model(event_list)
+                saved_or_error.set()
+                continue
+            error = saved_or_error
+            remaining -= 1
+            if error is None:
+                self.stdout.write('...Finished pulling from %s' % name) # TODO (susanctu): in future, maybe we want to print some stats
+            else:
+                self.stderr.write('...Failed pulling from %s: %r' % (name, error))
+                failed_sources.append(name)
+        for thread in threads:
+            thread.join()
+        if failed_sources:
+            raise CommandError('Could not pull from %s' % ', '.join(failed_sources))
@@ -1,7 +1,21 @@
+from django.core.management.base import CommandError
 from django.test import TestCase
+from django.test.utils import override_settings
 from cfsite.apps.crawlers.deduplication import SimpleDeduplicator
+from cfsite.apps.crawlers.management.commands.import_events import Command
+from cfsite.apps.crawlers.management.commands._fetch import fetch_in_order, fetch_if_changed
+from cfsite.apps.crawlers.management.commands._import_from_ebrite import _parse_eventbrite_page
+from cfsite.apps.crawlers.management.commands._import_from_meetup import _parse_meetup_page
+from cfsite.apps.crawlers.management.commands._import_from_feeds import _iter_items
 from cfsite.apps.events.models import Location, Category, Event
-from datetime import datetime
+from datetime import datetime, timedelta
+from StringIO import StringIO
+from urllib2 import HTTPError
+import mimetools
+import shutil
+import tempfile
+import threading
+import time
  
 class OneEventInDbDeduplicationTestCase(TestCase):
     def setUp(self):
@@ -54,3 +68,207 @@ class OneEventInDbDeduplicationTestCase(TestCase):
         #    [(ev,'dummy metadata')])
 
 
+class ConcurrentImportTestCase(TestCase):
+    def setUp(self):
+        self.command = Command()
+        self.command.stdout = StringIO()
+        self.command.stderr = StringIO()
+
+    def test_import_all_sources(self):
+        """
+        _import_events saves the events of every source, whatever the
+        number of workers
+        """
+        for workers in (1, 2, 5):
+            Event.objects.all().delete()
+            self.command._import_events(
+                [('source%d' % i, self.fake_source(i, 3)) for i in range(4)],
+                workers)
+            self.assertEqual(Event.objects.count(), 4 * 3)
+
+    def test_failed_source(self):
+        """
+        _import_events saves the events of the other sources before
+        reporting a source which failed
+        """
+        def failing_source():
+            yield [self.fake_event_dict(9, 0)]
+            raise IOError('feed unavailable')
+        with self.assertRaises(CommandError):
+            self.command._import_events(
+                [('failing', failing_source()), ('ok', self.fake_source(0, 2))],
+                2)
+        self.assertEqual(Event.objects.count(), 3)
+        self.assertIn('failing', self.command.stderr.getvalue())
+
+    def fake_source(self, source, batch_count):
+        """Returns a dummy source generator, yielding batches of one event."""
+        for batch in range(batch_count):
+            yield [self.fake_event_dict(source, batch)]
+
+    def fake_event_dict(self, source, batch):
+        """Returns a dummy event, as parsed from a source."""
+        return {
+            'name': 'dummy event %d-%d' % (source, batch),
+            'start_datetime': datetime(2030, 1, 1, 10) + timedelta(hours=batch),
+            'categories': [],
+            }
+
+
+class FetchInOrderTestCase(TestCase):
+    def test_results_in_order(self):
+        """
+        fetch_in_order yields the results in the order of the arguments,
+        with no more than fan_out calls running at the same time
+        """
+        lock = threading.Lock()
+        running = [0, 0] # running now, most running at once
+        def fetch(page):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01 * (page % 3))
+            with lock:
+                running[0] -= 1
+            return page * 10
+        self.assertEqual(list(fetch_in_order(fetch, range(10), 3)),
+                         [page * 10 for page in range(10)])
+        self.assert_(1 <= running[1] <= 3)
+
+    def test_error(self):
+        """
+        fetch_in_order raises the error of a call once its result is due
+        """
+        def fetch(page):
+            if page == 2:
+                raise IOError('page unavailable')
+            return page
+        pages = fetch_in_order(fetch, range(5), 2)
+        self.assertEqual([next(pages), next(pages)], [0, 1])
+        self.assertRaises(IOError, next, pages)
+
+
+class FetchIfChangedTestCase(TestCase):
+    URL = 'http://example.com/feed.rss'
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            CRAWLER_HTTP_CACHE_DIR=self.cache_dir)
+        self.settings_override.enable()
+        self.requests = []
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.cache_dir)
+
+    def test_unchanged_body(self):
+        """
+        fetch_if_changed only returns the body of a url once it changed
+        since it was last remembered
+        """
+        response = fetch_if_changed(self.fake_opener('<rss/>'), self.URL)
+        self.assertEqual(response.body, '<rss/>')
+        # not remembered yet, e.g. the import failed
+        response = fetch_if_changed(self.fake_opener('<rss/>'), self.URL)
+        self.assertEqual(response.body, '<rss/>')
+        response.remember(42)
+
+        response = fetch_if_changed(self.fake_opener('<rss/>'), self.URL)
+        self.assertEqual(response.body, None)
+        self.assertEqual(response.info, 42)
+        self.assertEqual(self.requests[-1].get_header('If-none-match'), '"v1"')
+        response = fetch_if_changed(self.fake_opener('<rss></rss>'), self.URL)
+        self.assertEqual(response.body, '<rss></rss>')
+
+    def test_not_modified(self):
+        """
+        fetch_if_changed reports a url answering 304 Not Modified as
+        unchanged
+        """
+        fetch_if_changed(self.fake_opener('<rss/>'), self.URL).remember()
+        response = fetch_if_changed(self.fake_opener(None), self.URL)
+        self.assertEqual(response.body, None)
+
+    def fake_opener(self, body):
+        """
+        Returns a dummy opener answering body, or 304 Not Modified if body
+        is None.
+        """
+        test_case = self
+        class FakeOpener(object):
+            def open(self, req):
+                test_case.requests.append(req)
+                headers = mimetools.Message(StringIO(
+                    'ETag: "v1"\r\nLast-Modified: Sat, 25 Jan 2014 19:00:00 GMT\r\n\r\n'))
+                if body is None:
+                    raise HTTPError(req.get_full_url(), 304, 'Not Modified',
+                                    headers, None)
+                f = StringIO(body)
+                f.info = lambda: headers
+                return f
+        return FakeOpener()
+
+
+class IterItemsTestCase(TestCase):
+    RSS1_FEED = (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"'
+        ' xmlns="http://purl.org/rss/1.0/">'
+        '<channel><title>Feed</title></channel>'
+        '<item><title>Concert</title><description><![CDATA[<b>Music</b>]]>'
+        '</description><link>http://example.com/1</link></item>'
+        '<item><title>Play</title><description/></item>'
+        '</rdf:RDF>')
+
+    def test_items(self):
+        """
+        _iter_items yields the text of the elements of each item, without
+        their namespace
+        """
+        items = list(_iter_items(StringIO(self.RSS1_FEED)))
+        self.assertEqual(items, [
+            {'title': 'Concert', 'description': '<b>Music</b>',
+             'link': 'http://example.com/1'},
+            {'title': 'Play', 'description': None}])
+
+
+class ParseApiPagesTestCase(TestCase):
+    def test_eventbrite_page(self):
+        """
+        Events missing mandatory info are skipped, events with unexpected
+        optional info are skipped with a warning
+        """
+        page = {u'events': [
+            {u'summary': {u'total_items': 2, u'num_showing': 2}},
+            {u'event': {u'title': u'Concert', u'category': u'music',
+                        u'start_date': u'2030-01-01 10:00:00',
+                        u'tickets': [{u'ticket': {u'price': u'1,000.00'}}]}},
+            {u'event': {u'title': u'No date', u'category': u'music'}}]}
+        events = _parse_eventbrite_page(page, 2)
+        self.assertEqual([(ev['name'], ev['price']) for ev in events],
+                         [(u'Concert', 1000.0)])
+        page[u'events'][1][u'event'][u'tickets'] = [{u'price': u'10.00'}]
+        stderr = StringIO()
+        self.assertEqual(_parse_eventbrite_page(page, 2, stderr), [])
+        self.assertIn('Concert', stderr.getvalue())
+
+    def test_meetup_page(self):
+        """
+        Events missing mandatory info are skipped, events with unexpected
+        optional info are skipped with a warning
+        """
+        page = {'results': [
+            {'name': u'Meetup', 'time': 1893492000000,
+             'fee': {'amount': 5}},
+            {'name': u'No time'}]}
+        events = _parse_meetup_page(page)
+        self.assertEqual([(ev['name'], ev['price']) for ev in events],
+                         [(u'Meetup', 5.0)])
+        page['results'].append({'name': u'Other meetup',
+                                'time': 1893492000000})
+        page['results'][0]['fee']['amount'] = u'five dollars'
+        stderr = StringIO()
+        events = _parse_meetup_page(page, stderr)
+        self.assertEqual([ev['name'] for ev in events], [u'Other meetup'])
+        self.assertIn('Meetup', stderr.getvalue())
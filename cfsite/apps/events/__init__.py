@@ -0,0 +1,7 @@
+# Connect the signal receivers which keep the in-memory and cached data in
+# sync with the database. Any import of a module of this app imports the
+# package first, so the receivers are connected wherever the models are used:
+# web processes, management commands such as import_events, and tests.
+# models.py must not import signals: signals imports the registries, the
+# search cache and the suggestion index, which all import the models.
+from cfsite.apps.events import signals
@@ -4,7 +4,9 @@ __status__ = "Prototype"
 
 from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
-from cfsite.apps.events.models import Event, Location, Category
+from cfsite.apps.events.models import Event, Location, Category, \
+    GeocodedAddress
+from cfsite.apps.events.registry import facet_registry
 
 
 class LocationAdmin(admin.ModelAdmin):
@@ -33,7 +35,8 @@ class CategoryFilter(SimpleListFilter):
     """ CategoryFilter
     ----------
     Custom filter list for displaying the different events
-    filtered by category type.
+    filtered by category type. Categories sharing the same base name are
+    offered as a single choice, taken from the facet registry.
 
     """
     # Title displayed in the right admin sidebar
@@ -54,8 +57,7 @@ class CategoryFilter(SimpleListFilter):
         @type model_admin: ModelAdmin
 
         """
-        categories = set([c for c in Category.objects.all()])
-        return [(c.id, c.__unicode__) for c in categories]
+        return [(name, name) for name in facet_registry.get_category_names()]
 
     def queryset(self, request, queryset):
         """ 
@@ -70,7 +72,8 @@ class CategoryFilter(SimpleListFilter):
         @rtype: queryset
         """
         if self.value():
-            return queryset.filter(category__id__exact=self.value())
+            return queryset.filter(
+                category__base_name=self.value()).distinct()
         else:
             return queryset
 
@@ -88,8 +91,31 @@ class EventAdmin(admin.ModelAdmin):
     ordering = ('-event_start_date',)
     search_fields = ('category', 'event_start_date', 'location',)
 
+    def get_queryset(self, request):
+        """ EventAdmin.get_queryset(request)
+        ----------
+        Loads the categories and the location of the listed events along with
+        them, instead of with one query per event and column.
+
+        """
+        return super(EventAdmin, self).get_queryset(request).select_related(
+            'event_location').prefetch_related('category')
+
+
+class GeocodedAddressAdmin(admin.ModelAdmin):
+    """ GeocodedAddressAdmin
+    ----------
+    Basic administrative model for the local geocoding table in the admin
+    panel.
+
+    """
+    list_display = ('address', 'latitude', 'longitude', 'source')
+    ordering = ('address',)
+    search_fields = ('address',)
+
 
 # Register the models here.
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Location, LocationAdmin)
 admin.site.register(Event, EventAdmin)
+admin.site.register(GeocodedAddress, GeocodedAddressAdmin)
@@ -0,0 +1,619 @@
+import datetime
+import math
+import random
+import resource
+import time
+from django.core.cache import get_cache
+from django.core.management.color import no_style
+from django.db import connection, reset_queries, transaction
+from django.db.models import Max
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from cfsite.apps.events.models import Event, DayEvent, Location, Category, \
+    CF_CATEGORIES, MAX_DESCRIPTION_LEN, MUSIC, SPORT, ART, FOOD
+from cfsite.apps.events import search_cache
+from cfsite.apps.events.fulltext import get_fulltext_index
+from cfsite.apps.events.geo import get_geo_cell
+from cfsite.apps.events.suggest import PrefixTrie
+from cfsite.apps.events.views import calculate_timeline_data, \
+    calculate_bounds_time_data, time_to_percentage, \
+    duration_from_start_end_time, format_sr_data_from_event_list
+
+# Benchmark events are spread over a year, starting on this date.
+BENCHMARK_START_DATE = datetime.date(2014, 1, 1)
+BENCHMARK_DAYS = 365
+
+# Benchmark event names and descriptions are made of these 10000 made up
+# words. Like in real text, a few words are frequent and most are rare: the
+# first words of the list are drawn much more often than the last ones.
+_SYLLABLES = ['ba', 'ko', 'ri', 'zu', 'me', 'ta', 'lo', 'vi', 'sa', 'ne']
+BENCHMARK_WORDS = [a + b + c + d for a in _SYLLABLES for b in _SYLLABLES
+                   for c in _SYLLABLES for d in _SYLLABLES]
+# Keywords of the benchmark: a typical word, found in about 0.1% of the
+# events, and a frequent one, found in about 2% of them.
+BENCHMARK_KEYWORDS = [BENCHMARK_WORDS[1000], BENCHMARK_WORDS[10]]
+
+# Sub-categories of the synthetic events, besides the base categories.
+SYNTHETIC_SUB_CATEGORIES = [(MUSIC, 'jazz'), (MUSIC, 'rock'),
+                            (SPORT, 'running'), (ART, 'theater'),
+                            (FOOD, 'wine tasting')]
+
+# Venues of the synthetic events with coordinates are scattered around this
+# point, in Palo Alto.
+SYNTHETIC_LATITUDE = 37.4419
+SYNTHETIC_LONGITUDE = -122.1430
+
+
+def get_benchmark_locations():
+    """ get_benchmark_locations()
+    ----------
+    Returns the locations the benchmark events take place in, creating them
+    if needed.
+
+    @rtype: [Location]
+    """
+    return [
+        Location.objects.get_or_create(city='Palo Alto', state_province='CA',
+                                       zip_code=94303, country='United States',
+                                       timezone='US/Pacific')[0],
+        Location.objects.get_or_create(city='Stanford', state_province='CA',
+                                       zip_code=94305, country='United States',
+                                       timezone='US/Pacific')[0],
+    ]
+
+
+def get_benchmark_word(rng):
+    """ get_benchmark_word(rng)
+    ----------
+    Draws one of the BENCHMARK_WORDS, the first ones being the most frequent.
+
+    @type rng: random.Random
+    @rtype: str
+    """
+    return BENCHMARK_WORDS[int(len(BENCHMARK_WORDS) * rng.random() ** 3)]
+
+
+def create_benchmark_events(count, seed=0):
+    """ create_benchmark_events(count, seed=0)
+    ----------
+    Bulk inserts count simple events, spread over BENCHMARK_DAYS days and the
+    benchmark locations, along with their DayEvents and their full text index
+    entries. About one event in twenty is invalid.
+    Events are inserted without calling Event.save(), so their derived fields
+    are not computed.
+
+    @param count: number of events to insert
+    @type count: int
+
+    @param seed: seed of the random generator, so that runs are reproducible.
+    @type seed: int
+    """
+    rng = random.Random(seed)
+    locations = get_benchmark_locations()
+    batch_size = 5000
+    # IDs are set explicitly, bulk_create does not return them. The ID
+    # sequence is moved past them afterwards.
+    first_id = (Event.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+    fulltext_index = get_fulltext_index()
+    with transaction.atomic():
+        for batch_start in range(0, count, batch_size):
+            events = []
+            for i in range(batch_start, min(count, batch_start + batch_size)):
+                start_date = BENCHMARK_START_DATE + datetime.timedelta(
+                    days=rng.randrange(BENCHMARK_DAYS))
+                start_time = datetime.time(rng.randint(8, 21),
+                                           rng.choice([0, 15, 30, 45]))
+                events.append(Event(
+                    id=first_id + i,
+                    name='%s %s %d' % (get_benchmark_word(rng),
+                                       get_benchmark_word(rng), i),
+                    description=' '.join(get_benchmark_word(rng)
+                                         for j in range(5)),
+                    event_location=rng.choice(locations),
+                    event_start_date=start_date,
+                    event_end_date=start_date,
+                    event_start_time=start_time,
+                    event_end_time=start_time.replace(
+                        hour=min(23, start_time.hour + rng.randint(1, 3))),
+                    is_valid_event=rng.random() > 0.05))
+            Event.objects.bulk_create(events)
+            DayEvent.objects.bulk_create([
+                day_event for event in events for day_event in
+                DayEvent.objects.build_for_event(event, category_ids=[])])
+            fulltext_index.index_events(connection.cursor(), events)
+        reset_event_id_sequence()
+
+
+def reset_event_id_sequence():
+    """ reset_event_id_sequence()
+    ----------
+    Moves the sequence of the event IDs past the highest event ID, after
+    events were inserted with explicit IDs, so that the events saved next
+    get fresh IDs. Does nothing on databases without sequences.
+    """
+    cursor = connection.cursor()
+    for sql in connection.ops.sequence_reset_sql(no_style(), [Event]):
+        cursor.execute(sql)
+
+
+def get_synthetic_categories():
+    """ get_synthetic_categories()
+    ----------
+    Returns the categories of the synthetic events: all the base categories
+    and a few sub-categories, creating them if needed.
+
+    @rtype: [Category]
+    """
+    return [Category.objects.get_or_create(base_name=base_name,
+                                           sub_category=sub_category)[0]
+            for (base_name, sub_category) in
+            [(base_name, '') for base_name in CF_CATEGORIES] +
+            SYNTHETIC_SUB_CATEGORIES]
+
+
+def make_synthetic_description(rng):
+    """ make_synthetic_description(rng)
+    ----------
+    Returns a random event description, like the ones found in the crawled
+    feeds: one in ten is empty, the others are from ten to a thousand words
+    long, as plain text paragraphs, HTML, or HTML with images.
+
+    @type rng: random.Random
+    @rtype: str
+    """
+    kind = rng.random()
+    if kind < 0.1:
+        return ''
+    n_words = int(10 * 100 ** rng.random())
+    words = [get_benchmark_word(rng) for i in range(n_words)]
+    paragraphs = [' '.join(words[i:i + 40]) for i in range(0, n_words, 40)]
+    if kind < 0.55:
+        description = '\n'.join(paragraphs)
+    elif kind < 0.9:
+        description = ''.join('<p>%s <b>%s</b> <a href="http://example.com/'
+                              '%s">%s</a></p>' % (p, words[0], words[-1],
+                                                  words[-1])
+                              for p in paragraphs)
+    else:
+        description = ''.join('<p>%s</p>' % p for p in paragraphs) + \
+            '<p><img src="http://example.com/%s.png"></p>' % words[0]
+    return description[:MAX_DESCRIPTION_LEN]
+
+
+def make_synthetic_event(rng, event_id, locations):
+    """ make_synthetic_event(rng, event_id, locations)
+    ----------
+    Returns an unsaved random event, with its derived fields computed.
+    Most events last a few hours, some have no end time or end after
+    midnight, and some run for several days or weeks. Most of them have
+    coordinates, and about one in twenty is invalid.
+
+    @type rng: random.Random
+
+    @param event_id: ID of the event
+    @type event_id: int
+
+    @param locations: locations to choose the event location from
+    @type locations: [Location]
+
+    @rtype: Event
+    """
+    start_date = BENCHMARK_START_DATE + datetime.timedelta(
+        days=rng.randrange(BENCHMARK_DAYS))
+    start_time = datetime.time(rng.randint(7, 22), rng.choice([0, 15, 30, 45]))
+    end_date = None
+    end_time = None
+    span = rng.random()
+    if span < 0.08:
+        end_date = start_date + datetime.timedelta(days=rng.randint(1, 3))
+    elif span < 0.1:
+        end_date = start_date + datetime.timedelta(days=rng.randint(4, 13))
+    elif span < 0.15:
+        # Ends after midnight.
+        end_date = start_date + datetime.timedelta(days=1)
+        end_time = datetime.time(rng.randint(0, 3), 0)
+    if span < 0.15 or rng.random() < 0.85:
+        end_time = end_time or start_time.replace(
+            hour=min(23, start_time.hour + rng.randint(1, 4)))
+
+    event = Event(
+        id=event_id,
+        name='%s %s %d' % (get_benchmark_word(rng).capitalize(),
+                           get_benchmark_word(rng), event_id),
+        description=make_synthetic_description(rng),
+        event_location=rng.choice(locations),
+        website='http://example.com/events/%d' % event_id,
+        event_start_date=start_date,
+        event_end_date=end_date,
+        event_start_time=start_time,
+        event_end_time=end_time,
+        price=rng.choice([None, None, 0, 5, 10, 15, 20, 35, 50]),
+        is_valid_event=rng.random() > 0.05)
+    if rng.random() < 0.7:
+        event.latitude = SYNTHETIC_LATITUDE + rng.uniform(-0.1, 0.1)
+        event.longitude = SYNTHETIC_LONGITUDE + rng.uniform(-0.1, 0.1)
+        event.geo_cell = get_geo_cell(event.latitude, event.longitude)
+    event.format_description()
+    return event
+
+
+def create_synthetic_events(count, seed=0, stdout=None):
+    """ create_synthetic_events(count, seed=0, stdout=None)
+    ----------
+    Bulk inserts count realistic events (see make_synthetic_event), spread
+    over BENCHMARK_DAYS days, the benchmark locations and the synthetic
+    categories, along with their categories, their DayEvents and their full
+    text index entries. Events are inserted in batches, so that memory use
+    does not grow with count.
+    Search results cached for the days of the events are invalidated.
+
+    @param count: number of events to insert
+    @type count: int
+
+    @param seed: seed of the random generator, so that runs are reproducible.
+    @type seed: int
+
+    @param stdout: stream progress is written to, optional.
+    """
+    rng = random.Random(seed)
+    locations = get_benchmark_locations()
+    categories = get_synthetic_categories()
+    event_category = Event.category.through
+    batch_size = 2000
+    # IDs are set explicitly, bulk_create does not return them. The ID
+    # sequence is moved past them afterwards.
+    first_id = (Event.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+    fulltext_index = get_fulltext_index()
+    for batch_start in range(0, count, batch_size):
+        events = [make_synthetic_event(rng, first_id + i, locations)
+                  for i in range(batch_start,
+                                 min(count, batch_start + batch_size))]
+        with transaction.atomic():
+            Event.objects.bulk_create(events)
+            event_categories = []
+            day_events = []
+            for event in events:
+                category_ids = [category.id for category in rng.sample(
+                    categories, 2 if rng.random() < 0.1 else 1)]
+                event_categories += [event_category(event_id=event.id,
+                                                    category_id=category_id)
+                                     for category_id in category_ids]
+                day_events += DayEvent.objects.build_for_event(event,
+                                                               category_ids)
+            event_category.objects.bulk_create(event_categories)
+            DayEvent.objects.bulk_create(day_events)
+            fulltext_index.index_events(connection.cursor(), events)
+            reset_event_id_sequence()
+        if stdout is not None:
+            stdout.write('%d events created' % (batch_start + len(events)))
+    search_cache.invalidate_all()
+
+
+def time_calls(func, repeat=20):
+    """ time_calls(func, repeat=20)
+    ----------
+    Calls func repeat times and returns the durations of the calls.
+
+    @return: durations, in milliseconds, in increasing order.
+    @rtype: [float]
+    """
+    durations = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        durations.append((time.time() - start) * 1000)
+    durations.sort()
+    return durations
+
+
+def time_call(func, repeat=20):
+    """ time_call(func, repeat=20)
+    ----------
+    Calls func repeat times and returns the median duration of a call.
+
+    @return: median duration, in milliseconds.
+    @rtype: float
+    """
+    durations = time_calls(func, repeat)
+    return durations[len(durations) // 2]
+
+
+def get_percentile(durations, percent):
+    """ get_percentile(durations, percent)
+    ----------
+    Returns the nearest-rank percentile of durations.
+
+    @param durations: durations in increasing order, as returned by
+           time_calls.
+    @type durations: [float]
+
+    @param percent: the percentile, between 0 and 100
+    @type percent: int
+
+    @rtype: float
+    """
+    rank = int(math.ceil(percent / 100.0 * len(durations)))
+    return durations[max(rank, 1) - 1]
+
+
+def get_peak_memory():
+    """ get_peak_memory()
+    ----------
+    Returns the peak resident memory of the process so far, in megabytes.
+    Linux reports it in kilobytes.
+
+    @rtype: float
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def benchmark_search_query(sizes, stdout):
+    """ benchmark_search_query(sizes, stdout)
+    ----------
+    Measures how long EventManager.search_for_events takes to return the
+    events of one day, as the events table grows to each of the sizes.
+    Results are written to stdout.
+
+    @param sizes: sizes of the events table, in increasing order.
+    @type sizes: [int]
+    """
+    location = get_benchmark_locations()[0]
+    date = BENCHMARK_START_DATE + datetime.timedelta(days=BENCHMARK_DAYS // 2)
+    stdout.write('search_for_events, one day of events:')
+    for size in sizes:
+        create_benchmark_events(size - Event.objects.count(), seed=size)
+        n_results = len(Event.objects.search_for_events(date, location.id))
+        duration = time_call(
+            lambda: list(Event.objects.search_for_events(date, location.id)))
+        stdout.write('%9d events: %8.2f ms (%d results)'
+                     % (size, duration, n_results))
+
+
+def benchmark_keyword_search(sizes, stdout):
+    """ benchmark_keyword_search(sizes, stdout)
+    ----------
+    Measures how long the full text index takes to find the events matching
+    each of the BENCHMARK_KEYWORDS, alone and restricted to one day and
+    location, as the events table grows to each of the sizes. The time
+    EventManager.search_by_keyword takes to also fetch the events, and the
+    full table scan of a name__icontains count, are measured for comparison.
+    Results are written to stdout.
+
+    @param sizes: sizes of the events table, in increasing order.
+    @type sizes: [int]
+    """
+    location = get_benchmark_locations()[0]
+    date = BENCHMARK_START_DATE + datetime.timedelta(days=BENCHMARK_DAYS // 2)
+    fulltext_index = get_fulltext_index()
+    stdout.write('keyword search: index lookup, index lookup on one day, '
+                 'search_by_keyword, icontains table scan')
+    for size in sizes:
+        create_benchmark_events(size - Event.objects.count(), seed=size)
+        for keyword in BENCHMARK_KEYWORDS:
+            n_results = len(fulltext_index.search(keyword, limit=None))
+            duration = time_call(lambda: fulltext_index.search(keyword))
+            day_duration = time_call(lambda: fulltext_index.search(
+                keyword, date, location.id))
+            fetch_duration = time_call(
+                lambda: Event.objects.search_by_keyword(keyword))
+            scan_duration = time_call(
+                lambda: Event.objects.filter(name__icontains=keyword).count(),
+                repeat=3)
+            stdout.write('%9d events, "%s" (%d matches): %8.2f ms, '
+                         '%8.2f ms, %8.2f ms, %8.2f ms'
+                         % (size, keyword, n_results, duration, day_duration,
+                            fetch_duration, scan_duration))
+
+
+def benchmark_suggest(name_counts, stdout):
+    """ benchmark_suggest(name_counts, stdout)
+    ----------
+    Measures how long a PrefixTrie holding each number of event names in
+    name_counts takes to be built, and to answer the query of each keystroke
+    of a word. No database access is involved.
+    Results are written to stdout.
+
+    @param name_counts: numbers of event names in the trie
+    @type name_counts: [int]
+    """
+    rng = random.Random(0)
+    word = BENCHMARK_KEYWORDS[0]
+    stdout.write('suggestions, keystrokes of "%s":' % word)
+    for count in name_counts:
+        names = ['%s %s %s' % (get_benchmark_word(rng), get_benchmark_word(rng),
+                               get_benchmark_word(rng)) for i in range(count)]
+        trie = PrefixTrie()
+        start = time.time()
+        for name in names:
+            trie.add(name)
+        build_duration = (time.time() - start) * 1000
+        durations = [time_call(lambda: trie.search(word[:n]), repeat=100)
+                     for n in range(1, len(word) + 1)]
+        stdout.write('%9d names: built in %8.1f ms, %s ms per keystroke'
+                     % (count, build_duration,
+                        ' '.join('%.3f' % d for d in durations)))
+
+
+def make_timeline_events(count, date, seed=0):
+    """ make_timeline_events(count, date, seed=0)
+    ----------
+    Returns count unsaved events taking place on date, some of them without
+    end time and some of them ending on the next day.
+
+    @rtype: [Event]
+    """
+    rng = random.Random(seed)
+    events = []
+    for i in range(count):
+        start_time = datetime.time(rng.randint(8, 21), rng.randint(0, 59))
+        event = Event(name='timeline event %d' % i, event_start_date=date,
+                      event_start_time=start_time)
+        r = rng.random()
+        if r < 0.6:
+            event.event_end_time = start_time.replace(
+                hour=min(23, start_time.hour + rng.randint(1, 3)))
+        elif r < 0.7:
+            event.event_end_date = date + datetime.timedelta(days=1)
+            event.event_end_time = datetime.time(2, 0)
+        events.append(event)
+    return events
+
+
+def _per_event_timeline_data(event_list, date):
+    """ _per_event_timeline_data(event_list, date)
+    ----------
+    Positions events on the time bar the way format_sr_data_from_event_list
+    and format_event_data used to, one event at a time. Used as the reference
+    of benchmark_timeline.
+
+    """
+    t_min = min([event.event_start_time for event in event_list])
+    all_event_end_dates = filter(None,
+                                 list(set([event.event_end_date
+                                 for event in event_list])))
+    if all_event_end_dates and max(all_event_end_dates) > date:
+        t_max = datetime.time(23, 59)
+    else:
+        t_max1 = max([event.event_start_time for event in event_list])
+        times = filter(None, [event.event_end_time for event in event_list])
+        times.append(t_max1)
+        t_max = max(times)
+    [t_min, t_max] = calculate_bounds_time_data(t_min, t_max)
+
+    timeline_data = []
+    for event in event_list:
+        start_time_val = event.event_start_time.strftime('%I:%M %p')
+        start_time_val_percent = time_to_percentage(
+            event.event_start_time, t_min, t_max)
+        if event.event_end_date and \
+                (event.event_end_date > event.event_start_date):
+            end_time = datetime.time(23, 59)
+        elif event.event_end_time:
+            end_time = event.event_end_time
+        else:
+            end_time = event.event_start_time
+        [duration_minutes_val, duration_str_val, duration_percent_val] = \
+            duration_from_start_end_time(event.event_start_time, end_time,
+                                         t_min, t_max)
+        weekday_num_to_str = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+        month_num_to_str = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul',
+                            'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+        datetime_val = weekday_num_to_str[event.event_start_date.weekday()] \
+            + ' ' + month_num_to_str[event.event_start_date.month - 1] + ' ' \
+            + str(event.event_start_date.day) + ', ' + start_time_val
+        timeline_data.append((start_time_val, start_time_val_percent,
+                              duration_minutes_val, duration_str_val,
+                              duration_percent_val, datetime_val))
+    return [t_min, t_max, timeline_data]
+
+
+def benchmark_timeline(day_sizes, stdout):
+    """ benchmark_timeline(day_sizes, stdout)
+    ----------
+    Compares the time it takes to position a day of events on the time bar
+    with the batch calculate_timeline_data and with the former per-event
+    code, for days with each number of events in day_sizes. Both are checked
+    to give identical results. No database access is involved.
+    Results are written to stdout.
+
+    @param day_sizes: numbers of events in the day
+    @type day_sizes: [int]
+    """
+    date = BENCHMARK_START_DATE
+    stdout.write('timeline geometry, per event vs batch:')
+    for size in day_sizes:
+        events = make_timeline_events(size, date, seed=size)
+        if repr(_per_event_timeline_data(events, date)) != \
+                repr(calculate_timeline_data(events, date)):
+            raise AssertionError('Batch and per-event timelines differ')
+        per_event = time_call(lambda: _per_event_timeline_data(events, date))
+        batch = time_call(lambda: calculate_timeline_data(events, date))
+        stdout.write('%9d events: %8.3f ms per event, %8.3f ms batch (x%.1f)'
+                     % (size, per_event, batch, per_event / batch))
+
+
+def benchmark_views(sizes, stdout, repeat=20):
+    """ benchmark_views(sizes, stdout, repeat=20)
+    ----------
+    Measures the home and search views through the test client, and
+    format_sr_data_from_event_list on the events of one day, as the events
+    table grows to each of the sizes with synthetic events. Searches of one
+    day and of a week are measured without the search results cache, then a
+    day with a warm cache.
+    For each of them, the median (p50) and 95th percentile (p95) latencies of
+    repeat calls, the number of queries of a call and the peak memory of the
+    process are reported. The peak memory never decreases: it only shows the
+    calls which need more memory than everything that ran before them. With
+    SQLite, it includes the test database, which is kept in memory.
+    Results are written to stdout.
+
+    @param sizes: sizes of the events table, in increasing order.
+    @type sizes: [int]
+
+    @param repeat: number of calls timed for each measure.
+    @type repeat: int
+    """
+    client = Client()
+    location = get_benchmark_locations()[0]
+    date = BENCHMARK_START_DATE + datetime.timedelta(days=BENCHMARK_DAYS // 2)
+    search_date = date.strftime('%a %b %d %Y')
+    end_date = (date + datetime.timedelta(days=6)).strftime('%a %b %d %Y')
+    uncached = get_cache('django.core.cache.backends.dummy.DummyCache')
+    cached = get_cache('django.core.cache.backends.locmem.LocMemCache')
+
+    def get(path, data=None):
+        response = client.get(path, data or {})
+        if response.status_code != 200:
+            raise AssertionError('%s returned %d'
+                                 % (path, response.status_code))
+
+    def format_day():
+        event_list = list(Event.objects.search_for_events(
+            date, location.id).prefetch_related('category'))
+        return lambda: format_sr_data_from_event_list(event_list, date,
+                                                      location.city)
+
+    cases = [
+        ('home', uncached, lambda: lambda: get('/')),
+        ('search, one day', uncached,
+         lambda: lambda: get('/search/', {'date': search_date})),
+        ('search, one week', uncached,
+         lambda: lambda: get('/search/', {'date': search_date,
+                                          'end_date': end_date})),
+        ('search, one day, cached', cached,
+         lambda: lambda: get('/search/', {'date': search_date})),
+        ('format_sr_data_from_event_list', uncached, format_day),
+    ]
+
+    stdout.write('views: p50, p95, queries per call, peak memory')
+    old_cache = search_cache.cache
+    # Queries are only recorded while they are counted, so that the list of
+    # queries of the DEBUG mode does not grow during the benchmark.
+    old_use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = False
+    try:
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for size in sizes:
+                create_synthetic_events(size - Event.objects.count(),
+                                        seed=size)
+                n_results = len(Event.objects.search_for_events(date,
+                                                                location.id))
+                stdout.write('%9d events, %d on the searched day:'
+                             % (size, n_results))
+                for (name, cache, make_call) in cases:
+                    search_cache.cache = cache
+                    call = make_call()
+                    # Warm up the registries and the cache.
+                    call()
+                    reset_queries()
+                    with CaptureQueriesContext(connection) as queries:
+                        call()
+                    durations = time_calls(call, repeat)
+                    stdout.write('    %-32s %8.2f ms %8.2f ms %4d queries '
+                                 '%8.1f MB'
+                                 % (name, get_percentile(durations, 50),
+                                    get_percentile(durations, 95),
+                                    len(queries), get_peak_memory()))
+    finally:
+        search_cache.cache = old_cache
+        connection.use_debug_cursor = old_use_debug_cursor
@@ -0,0 +1,25 @@
+import datetime
+
+# Date helpers shared by the models and the search results cache. This module
+# must not import the models, so that search_cache, which uses it, does not
+# depend on them.
+
+# Events are only listed on this many days after they start.
+MAX_EVENT_DAYS = 366
+
+
+def get_span_dates(start_date, end_date=None):
+    """ get_span_dates(start_date, end_date=None)
+    ----------
+    Returns the list of the dates from start_date to end_date (included), at
+    most MAX_EVENT_DAYS of them. A missing end date, or one before the start
+    date, spans the start date only.
+
+    @type start_date: datetime.date
+    @type end_date: datetime.date
+    @rtype: [datetime.date]
+    """
+    if end_date is None or end_date < start_date:
+        return [start_date]
+    n_days = min((end_date - start_date).days + 1, MAX_EVENT_DAYS)
+    return [start_date + datetime.timedelta(days=i) for i in range(n_days)]
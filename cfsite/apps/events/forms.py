@@ -5,7 +5,12 @@ __status__ = "Prototype"
 import pytz
 from datetime import datetime
 from django import forms
-from cfsite.apps.events.models import Category, Location
+from cfsite.apps.events.models import Location
+from cfsite.apps.events.paging import decode_page_cursor
+from cfsite.apps.events.registry import name_resolver
+
+# Maximum number of days a single search can cover.
+MAX_SEARCH_DAYS = 14
 
 
 class SearchForm(forms.Form):
@@ -18,25 +23,32 @@ class SearchForm(forms.Form):
     category = forms.CharField()
     category_id = forms.IntegerField(required=False)
     date = forms.DateField()
+    end_date = forms.DateField(required=False)
     location = forms.CharField()
     location_id = forms.IntegerField(required=False)
+    after = forms.CharField(required=False)
 
     def clean_category(self):
         """ SearchForm.clean_category()
         ----------
-        Make sure that the category selected is among those we have approved.
+        Make sure that the categories selected are among those we have
+        approved. Several categories can be selected, separated by commas.
 
         """
         category = self.cleaned_data['category']
 
         if category != u'all':
-            matching_ids = get_all_matching_category_ids(category)
-            if len(matching_ids)>1:
-                # If there is more than one match: something went wrong
-                raise forms.ValidationError(
-                    "Ooops. We couldn't understand what type of events you're looking for.")
-            elif not matching_ids:
+            category_names = split_category_names(category)
+            if not category_names:
                 raise forms.ValidationError("We don't have data for this type of events.")
+            for category_name in category_names:
+                matching_ids = get_all_matching_category_ids(category_name)
+                if len(matching_ids)>1:
+                    # If there is more than one match: something went wrong
+                    raise forms.ValidationError(
+                        "Ooops. We couldn't understand what type of events you're looking for.")
+                elif not matching_ids:
+                    raise forms.ValidationError("We don't have data for this type of events.")
 
         return category
 
@@ -56,6 +68,21 @@ class SearchForm(forms.Form):
 
         return location
 
+    def clean_after(self):
+        """ SearchForm.clean_after()
+        ----------
+        Make sure the page cursor, if any, is one we made, and decode it.
+
+        """
+        after = self.cleaned_data['after']
+        if not after:
+            return None
+        try:
+            return decode_page_cursor(after)
+        except ValueError:
+            raise forms.ValidationError("Ooops. We lost track of the events "
+                                        "you were looking at.")
+
     def clean(self):
         """ SearchForm.clean()
         ----------
@@ -70,6 +97,8 @@ class SearchForm(forms.Form):
         After IDs have been validated, the date is cleaned. This cannot be done
         before as it needs to know in which time zone the location is in
         order to check things properly.
+        The end date, if any, must not be before the date, and the search
+        must not cover more than MAX_SEARCH_DAYS days.
 
         """
 
@@ -80,26 +109,40 @@ class SearchForm(forms.Form):
         # Cleaning IDs
         category_name = self.cleaned_data['category']
         if category_name != u'all':
-            matching_category_ids = get_all_matching_category_ids(
-                category_name
-            )
-            self.cleaned_data['category_id'] = matching_category_ids[0]
+            category_ids = sorted(set(
+                get_all_matching_category_ids(name)[0]
+                for name in split_category_names(category_name)))
+            self.cleaned_data['category_ids'] = category_ids
+            self.cleaned_data['category_id'] = category_ids[0]
         else:
+            self.cleaned_data['category_ids'] = []
             self.cleaned_data['category_id'] = 0
 
         location_name = self.cleaned_data['location']
         matching_location_ids = get_all_matching_location_ids(
             location_name)
         self.cleaned_data['location_id'] = matching_location_ids[0]
-        location = Location.objects.get(id=matching_location_ids[0])
 
         # TODO (susanctu): disable for now:
         # Cleaning date
+        # location = Location.objects.get(id=matching_location_ids[0])
         # t = self.cleaned_data['date']
         # now = datetime.now(pytz.timezone(location.timezone)).date()
         # if t < now:
         #     raise forms.ValidationError("It looks like the date you searched for already happened...")
 
+        # Cleaning the date range
+        end_date = self.cleaned_data.get('end_date')
+        if end_date:
+            n_days = (end_date - self.cleaned_data['date']).days + 1
+            if n_days < 1:
+                raise forms.ValidationError(
+                    "Ooops. Your search seems to end before it starts.")
+            elif n_days > MAX_SEARCH_DAYS:
+                raise forms.ValidationError(
+                    "You can search for at most %d days of events at once."
+                    % MAX_SEARCH_DAYS)
+
         return self.cleaned_data
 
     def get_location(self):
@@ -129,6 +172,25 @@ class SearchForm(forms.Form):
         """
         return self.cleaned_data['category_id']
 
+    def get_category_ids(self):
+        """ SearchForm.get_category_ids()
+        ----------
+        Returns the ids of all the categories matching the user's request
+        from the cleaned form data, in increasing order. The list is empty
+        when all the categories are requested.
+
+        """
+        return self.cleaned_data['category_ids']
+
+    def get_category(self):
+        """ SearchForm.get_category()
+        ----------
+        Returns the categories requested by the user, as they were
+        requested, from the cleaned form data.
+
+        """
+        return self.cleaned_data['category']
+
     def get_date(self):
         """ SearchForm.get_date()
         ----------
@@ -137,28 +199,50 @@ class SearchForm(forms.Form):
         """
         return self.cleaned_data['date']
 
+    def get_end_date(self):
+        """ SearchForm.get_end_date()
+        ----------
+        Returns the last date of the search if the field passed validation.
+        This is the date itself when the search is for a single day.
+
+        """
+        return self.cleaned_data.get('end_date') or self.cleaned_data['date']
+
+    def get_page_cursor(self):
+        """ SearchForm.get_page_cursor()
+        ----------
+        Returns the decoded cursor of the page of results requested (see
+        decode_page_cursor), or None for the first page.
+
+        """
+        return self.cleaned_data.get('after')
+
+
+def split_category_names(category):
+    """ split_category_names(category)
+    ----------
+    Returns the names of the categories of a category field listing several
+    of them, separated by commas.
+
+    """
+    return [name.strip() for name in category.split(u',') if name.strip()]
+
 
 def get_all_matching_category_ids(category_name):
     """ SearchForm.get_all_matching_category_ids(category_name)
     ----------
     This function returns a list (possibly empty) of category ids matching
-    a category name.
+    a category name. Names are resolved in memory, see NameResolver.
 
     """
-    category_list = Category.objects.filter(
-        base_name__icontains=category_name
-    ).all()
-    return [category.id for category in category_list]
+    return name_resolver.resolve_category_ids(category_name)
 
 
 def get_all_matching_location_ids(location_name):
     """ SearchForm.get_all_matching_location_ids(location_name)
     ----------
     This function returns a list (possibly empty) of location ids matching
-    a location name
+    a location name. Names are resolved in memory, see NameResolver.
 
     """
-    locations_list = Location.objects.filter(
-        city__icontains=location_name
-    ).all()
-    return [location.id for location in locations_list]
+    return name_resolver.resolve_location_ids(location_name)
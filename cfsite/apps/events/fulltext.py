@@ -0,0 +1,299 @@
+import re
+from django.db import connection, DatabaseError
+from cfsite.apps.crawlers.parsers import MLStripper
+
+# Keyword search over the event names and descriptions. Each database backend
+# has its own full text index:
+#   - SQLite (dev): an FTS5 virtual table, whose rowids are the event IDs.
+#     SQLite builds without FTS5 fall back to LIKE searches, unindexed.
+#   - Postgres (prod): a tsvector column of the events table, with a GIN
+#     index.
+# The index is created after syncdb and kept up to date when events are saved
+# (see signals.py). Events inserted without calling save() can be indexed with
+# python manage.py rebuild_search_index.
+
+# Maximum number of events returned by a keyword search.
+MAX_KEYWORD_RESULTS = 100
+
+# Names in the database. The full text index cannot use the models, which
+# depend on it.
+_EVENT_TABLE = 'events_event'
+_DAY_EVENT_TABLE = 'events_dayevent'
+
+# Whether the SQLite library supports FTS5, None until checked.
+_sqlite_has_fts5 = None
+
+
+def get_keyword_tokens(keyword):
+    """ get_keyword_tokens(keyword)
+    ----------
+    Splits a keyword search into words. Anything else, like the operators of
+    the different full text query languages, is ignored.
+
+    @type keyword: str
+    @rtype: [str]
+    """
+    return re.findall(r'\w+', keyword.lower(), re.UNICODE)
+
+
+def get_event_text(event):
+    """ get_event_text(event)
+    ----------
+    Returns the text of an event description to index, with the HTML tags
+    stripped.
+
+    @type event: Event
+    @rtype: str
+    """
+    if not event.description:
+        return u''
+    s = MLStripper()
+    s.feed(event.description)
+    return s.get_data()
+
+
+class FullTextIndex(object):
+    """ FullTextIndex
+    ----------
+    Base class of the full text indexes. Databases without full text search
+    support get this one, which does no indexing and searches with LIKE,
+    a full table scan.
+
+    """
+
+    def create(self, cursor):
+        """ FullTextIndex.create(cursor)
+        ----------
+        Creates the index if it does not exist yet.
+
+        """
+        pass
+
+    def index_events(self, cursor, events):
+        """ FullTextIndex.index_events(cursor, events)
+        ----------
+        Adds saved events to the index, or refreshes them if they already are.
+
+        @type events: [Event]
+        """
+        pass
+
+    def unindex_event(self, cursor, event_id):
+        """ FullTextIndex.unindex_event(cursor, event_id)
+        ----------
+        Removes a deleted event from the index.
+
+        """
+        pass
+
+    def get_search_sql(self, tokens, filters_sql, names_only=False):
+        """ FullTextIndex.get_search_sql(tokens, filters_sql,
+                                         names_only=False)
+        ----------
+        Returns the SQL query listing the IDs of the events matching all the
+        words, most relevant first, and its parameters. The events table is
+        aliased as e in the query, which ends with its ORDER BY clause.
+
+        @param tokens: the words searched for, at least one.
+        @type tokens: [str]
+
+        @param filters_sql: JOIN and WHERE clauses restricting the events, and
+               their parameters.
+        @type filters_sql: (str, str, list)
+
+        @param names_only: whether to only match the words in the event
+               names, rather than in the names and descriptions.
+        @type names_only: bool
+
+        @rtype: (str, list)
+        """
+        (join_sql, where_sql, params) = filters_sql
+        conditions = []
+        like_params = []
+        for token in tokens:
+            if names_only:
+                conditions.append('e.name LIKE %s')
+                like_params.append('%' + token + '%')
+            else:
+                conditions.append('(e.name LIKE %s OR e.description LIKE %s)')
+                like_params += ['%' + token + '%'] * 2
+        sql = ('SELECT e.id FROM %s e %s WHERE %s %s '
+               'ORDER BY e.event_start_date, e.event_start_time'
+               % (_EVENT_TABLE, join_sql, ' AND '.join(conditions), where_sql))
+        return sql, like_params + params
+
+    def search(self, keyword, date=None, location_id=None,
+               limit=MAX_KEYWORD_RESULTS, names_only=False):
+        """ FullTextIndex.search(keyword, date=None, location_id=None,
+                                 limit=MAX_KEYWORD_RESULTS, names_only=False)
+        ----------
+        Returns the IDs of the valid events whose name or description match
+        all the words of keyword, most relevant first. Events can be
+        restricted to those taking place on a date, at a location, or both.
+
+        @type keyword: str
+
+        @param date: date the events take place on, optional.
+        @type date: datetime.date
+
+        @param location_id: ID of the location of the events, optional.
+        @type location_id: int
+
+        @param limit: maximum number of IDs returned, no limit if None.
+        @type limit: int
+
+        @param names_only: whether to only match the words in the event
+               names.
+        @type names_only: bool
+
+        @rtype: [int]
+        """
+        tokens = get_keyword_tokens(keyword)
+        if not tokens:
+            return []
+
+        join_sql = ''
+        where_sql = 'AND e.is_valid_event = %s'
+        params = [True]
+        if date is not None:
+            # Events running on the date are listed in the DayEvent table.
+            join_sql = 'JOIN %s d ON d.event_id = e.id' % _DAY_EVENT_TABLE
+            where_sql += ' AND d.date = %s'
+            params.append(connection.ops.value_to_db_date(date))
+            if location_id is not None:
+                where_sql += ' AND d.event_location_id = %s'
+                params.append(location_id)
+        elif location_id is not None:
+            where_sql += ' AND e.event_location_id = %s'
+            params.append(location_id)
+
+        (sql, params) = self.get_search_sql(tokens,
+                                            (join_sql, where_sql, params),
+                                            names_only)
+        if limit is not None:
+            sql += ' LIMIT %s'
+            params.append(limit)
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+class SQLiteFullTextIndex(FullTextIndex):
+    """ SQLiteFullTextIndex
+    ----------
+    Full text index stored in an FTS5 virtual table, with one row per event.
+    Results are ranked with BM25, a word of the name weighting as much as ten
+    words of the description.
+
+    """
+    table = 'events_event_fts'
+
+    def create(self, cursor):
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+                       "name, description, tokenize='porter unicode61')"
+                       % self.table)
+
+    def index_events(self, cursor, events):
+        cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % self.table,
+                           [(event.id,) for event in events])
+        cursor.executemany('INSERT INTO %s (rowid, name, description) '
+                           'VALUES (%%s, %%s, %%s)' % self.table,
+                           [(event.id, event.name, get_event_text(event))
+                            for event in events])
+
+    def unindex_event(self, cursor, event_id):
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % self.table,
+                       [event_id])
+
+    def get_search_sql(self, tokens, filters_sql, names_only=False):
+        (join_sql, where_sql, params) = filters_sql
+        # All the words, each of them possibly as the prefix of a longer one.
+        query = ' '.join('"%s"*' % token for token in tokens)
+        if names_only:
+            query = 'name : (%s)' % query
+        sql = ('SELECT e.id FROM %s JOIN %s e ON e.id = %s.rowid %s '
+               'WHERE %s MATCH %%s %s '
+               'ORDER BY bm25(%s, 10.0, 1.0)'
+               % (self.table, _EVENT_TABLE, self.table, join_sql, self.table,
+                  where_sql, self.table))
+        return sql, [query] + params
+
+
+class PostgresFullTextIndex(FullTextIndex):
+    """ PostgresFullTextIndex
+    ----------
+    Full text index stored in a tsvector column of the events table, with a
+    GIN index. Names are given the highest weight, and results are ranked
+    with ts_rank.
+
+    """
+    column = 'search_vector'
+
+    def create(self, cursor):
+        cursor.execute('SELECT 1 FROM information_schema.columns '
+                       'WHERE table_name = %s AND column_name = %s',
+                       [_EVENT_TABLE, self.column])
+        if cursor.fetchone() is None:
+            cursor.execute('ALTER TABLE %s ADD COLUMN %s tsvector'
+                           % (_EVENT_TABLE, self.column))
+            cursor.execute('CREATE INDEX %s_%s ON %s USING gin(%s)'
+                           % (_EVENT_TABLE, self.column, _EVENT_TABLE,
+                              self.column))
+
+    def index_events(self, cursor, events):
+        cursor.executemany("UPDATE %s SET %s = "
+                           "setweight(to_tsvector('english', %%s), 'A') || "
+                           "setweight(to_tsvector('english', %%s), 'B') "
+                           "WHERE id = %%s" % (_EVENT_TABLE, self.column),
+                           [(event.name, get_event_text(event), event.id)
+                            for event in events])
+
+    def get_search_sql(self, tokens, filters_sql, names_only=False):
+        (join_sql, where_sql, params) = filters_sql
+        # All the words, each of them possibly as the prefix of a longer one.
+        # Names are the words of weight A.
+        query = ' & '.join('%s:*%s' % (token, 'A' if names_only else '')
+                           for token in tokens)
+        sql = ("SELECT e.id FROM %s e %s, to_tsquery('english', %%s) query "
+               "WHERE e.%s @@ query %s "
+               "ORDER BY ts_rank(e.%s, query) DESC, e.id"
+               % (_EVENT_TABLE, join_sql, self.column, where_sql,
+                  self.column))
+        return sql, [query] + params
+
+
+def get_fulltext_index():
+    """ get_fulltext_index()
+    ----------
+    Returns the full text index of the database in use.
+
+    @rtype: FullTextIndex
+    """
+    if connection.vendor == 'sqlite':
+        if sqlite_has_fts5():
+            return SQLiteFullTextIndex()
+        return FullTextIndex()
+    elif connection.vendor == 'postgresql':
+        return PostgresFullTextIndex()
+    return FullTextIndex()
+
+
+def sqlite_has_fts5():
+    """ sqlite_has_fts5()
+    ----------
+    Returns whether the SQLite library in use supports FTS5, by creating a
+    temporary FTS5 table the first time it is called.
+
+    @rtype: bool
+    """
+    global _sqlite_has_fts5
+    if _sqlite_has_fts5 is None:
+        cursor = connection.cursor()
+        try:
+            cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS '
+                           'temp.cf_fts5_probe USING fts5(text)')
+            cursor.execute('DROP TABLE temp.cf_fts5_probe')
+            _sqlite_has_fts5 = True
+        except DatabaseError:
+            _sqlite_has_fts5 = False
+    return _sqlite_has_fts5
@@ -0,0 +1,122 @@
+import math
+
+# Events with coordinates are assigned to the cell of a grid covering the
+# globe, so that the events near a point can be looked up by cell in an index
+# before their exact distance is computed.
+# Cells are GEO_CELL_DEGREES degrees of latitude and longitude wide, which is
+# about 5.5 km from north to south.
+GEO_CELL_DEGREES = 0.05
+_GEO_GRID_COLUMNS = int(round(360 / GEO_CELL_DEGREES))
+
+# Radius searches covering more cells than this do not filter by cell, the
+# bounding box alone is used.
+MAX_GEO_CELLS = 100
+
+EARTH_RADIUS_KM = 6371.0
+_KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def _get_cell_row_column(latitude, longitude):
+    """ _get_cell_row_column(latitude, longitude)
+    ----------
+    Returns the row and column of the grid cell of a point.
+
+    @rtype: (int, int)
+    """
+    row = int(math.floor((latitude + 90) / GEO_CELL_DEGREES))
+    column = int(math.floor((longitude + 180) / GEO_CELL_DEGREES))
+    return row, column % _GEO_GRID_COLUMNS
+
+
+def get_geo_cell(latitude, longitude):
+    """ get_geo_cell(latitude, longitude)
+    ----------
+    Returns the ID of the grid cell a point is in, or None if the point has
+    no coordinates.
+
+    @type latitude: float
+    @type longitude: float
+    @rtype: int
+    """
+    if latitude is None or longitude is None:
+        return None
+    (row, column) = _get_cell_row_column(latitude, longitude)
+    return row * _GEO_GRID_COLUMNS + column
+
+
+def get_bounding_box(latitude, longitude, radius_km):
+    """ get_bounding_box(latitude, longitude, radius_km)
+    ----------
+    Returns the smallest box of latitudes and longitudes containing all the
+    points within radius_km of a point. Boxes crossing the poles or the 180th
+    meridian are clipped.
+
+    @return: minimum latitude, maximum latitude, minimum longitude and
+             maximum longitude of the box.
+    @rtype: (float, float, float, float)
+    """
+    delta_latitude = radius_km / _KM_PER_DEGREE
+    cos_latitude = math.cos(math.radians(latitude))
+    if cos_latitude > 1e-6:
+        delta_longitude = min(radius_km / (_KM_PER_DEGREE * cos_latitude),
+                              180)
+    else:
+        delta_longitude = 180
+    return (max(latitude - delta_latitude, -90),
+            min(latitude + delta_latitude, 90),
+            max(longitude - delta_longitude, -180),
+            min(longitude + delta_longitude, 180))
+
+
+def get_geo_cells(bounding_box):
+    """ get_geo_cells(bounding_box)
+    ----------
+    Returns the IDs of the grid cells overlapping a bounding box, or None if
+    there are more than MAX_GEO_CELLS of them.
+
+    @param bounding_box: as returned by get_bounding_box
+    @type bounding_box: (float, float, float, float)
+
+    @rtype: [int]
+    """
+    (min_latitude, max_latitude, min_longitude, max_longitude) = bounding_box
+    (min_row, min_column) = _get_cell_row_column(min_latitude, min_longitude)
+    (max_row, max_column) = _get_cell_row_column(max_latitude, max_longitude)
+    if max_column < min_column:
+        # The box ends on the 180th meridian, whose column wrapped around.
+        max_column = _GEO_GRID_COLUMNS - 1
+    if (max_row - min_row + 1) * (max_column - min_column + 1) > MAX_GEO_CELLS:
+        return None
+    return [row * _GEO_GRID_COLUMNS + column
+            for row in range(min_row, max_row + 1)
+            for column in range(min_column, max_column + 1)]
+
+
+def get_distance_km(latitude1, longitude1, latitude2, longitude2):
+    """ get_distance_km(latitude1, longitude1, latitude2, longitude2)
+    ----------
+    Returns the great circle distance between two points, with the haversine
+    formula.
+
+    @rtype: float
+    """
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    delta_phi = phi2 - phi1
+    delta_lambda = math.radians(longitude2 - longitude1)
+    a = math.sin(delta_phi / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1, math.sqrt(a)))
+
+
+def normalize_address(address):
+    """ normalize_address(address)
+    ----------
+    Normalizes an address so that different spellings of the same address
+    share their geocoding: case, punctuation and repeated spaces are ignored.
+
+    @type address: str
+    @rtype: str
+    """
+    return u' '.join(u''.join(c if c.isalnum() else u' '
+                              for c in address.lower()).split())
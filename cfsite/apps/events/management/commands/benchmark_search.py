@@ -0,0 +1,98 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from cfsite.apps.events.benchmarks import benchmark_search_query, \
+    benchmark_timeline, benchmark_keyword_search, benchmark_suggest, \
+    benchmark_views
+
+
+class Command(BaseCommand):
+    """
+    Defines the behavior of and options accepted by
+    python manage.py benchmark_search.
+
+    The benchmark runs against a throwaway test database, which is created
+    and filled with synthetic events, and destroyed at the end of the run.
+    The real database is never touched. The views suite fills a database of
+    its own with realistic events (see generate_events).
+    """
+    help = 'Benchmarks the different stages of a search'
+
+    SUITES = ['query', 'timeline', 'keyword', 'suggest', 'views']
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes',
+            action='store',
+            type='string',
+            default='10000,100000,1000000',
+            help='Comma separated list of events table sizes to '
+                 'benchmark, in increasing order'),
+        make_option('--day_sizes',
+            action='store',
+            type='string',
+            default='10,100,1000',
+            help='Comma separated list of numbers of events in a day, '
+                 'for the benchmarks working on a single day'),
+        make_option('--name_counts',
+            action='store',
+            type='string',
+            default='1000,10000,100000',
+            help='Comma separated list of numbers of event names, '
+                 'for the suggestions benchmark'),
+        make_option('--repeat',
+            action='store',
+            type='int',
+            default=20,
+            help='Number of requests timed for each measure of the views '
+                 'suite'),
+        make_option('--suites',
+            action='store',
+            type='string',
+            default=','.join(SUITES),
+            help='Comma separated list of benchmarks to run. '
+                 'Choices are %s' % (' '.join(SUITES))),
+        )
+
+    def handle(self, *args, **options):
+        sizes = self._parse_sizes(options.get('sizes'))
+        if sizes != sorted(sizes):
+            raise CommandError('Sizes should be in increasing order')
+        day_sizes = self._parse_sizes(options.get('day_sizes'))
+        name_counts = self._parse_sizes(options.get('name_counts'))
+        suites = options.get('suites').split(',')
+        for suite in suites:
+            if not suite in self.SUITES:
+                raise CommandError('Unrecognized suite: %s' % suite)
+
+        if 'timeline' in suites or 'suggest' in suites or \
+                'query' in suites or 'keyword' in suites:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0)
+            try:
+                if 'timeline' in suites:
+                    benchmark_timeline(day_sizes, self.stdout)
+                if 'suggest' in suites:
+                    benchmark_suggest(name_counts, self.stdout)
+                if 'query' in suites:
+                    benchmark_search_query(sizes, self.stdout)
+                if 'keyword' in suites:
+                    benchmark_keyword_search(sizes, self.stdout)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if 'views' in suites:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0)
+            try:
+                benchmark_views(sizes, self.stdout, options.get('repeat'))
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _parse_sizes(self, sizes_str):
+        """
+        Takes a comma separated list of sizes, returns the list of integers.
+        """
+        try:
+            return [int(size) for size in sizes_str.split(',')]
+        except ValueError:
+            raise CommandError('Sizes should be a list of integers')
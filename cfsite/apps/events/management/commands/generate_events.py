@@ -0,0 +1,37 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from cfsite.apps.events.benchmarks import create_synthetic_events
+
+
+class Command(BaseCommand):
+    """
+    Defines the behavior of and options accepted by
+    python manage.py generate_events.
+
+    The events are added to the configured database, on top of the events
+    already there. They are made up, but their categories, durations, spans
+    and descriptions vary like those of real events, so that the site can be
+    tried and profiled at any scale.
+    """
+    help = 'Fills the database with synthetic events'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--count',
+            action='store',
+            type='int',
+            default=10000,
+            help='Number of events to create, from 1000 to 1000000 or more'),
+        make_option('--seed',
+            action='store',
+            type='int',
+            default=0,
+            help='Seed of the random generator, the same seed gives the '
+                 'same events'),
+        )
+
+    def handle(self, *args, **options):
+        count = options.get('count')
+        if count <= 0:
+            raise CommandError('The number of events should be positive')
+        create_synthetic_events(count, seed=options.get('seed'),
+                                stdout=self.stdout)
@@ -0,0 +1,37 @@
+import csv
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from cfsite.apps.events.models import GeocodedAddress
+
+
+class Command(BaseCommand):
+    """
+    Defines the behavior of python manage.py load_geocoded_addresses.
+
+    Loads coordinates into the local geocoding table from CSV files with one
+    address, latitude, longitude line per address, for example exported from
+    a geocoding service. Addresses already known are updated.
+    """
+    args = '<file.csv file.csv ...>'
+    help = 'Loads addresses and their coordinates into the geocoding table'
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('No file to load')
+        n_addresses = 0
+        with transaction.atomic():
+            for file_name in args:
+                with open(file_name, 'rb') as f:
+                    for (line_num, row) in enumerate(csv.reader(f)):
+                        try:
+                            (address, latitude, longitude) = row
+                            GeocodedAddress.objects.remember(
+                                address.decode('utf-8'), float(latitude),
+                                float(longitude), source=file_name)
+                        except ValueError:
+                            raise CommandError('%s, line %d: expected an '
+                                               'address, a latitude and a '
+                                               'longitude'
+                                               % (file_name, line_num + 1))
+                        n_addresses += 1
+        self.stdout.write('Loaded %d addresses' % n_addresses)
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from cfsite.apps.events.models import Event, DayEvent
+
+
+class Command(BaseCommand):
+    """
+    Defines the behavior of python manage.py rebuild_day_events.
+
+    DayEvents are maintained whenever an event is saved, but events added
+    before the DayEvent table existed, or inserted without calling save()
+    (bulk_create, raw SQL), are not listed, and events updated without
+    calling save() (update(), raw SQL) have stale DayEvents. This command
+    rebuilds the whole table from the events.
+
+    The events are processed in batches, in ID order, each in its own
+    transaction: the memory used and the time the table is locked do not
+    grow with the number of events, and the days of the events outside the
+    current batch remain listed while the command runs.
+    """
+    help = 'Rebuilds the list of days on which each event takes place'
+    batch_size = 1000
+
+    def handle(self, *args, **options):
+        n_events = 0
+        batch = []
+        event_ids = Event.objects.order_by('id').values_list('id', flat=True)
+        for event_id in event_ids.iterator():
+            batch.append(event_id)
+            if len(batch) == self.batch_size:
+                n_events += self.rebuild_batch(batch)
+                batch = []
+        n_events += self.rebuild_batch(batch)
+        self.stdout.write('Listed the days of %d events' % n_events)
+
+    def rebuild_batch(self, event_ids):
+        """ Command.rebuild_batch(event_ids)
+        ----------
+        Replaces the DayEvents of a batch of events, in a single transaction.
+
+        @param event_ids: IDs of the events of the batch
+        @type event_ids: list of int
+        @return: number of events listed, events deleted since the IDs were
+        read are skipped
+        @rtype: int
+        """
+        if not event_ids:
+            return 0
+        with transaction.atomic():
+            DayEvent.objects.filter(event_id__in=event_ids).delete()
+            day_events = []
+            n_events = 0
+            for event in Event.objects.filter(id__in=event_ids) \
+                    .prefetch_related('category'):
+                day_events.extend(DayEvent.objects.build_for_event(event))
+                n_events += 1
+            DayEvent.objects.bulk_create(day_events)
+        return n_events
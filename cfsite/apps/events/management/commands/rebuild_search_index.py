@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from cfsite.apps.events.models import Event
+from cfsite.apps.events.fulltext import get_fulltext_index
+
+
+class Command(BaseCommand):
+    """
+    Defines the behavior of python manage.py rebuild_search_index.
+
+    The full text index is maintained whenever an event is saved, but events
+    added before the index existed, or inserted without calling save()
+    (bulk_create, raw SQL), are not indexed. This command indexes all the
+    events again.
+    """
+    help = 'Rebuilds the full text index of the event names and descriptions'
+
+    def handle(self, *args, **options):
+        index = get_fulltext_index()
+        batch_size = 1000
+        with transaction.atomic():
+            cursor = connection.cursor()
+            index.create(cursor)
+            n_events = 0
+            batch = []
+            for event in Event.objects.all().iterator():
+                batch.append(event)
+                if len(batch) == batch_size:
+                    index.index_events(cursor, batch)
+                    n_events += len(batch)
+                    batch = []
+            index.index_events(cursor, batch)
+            n_events += len(batch)
+        self.stdout.write('Indexed %d events' % n_events)
@@ -0,0 +1,111 @@
+import re
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import get_app, get_models
+
+
+_INDEX_NAME_RE = re.compile(r'^CREATE INDEX (\S+) ON ')
+
+
+def _get_index_names(cursor, table):
+    """ _get_index_names(cursor, table)
+    ----------
+    Lists the names of the indexes of a table. Django 1.6's introspection only
+    reports single column indexes, by column, so the catalog is queried
+    directly.
+
+    @param cursor: cursor on the database
+    @param table: name of the table
+    @type table: str
+    @rtype: set of str
+    """
+    if connection.vendor == 'postgresql':
+        cursor.execute(
+            'SELECT indexname FROM pg_indexes WHERE tablename = %s', [table])
+    else:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name = %s", [table])
+    return set(row[0] for row in cursor.fetchall())
+
+
+def get_upgrade_statements(cursor, model):
+    """ get_upgrade_statements(cursor, model)
+    ----------
+    Lists the SQL statements which bring the table of a model up to date,
+    along with their parameters: the columns added to the model since the
+    table was created, and the indexes it is missing. Tables which do not
+    exist yet are left to syncdb.
+
+    New columns are added as nullable, filled in with the default of their
+    field, then made NOT NULL where the database allows it (SQLite cannot
+    alter a column, so the NOT NULL constraint is only enforced by Django).
+
+    @param cursor: cursor on the database
+    @param model: model whose table is upgraded
+    @type model: django.db.models.Model subclass
+    @rtype: list of (str, list) tuples
+    """
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    if table not in connection.introspection.table_names(cursor):
+        return []
+    statements = []
+    columns = set(
+        row[0] for row in
+        connection.introspection.get_table_description(cursor, table))
+    for f in model._meta.local_fields:
+        db_type = f.db_type(connection=connection)
+        if db_type is None or f.column in columns:
+            continue
+        statements.append(('ALTER TABLE %s ADD COLUMN %s %s;' % (
+            qn(table), qn(f.column), db_type), []))
+        default = f.get_default()
+        if default is not None:
+            statements.append(('UPDATE %s SET %s = %%s;' % (
+                qn(table), qn(f.column)),
+                [f.get_db_prep_save(default, connection=connection)]))
+        if not f.null and connection.vendor == 'postgresql':
+            statements.append(('ALTER TABLE %s ALTER COLUMN %s SET NOT NULL;'
+                               % (qn(table), qn(f.column)), []))
+    index_names = _get_index_names(cursor, table)
+    for sql in connection.creation.sql_indexes_for_model(model, no_style()):
+        name = _INDEX_NAME_RE.match(sql).group(1).strip('"`')
+        if name not in index_names:
+            statements.append((sql, []))
+    return statements
+
+
+class Command(BaseCommand):
+    """
+    Defines the behavior of python manage.py upgrade_schema.
+
+    syncdb creates the tables which do not exist, but never alters the ones
+    which do. This command adds the columns and indexes of the events models
+    which an existing database is missing. Run syncdb first, then this
+    command, then rebuild_day_events and rebuild_search_index to fill in the
+    new tables. Running it again does nothing.
+    """
+    help = 'Adds the missing columns and indexes of the events tables'
+    option_list = BaseCommand.option_list + (
+        make_option('--sql', action='store_true', dest='sql', default=False,
+                    help='Print the SQL statements instead of running them'),
+    )
+
+    def handle(self, *args, **options):
+        n_statements = 0
+        with transaction.atomic():
+            cursor = connection.cursor()
+            for model in get_models(get_app('events')):
+                for sql, params in get_upgrade_statements(cursor, model):
+                    if options['sql']:
+                        self.stdout.write(sql if not params else
+                                          '%s -- %r' % (sql, params))
+                    else:
+                        cursor.execute(sql, params)
+                    n_statements += 1
+        if not options['sql']:
+            self.stdout.write('Ran %d upgrade statements' % n_statements)
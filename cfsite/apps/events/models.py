@@ -4,7 +4,14 @@ __status__ = "Prototype"
 
 import datetime
 from django.db import models
+from django.db.models import Count, Max, Min, Q
 from django.core.exceptions import ValidationError
+from cfsite.apps.crawlers.parsers import MLStripper, MLTagDetector, MLFormatter
+from cfsite.apps.events.dates import MAX_EVENT_DAYS, get_span_dates
+from cfsite.apps.events.fulltext import get_fulltext_index, \
+    MAX_KEYWORD_RESULTS
+from cfsite.apps.events.geo import get_geo_cell, get_bounding_box, \
+    get_geo_cells, get_distance_km, normalize_address
 
 # the crazyfish categories
 ART = 'arts & culture'
@@ -20,6 +27,58 @@ CF_CATEGORIES = [ART, CLASS, CONF, FAM, MUSIC, MEET, FOOD, SPORT]
 
 MAX_DESCRIPTION_LEN = 10000
 MAX_NAME_LEN = 100
+MAX_DESCRIPTION_SHORT_LEN = 100
+
+
+def get_display_minutes(start_date, start_time, end_date, end_time,
+                        date=None):
+    """ get_display_minutes(start_date, start_time, end_date, end_time,
+                            date=None)
+    ----------
+    Returns the start and end time of an event as it is displayed on the time
+    bar of a date, in minutes. Events continuing after that date are
+    displayed until midnight, events ending on it until their end time, and
+    events without an end time have no duration. On the last day of an event
+    ending earlier in the day than it started, it has no duration either.
+
+    @type start_date: datetime.date
+    @type start_time: datetime.time
+    @type end_date: datetime.date
+    @type end_time: datetime.time
+
+    @param date: date of the time bar, the start date if None.
+    @type date: datetime.date
+
+    @return: start and end minutes
+    @rtype: [int, int]
+    """
+    if date is None:
+        date = start_date
+    start_minutes = start_time.hour*60 + start_time.minute
+    # Check if the event continues after the date
+    # If so, display event end at midnight
+    if end_date and (end_date > date):
+        end_minutes = 23*60 + 59
+    elif end_time:
+        end_minutes = max(end_time.hour*60 + end_time.minute, start_minutes)
+    else:
+        end_minutes = start_minutes
+    return [start_minutes, end_minutes]
+
+
+def get_category_event_ids(category_ids):
+    """ get_category_event_ids(category_ids)
+    ----------
+    Returns a subquery of the IDs of the events belonging to any of the
+    categories. It reads the category index of the table relating events to
+    their categories, without joining the events, and lists every event only
+    once: filtering on id__in (or event__in) with it needs no distinct().
+
+    @type category_ids: [int]
+    @rtype: QuerySet
+    """
+    return Event.category.through.objects.filter(
+        category__in=category_ids).values('event')
 
 ### Models for the event app here ###
 
@@ -131,48 +190,193 @@ class EventManager(models.Manager):
     def name_count(self, keyword):
         """ EventManager.name_count(keyword)
         -----------
-        Returns the number of events that have a name which matches a
-        keyword.
+        Returns the number of valid events that have a name which contains
+        all the words of keyword, or words starting with them.
+        Names are looked up in the full text index of the database (see
+        fulltext.py).
 
         @type keyword: str
         @param keyword: keyword for which we will search against in
         the database of events.
 
         """
-        return self.filter(name__icontains=keyword).count()
+        return len(get_fulltext_index().search(keyword, limit=None,
+                                               names_only=True))
 
     def search_name_by_keyword(self, keyword):
         """ EventManager.search_name_by_keyword(keyword)
         ----------
-        Returns a list of elements that have a name which matches a keyword.
+        Returns the valid events that have a name which contains all the
+        words of keyword, or words starting with them, as a QuerySet.
+        Names are looked up in the full text index of the database (see
+        fulltext.py).
 
         @type keyword: str
         @param keyword: keyword for which we will do a search against in the
         events database.
 
         """
-        return self.filter(name__icontains=keyword)
+        return self.filter(id__in=get_fulltext_index().search(
+            keyword, limit=None, names_only=True))
 
-    @staticmethod
-    def search_for_events(date, location_id):
-        """ EventManager.search_for_events(date, location_id)
+    def search_by_keyword(self, keyword, date=None, location_id=None,
+                          limit=MAX_KEYWORD_RESULTS):
+        """ EventManager.search_by_keyword(keyword, date=None,
+                                           location_id=None,
+                                           limit=MAX_KEYWORD_RESULTS)
         ----------
-        Returns the list of all events that occurs on the date specified,
-        for the matching category and location.
+        Returns the valid events whose name or description contain all the
+        words of keyword, or words starting with them, most relevant first.
+        Events can also be restricted to a date and a location, like
+        search_for_events does.
+        Matching events are looked up in the full text index of the database
+        (see fulltext.py), then fetched with a second query.
+
+        @type keyword: str
+        @param keyword: words to search for.
+
+        @type date: datetime.date
+        @param date: date of the events, optional.
+
+        @type location_id: int
+        @param location_id: numerical ID of the location of interest, optional.
+
+        @type limit: int
+        @param limit: maximum number of events returned.
+
+        @rtype: [Event]
+        """
+        event_ids = get_fulltext_index().search(keyword, date, location_id,
+                                                limit)
+        events = self.in_bulk(event_ids)
+        return [events[event_id] for event_id in event_ids
+                if event_id in events]
+
+    def search_for_events(self, date, location_id, category_ids=None):
+        """ EventManager.search_for_events(date, location_id,
+                                           category_ids=None)
+        ----------
+        Returns the list of all valid events that occurs on the date
+        specified, for the matching location. This includes events which
+        started on an earlier date and are still running.
+        Events can also be restricted to those belonging to any of a list of
+        categories. Their categories are then prefetched.
         It assumes that the date requested is specified in the event local
         time zone, and therefore does not make any checks as far as time
         zones go before filtering by date.
+        This is a single query, which looks up the events of the day in the
+        (location, date) index of the DayEvent table. It takes time
+        proportional to the number of events returned.
 
-        Note: for now, it does not return events which last more than one day
-        and do not start on the date specified.
+        @type date: datetime.date
+        @param date: date of the events
 
         @type: location_id: int
         @param: location_id: numerical ID of the location of interest
 
+        @type category_ids: [int]
+        @param category_ids: IDs of the categories of interest, all the
+               categories if None or empty.
+
         """
-        locations = Location.objects.get(id=location_id)
-        l = locations.event_set.filter(event_start_date=date)
-        return l
+        events = self.filter(dayevent__event_location=location_id,
+                             dayevent__date=date,
+                             is_valid_event=True)
+        if category_ids:
+            events = events.filter(
+                id__in=get_category_event_ids(category_ids)
+            ).prefetch_related('category')
+        return events
+
+    def search_for_events_by_day(self, start_date, end_date, location_id):
+        """ EventManager.search_for_events_by_day(start_date, end_date,
+                                                  location_id)
+        ----------
+        Returns the valid events of a location for every day from start_date
+        to end_date (included), grouped by day. Events running on several of
+        these days are listed on each of them.
+        The events of the whole range are looked up with a single query on
+        the (location, date) index of the DayEvent table, and their
+        categories are prefetched with a second one. Within a day, events are
+        ordered like search_for_events orders them.
+
+        @type start_date: datetime.date
+        @param start_date: first date of the range
+
+        @type end_date: datetime.date
+        @param end_date: last date of the range
+
+        @type: location_id: int
+        @param: location_id: numerical ID of the location of interest
+
+        @return: a (date, list of events) pair for every date of the range,
+                 in chronological order.
+        @rtype: [(datetime.date, [Event])]
+        """
+        n_days = (end_date - start_date).days + 1
+        dates = [start_date + datetime.timedelta(days=i)
+                 for i in range(n_days)]
+        events_by_day = dict((d, []) for d in dates)
+        day_events = DayEvent.objects.filter(
+            event_location=location_id,
+            date__range=(start_date, end_date),
+            event__is_valid_event=True
+        ).select_related('event').prefetch_related(
+            'event__category'
+        ).order_by('date', 'event__event_start_time', 'event__name')
+        for day_event in day_events:
+            events_by_day[day_event.date].append(day_event.event)
+        return [(d, events_by_day[d]) for d in dates]
+
+    def search_near(self, date, latitude, longitude, radius_km):
+        """ EventManager.search_near(date, latitude, longitude, radius_km)
+        ----------
+        Returns the valid events taking place within radius_km of a point on
+        the date specified, closest first. Each event gets a distance_km
+        attribute.
+        Events are prefiltered in the database: the (date, cell) index of the
+        DayEvent table selects the grid cells overlapping the bounding box of
+        the circle, and the coordinates are then restricted to the box. Exact
+        distances are only computed for the events left. Events without
+        coordinates are never returned.
+
+        @type date: datetime.date
+        @param date: date of the events
+
+        @type latitude: float
+        @param latitude: latitude of the center of the search, in degrees.
+
+        @type longitude: float
+        @param longitude: longitude of the center of the search, in degrees.
+
+        @type radius_km: float
+        @param radius_km: radius of the search, in kilometers.
+
+        @rtype: [Event]
+        """
+        bounding_box = get_bounding_box(latitude, longitude, radius_km)
+        (min_latitude, max_latitude, min_longitude, max_longitude) = \
+            bounding_box
+        filters = dict(dayevent__date=date,
+                       is_valid_event=True,
+                       latitude__range=(min_latitude, max_latitude),
+                       longitude__range=(min_longitude, max_longitude))
+        geo_cells = get_geo_cells(bounding_box)
+        if geo_cells is not None:
+            # In the same filter() call, so that both conditions apply to the
+            # same DayEvent.
+            filters['dayevent__geo_cell__in'] = geo_cells
+        event_list = self.filter(**filters)
+
+        events_near = []
+        for event in event_list:
+            event.distance_km = get_distance_km(latitude, longitude,
+                                                event.latitude,
+                                                event.longitude)
+            if event.distance_km <= radius_km:
+                events_near.append(event)
+        events_near.sort(key=lambda event: event.distance_km)
+        return events_near
 
 
 # Event model here...
@@ -217,6 +421,20 @@ class Event(models.Model):
         - rating: list of integer ratings, between 0 and 5.
         - is_valid_event: flag, used to choose if events should be served to the
         user or not.
+        - latitude, longitude: optional, coordinates of the venue, in degrees.
+
+    The following fields are derived from the description whenever the event
+    is saved with a new description, so that search results never have to
+    parse HTML. They cannot be edited directly:
+        - description_short: plain text preview of the description.
+        - description_formatted: HTML version of the description, ready to be
+        rendered in the event details.
+        - description_has_images: flag, set if the description contains
+        images (we don't display those, the user is sent to the website).
+
+    The cell of the grid the venue is in (see geo.py) is also derived from the
+    coordinates whenever the event is saved:
+        - geo_cell: grid cell ID, used by the spatial index of the DayEvents.
 
     """
 
@@ -235,8 +453,38 @@ class Event(models.Model):
     price_details = models.CharField(max_length=200, blank=True)
     rating = models.CommaSeparatedIntegerField(max_length=250, blank=True)
     is_valid_event = models.BooleanField('Is event valid?')
+    description_short = models.CharField(max_length=MAX_DESCRIPTION_SHORT_LEN,
+                                         blank=True, editable=False)
+    description_formatted = models.TextField(blank=True, editable=False)
+    description_has_images = models.BooleanField(default=False,
+                                                 editable=False)
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    geo_cell = models.IntegerField(blank=True, null=True, editable=False)
     objects = EventManager()
 
+    def __init__(self, *args, **kwargs):
+        """ Event.__init__()
+        ----------
+        Keeps track of the description the derived description fields were
+        computed from, so that save() knows when they need to be refreshed.
+        Events whose derived fields were never computed have no source.
+        Also keeps track of the location, dates and grid cell of the event as
+        stored in the database.
+
+        """
+        super(Event, self).__init__(*args, **kwargs)
+        if self.description_formatted:
+            self._description_source = self.description
+        else:
+            self._description_source = None
+        # Where and when the event was when last loaded or saved, so that the
+        # cached search results of its former dates can be invalidated.
+        if self.pk is not None:
+            self._saved_span = self.span
+        else:
+            self._saved_span = None
+
     def __unicode__(self):
         """ Event.__unicode__
         ----------
@@ -278,15 +526,109 @@ class Event(models.Model):
             if self.event_start_time > self.event_end_time:
                 raise ValidationError('Start and end times are inconsistent.')
 
+    @property
+    def span(self):
+        """ Event.span
+        ----------
+        The location ID, start date and end date of the event. Dates which
+        were set as strings (by the Gdocs crawler for example) are converted.
+
+        @rtype: (int, datetime.date, datetime.date)
+        """
+        to_date = self._meta.get_field('event_start_date').to_python
+        return (self.event_location_id, to_date(self.event_start_date),
+                to_date(self.event_end_date))
+
+    @property
+    def dates(self):
+        """ Event.dates
+        ----------
+        The list of the dates the event takes place on, from its start date to
+        its end date, at most MAX_EVENT_DAYS of them.
+
+        @rtype: [datetime.date]
+        """
+        (location_id, start_date, end_date) = self.span
+        return get_span_dates(start_date, end_date)
+
+    def save(self, *args, **kwargs):
+        """ Event.save()
+        ----------
+        Saves the event, refreshing the derived description fields first if
+        the description changed since they were last computed, and the grid
+        cell of the event.
+        If only some fields are saved and the description or the coordinates
+        are among them, the derived fields are saved along with them.
+
+        """
+        if self.description != self._description_source:
+            self.format_description()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'description' in update_fields:
+                kwargs['update_fields'] = list(update_fields) + [
+                    'description_short', 'description_formatted',
+                    'description_has_images']
+        self.geo_cell = get_geo_cell(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and \
+                ('latitude' in update_fields or 'longitude' in update_fields):
+            kwargs['update_fields'] = list(update_fields) + ['geo_cell']
+        super(Event, self).save(*args, **kwargs)
+
+    def format_description(self):
+        """ Event.format_description()
+        ----------
+        Computes the description preview, the HTML formatted description and
+        the images flag from the event description.
+        The preview has all the HTML tags stripped. Descriptions which are not
+        HTML are turned into paragraphs, and descriptions with images are
+        replaced by a link to the event website.
+
+        """
+        if self.description:
+            s = MLStripper()
+            s.feed(self.description)
+            self.description_short = s.get_data()[0:MAX_DESCRIPTION_SHORT_LEN]
+            # Detect if description is HTML or not
+            t_detect = MLTagDetector()
+            t_detect.feed(self.description)
+            tags = t_detect.get_tags()
+            self.description_has_images = tags.find('<img>') >= 0
+            if not tags:
+                # If not tags, it is not and need to be formatted.
+                formatter = MLFormatter()
+                formatter.feed(self.description)
+                self.description_formatted = formatter.get_formatted_string()
+            elif self.description_has_images:
+                self.description_formatted = \
+                    'Please visit event website for a description.'
+            else:
+                self.description_formatted = self.description
+        else:
+            self.description_short = 'No description for this event.'
+            self.description_formatted = '<p>No description for this event.</p>'
+            self.description_has_images = False
+        self._description_source = self.description
+
     def category_names(self):
         """ Category.category_names()
         ----------
         Database query used to display event category.
 
         """
-        return', '.join([a.__unicode__ for a in self.category.all()])
+        return u', '.join([a.__unicode__() for a in self.category.all()])
     category_names.short_description = "Categories"
 
+    def get_category_ids(self):
+        """ Event.get_category_ids()
+        ----------
+        Returns the IDs of the event categories, from the prefetched
+        categories if they were prefetched.
+
+        @rtype: [int]
+        """
+        return [category.id for category in self.category.all()]
+
     def compare(self, new_obj):
         """ Event.compare(new_obj)
         ----------
@@ -300,7 +642,10 @@ class Event(models.Model):
         @return: dictionary of changed attributes
 
         """
-        ignore_keys = 'created', '_state', 'timestamp', 'user', 'uid', 'changed'
+        ignore_keys = 'created', '_state', 'timestamp', 'user', 'uid', \
+                      'changed', '_description_source', 'description_short', \
+                      'description_formatted', 'description_has_images', \
+                      '_saved_span', 'geo_cell'
         return Event._compare(self, new_obj, ignore_keys)
 
     @staticmethod
@@ -340,4 +685,408 @@ class Event(models.Model):
 
     class Meta:
         ordering = ['event_start_time', 'name']
+        # Serves search_for_events, in the order the events are displayed.
+        index_together = [['event_location', 'event_start_date',
+                           'is_valid_event', 'event_start_time']]
+
+
+
+
+# DayEventManager class here
+class DayEventManager(models.Manager):
+    """ DayEventManager model class
+    ----------
+    This manager keeps the DayEvent table in sync with the events, and
+    searches it.
+
+    """
+
+    # Event fields copied as is to the DayEvents.
+    EVENT_FIELDS = ['is_valid_event', 'name', 'event_start_date',
+                    'event_end_date', 'event_start_time', 'event_end_time',
+                    'price', 'price_details', 'rating', 'address', 'website',
+                    'description_short']
+
+    # Order of the DayEvents of a day, and of their pages. It matches
+    # Event.Meta.ordering, with the event ID to break ties. The event ID is
+    # given as a column, for extra(): ordering by event__id would join the
+    # events table.
+    PAGE_ORDERING = ['event_start_time', 'name', 'events_dayevent.event_id']
+
+    def build_for_event(self, event, category_ids=None):
+        """ DayEventManager.build_for_event(event, category_ids=None)
+        ----------
+        Returns the unsaved DayEvents of the days an event currently takes
+        place on.
+
+        @type event: Event
+        @param event: a saved event.
+
+        @type category_ids: [int]
+        @param category_ids: IDs of the categories of the event, read from the
+               database (or from the prefetched categories) if not given.
+
+        @rtype: [DayEvent]
+        """
+        if category_ids is None:
+            category_ids = event.get_category_ids()
+        # Fields set as strings (by the Gdocs crawler for example) are
+        # converted.
+        fields = dict((name, Event._meta.get_field(name).to_python(
+                       getattr(event, name))) for name in self.EVENT_FIELDS)
+        day_events = []
+        for d in event.dates:
+            [start_minutes, end_minutes] = get_display_minutes(
+                fields['event_start_date'], fields['event_start_time'],
+                fields['event_end_date'], fields['event_end_time'], d)
+            day_events.append(DayEvent(
+                event_id=event.id,
+                event_location_id=event.event_location_id,
+                geo_cell=event.geo_cell,
+                date=d,
+                start_minutes=start_minutes,
+                end_minutes=end_minutes,
+                category_ids=','.join(str(category_id) for
+                                      category_id in category_ids),
+                **fields))
+        return day_events
+
+    def update_for_event(self, event):
+        """ DayEventManager.update_for_event(event)
+        ----------
+        Replaces the DayEvents of an event by the ones of the days it
+        currently takes place on, with its current data. This is the only
+        place DayEvents are written: it runs whenever an event is saved,
+        wherever it is saved from (see signals.py).
+
+        @type event: Event
+        @param event: a saved event.
+
+        """
+        self.filter(event=event).delete()
+        self.bulk_create(self.build_for_event(event))
+
+    def update_categories(self, event_ids):
+        """ DayEventManager.update_categories(event_ids)
+        ----------
+        Refreshes the category IDs of the DayEvents of events whose
+        categories changed.
+
+        @type event_ids: [int]
+        """
+        for event in Event.objects.filter(id__in=list(event_ids)
+                                          ).prefetch_related('category'):
+            self.filter(event=event).update(category_ids=','.join(
+                str(category_id) for category_id in event.get_category_ids()))
+
+    def search_by_day(self, start_date, end_date, location_id):
+        """ DayEventManager.search_by_day(start_date, end_date, location_id)
+        ----------
+        Returns the DayEvents of the valid events of a location for every day
+        from start_date to end_date (included), grouped by day, ordered by
+        start time, name and event ID within a day.
+        The DayEvents of the whole range are read with a single query on the
+        (location, date, start time) index, without any join. Their formatted
+        descriptions are then read with a second one, see set_descriptions.
+
+        @type start_date: datetime.date
+        @param start_date: first date of the range
+
+        @type end_date: datetime.date
+        @param end_date: last date of the range
+
+        @type: location_id: int
+        @param: location_id: numerical ID of the location of interest
+
+        @return: a (date, list of DayEvents) pair for every date of the
+                 range, in chronological order.
+        @rtype: [(datetime.date, [DayEvent])]
+        """
+        n_days = (end_date - start_date).days + 1
+        dates = [start_date + datetime.timedelta(days=i)
+                 for i in range(n_days)]
+        day_events_by_day = dict((d, []) for d in dates)
+        day_events = list(self.filter(
+            event_location=location_id,
+            date__range=(start_date, end_date),
+            is_valid_event=True
+        ).extra(order_by=['date'] + self.PAGE_ORDERING))
+        self.set_descriptions(day_events)
+        for day_event in day_events:
+            day_events_by_day[day_event.date].append(day_event)
+        return [(d, day_events_by_day[d]) for d in dates]
+
+    def search_page(self, date, location_id, after=None, limit=None,
+                    category_ids=None):
+        """ DayEventManager.search_page(date, location_id, after=None,
+                                        limit=None, category_ids=None)
+        ----------
+        Returns a page of the DayEvents of the valid events of a location on
+        a date, ordered by start time, name and event ID. Events can be
+        restricted to those belonging to any of a list of categories.
+        Pages are delimited by a keyset rather than an offset: the page
+        starts right after the (start time, name, event ID) of the last
+        DayEvent of the previous page. The query then reads the
+        (location, date, start time) index from that start time on, however
+        far in the day the page is.
+        Formatted descriptions are not set, see set_descriptions.
+
+        @type date: datetime.date
+        @param date: date of the events
+
+        @type: location_id: int
+        @param: location_id: numerical ID of the location of interest
+
+        @type after: (datetime.time, unicode, int)
+        @param after: start time, name and event ID of the last DayEvent of
+               the previous page, None for the first page.
+
+        @type limit: int
+        @param limit: maximum number of DayEvents returned, no limit if None.
+
+        @type category_ids: [int]
+        @param category_ids: IDs of the categories of interest, all the
+               categories if None or empty.
+
+        @rtype: [DayEvent]
+        """
+        day_events = self.filter(event_location=location_id,
+                                 date=date,
+                                 is_valid_event=True)
+        if category_ids:
+            day_events = day_events.filter(
+                event__in=get_category_event_ids(category_ids))
+        if after is not None:
+            (start_time, name, event_id) = after
+            day_events = day_events.filter(
+                Q(event_start_time__gt=start_time) |
+                Q(event_start_time=start_time, name__gt=name) |
+                Q(event_start_time=start_time, name=name,
+                  event__gt=event_id))
+        day_events = day_events.extra(order_by=self.PAGE_ORDERING)
+        if limit is not None:
+            day_events = day_events[:limit]
+        return list(day_events)
+
+    def get_day_bounds(self, start_date, end_date, location_id,
+                       category_ids=None):
+        """ DayEventManager.get_day_bounds(start_date, end_date, location_id,
+                                           category_ids=None)
+        ----------
+        Returns, for every day from start_date to end_date (included), the
+        number of valid events of a location and the bounds of their times.
+        Events can be restricted to those belonging to any of a list of
+        categories.
+        This is a single aggregate query on the DayEvents of the range, which
+        gives the bounds of a whole day without reading its events, whichever
+        page of them is displayed.
+
+        @type start_date: datetime.date
+        @param start_date: first date of the range
+
+        @type end_date: datetime.date
+        @param end_date: last date of the range
+
+        @type: location_id: int
+        @param: location_id: numerical ID of the location of interest
+
+        @type category_ids: [int]
+        @param category_ids: IDs of the categories of interest, all the
+               categories if None or empty.
+
+        @return: a dictionary indexed by date, with an entry for the days
+                 having events only. Each entry has the fields count,
+                 min_start_time, max_start_time, max_end_time (None if no
+                 event has an end time) and max_end_date (likewise).
+        @rtype: dict
+        """
+        day_events = self.filter(
+            event_location=location_id,
+            date__range=(start_date, end_date),
+            is_valid_event=True
+        )
+        if category_ids:
+            day_events = day_events.filter(
+                event__in=get_category_event_ids(category_ids))
+        rows = day_events.values('date').annotate(
+            count=Count('id'),
+            min_start_time=Min('event_start_time'),
+            max_start_time=Max('event_start_time'),
+            max_end_time=Max('event_end_time'),
+            max_end_date=Max('event_end_date')
+        ).order_by()
+        return dict((row.pop('date'), row) for row in rows)
+
+    def set_descriptions(self, day_events):
+        """ DayEventManager.set_descriptions(day_events)
+        ----------
+        Sets the formatted descriptions of the events, which are not copied
+        to the DayEvents, on a list of DayEvents. They are read by event ID
+        with a single query, without any join.
+
+        @type day_events: [DayEvent]
+        """
+        if not day_events:
+            return
+        descriptions = dict(Event.objects.filter(
+            id__in=set(day_event.event_id for day_event in day_events)
+        ).values_list('id', 'description_formatted'))
+        for day_event in day_events:
+            day_event.description_formatted = descriptions[day_event.event_id]
+
+
+# DayEvent model here...
+class DayEvent(models.Model):
+    """ DayEvent model class
+    ----------
+    This class is the read model of the searches: there is one DayEvent per
+    event and per day the event is running, from its start date to its end
+    date, holding a copy of all the event data the search results are made
+    of. Looking up the events of a location on a day is then an index lookup
+    on this table alone, even for events which started on an earlier date.
+
+    DayEvents are rewritten whenever events are saved (see signals.py) and
+    should not be edited by hand.
+        - event: the event taking place.
+        - event_location: location of the event.
+        - date: one of the days the event takes place on.
+        - geo_cell: grid cell of the event venue, if it has coordinates.
+        - start_minutes, end_minutes: start and end of the event on the time
+        bar of their date, in minutes (see get_display_minutes).
+        - category_ids: comma separated IDs of the event categories.
+        - the other fields are copies of the event fields with the same name.
+    The formatted description, which can be long, is not copied.
+
+    """
+    event = models.ForeignKey(Event)
+    event_location = models.ForeignKey(Location)
+    date = models.DateField()
+    geo_cell = models.IntegerField(blank=True, null=True)
+    is_valid_event = models.BooleanField(default=False)
+    name = models.CharField(max_length=MAX_NAME_LEN)
+    event_start_date = models.DateField()
+    event_end_date = models.DateField(blank=True, null=True)
+    event_start_time = models.TimeField()
+    event_end_time = models.TimeField(blank=True, null=True)
+    start_minutes = models.IntegerField()
+    end_minutes = models.IntegerField()
+    price = models.FloatField(blank=True, null=True)
+    price_details = models.CharField(max_length=200, blank=True)
+    rating = models.CommaSeparatedIntegerField(max_length=250, blank=True)
+    address = models.CharField(max_length=120, blank=True)
+    website = models.URLField(blank=True)
+    description_short = models.CharField(max_length=MAX_DESCRIPTION_SHORT_LEN,
+                                         blank=True)
+    category_ids = models.CommaSeparatedIntegerField(max_length=250,
+                                                     blank=True)
+    objects = DayEventManager()
+
+    def __unicode__(self):
+        """ DayEvent.__unicode__
+        ----------
+        Defines the formatting of a DayEvent
+
+        """
+        return u'%s (%s)' % (self.name, self.date)
+
+    def get_category_ids(self):
+        """ DayEvent.get_category_ids()
+        ----------
+        Returns the IDs of the event categories.
+
+        @rtype: [int]
+        """
+        return [int(category_id) for category_id in
+                self.category_ids.split(',') if category_id]
+
+    class Meta:
+        index_together = [['event_location', 'date', 'event_start_time',
+                           'event'],
+                          ['date', 'geo_cell', 'event']]
+
+
+# GeocodedAddressManager class here
+class GeocodedAddressManager(models.Manager):
+    """ GeocodedAddressManager model class
+    ----------
+    This manager geocodes addresses from the GeocodedAddress table, and fills
+    it in.
+
+    """
+
+    def geocode(self, address):
+        """ GeocodedAddressManager.geocode(address)
+        ----------
+        Returns the coordinates of an address, if they are known.
+
+        @type address: str
+        @param address: address to geocode, in any spelling.
+
+        @return: latitude and longitude of the address, or None.
+        @rtype: (float, float)
+        """
+        key = normalize_address(address)
+        if not key:
+            return None
+        coordinates = self.filter(address=key).values_list(
+            'latitude', 'longitude')[:1]
+        return coordinates[0] if coordinates else None
+
+    def remember(self, address, latitude, longitude, source=''):
+        """ GeocodedAddressManager.remember(address, latitude, longitude,
+                                            source='')
+        ----------
+        Records the coordinates of an address, replacing those it had.
+
+        @type address: str
+        @param address: address of the coordinates, in any spelling.
+
+        @type source: str
+        @param source: where the coordinates come from.
+
+        """
+        key = normalize_address(address)
+        if not key:
+            return
+        (geocoded_address, is_new) = self.get_or_create(
+            address=key, defaults=dict(latitude=latitude, longitude=longitude,
+                                       source=source))
+        if not is_new and (geocoded_address.latitude,
+                           geocoded_address.longitude) != (latitude,
+                                                           longitude):
+            geocoded_address.latitude = latitude
+            geocoded_address.longitude = longitude
+            geocoded_address.source = source
+            geocoded_address.save()
+
+
+# GeocodedAddress model here...
+class GeocodedAddress(models.Model):
+    """ GeocodedAddress model class
+    ----------
+    This class is a local geocoding table, so that events can be given
+    coordinates without calling any geocoding service, offline. It is filled
+    with the venue coordinates returned by the event APIs, and can be loaded
+    from a file with python manage.py load_geocoded_addresses.
+        - address: normalized address (see geo.normalize_address).
+        - latitude, longitude: coordinates of the address, in degrees.
+        - source: where the coordinates come from.
+
+    """
+    address = models.CharField(max_length=200, unique=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    source = models.CharField(max_length=50, blank=True)
+    objects = GeocodedAddressManager()
+
+    def __unicode__(self):
+        """ GeocodedAddress.__unicode__
+        ----------
+        Defines the formatting of a GeocodedAddress
+
+        """
+        return u'%s (%f, %f)' % (self.address, self.latitude, self.longitude)
+
+    class Meta:
+        verbose_name_plural = 'geocoded addresses'
 
@@ -0,0 +1,66 @@
+import datetime
+from django.core import signing
+
+# The search results of a day are served by pages, which the search page
+# loads one after the other. The cursor of the next page holds everything
+# needed to carry on where the previous page stopped: the keyset of its last
+# event (see DayEventManager.search_page), and the state of the lanes of the
+# events graph (see assign_lanes), so that the events of the next page are
+# laid out around the ones already displayed.
+# Cursors are opaque URL-safe strings, signed with the SECRET_KEY: the lane
+# state sizes the work done for the next page (see assign_lanes), so cursors
+# which were not made here are rejected.
+_CURSOR_SALT = 'cfsite.apps.events.paging'
+
+
+def encode_page_cursor(after, lane_count, busy_lanes):
+    """ encode_page_cursor(after, lane_count, busy_lanes)
+    ----------
+    Returns the cursor of the page following a page of search results.
+
+    @param after: start time, name and event ID of the last event of the
+           page.
+    @type after: (datetime.time, unicode, int)
+
+    @param lane_count: number of lanes used so far.
+    @type lane_count: int
+
+    @param busy_lanes: (end time in minutes, lane) of the lanes still in use
+           at the end of the page.
+    @type busy_lanes: [(int, int)]
+
+    @rtype: str
+    """
+    (start_time, name, event_id) = after
+    return signing.dumps(
+        [start_time.strftime('%H:%M:%S'), name, event_id, lane_count,
+         sorted(busy_lanes)], salt=_CURSOR_SALT, compress=True)
+
+
+def decode_page_cursor(cursor):
+    """ decode_page_cursor(cursor)
+    ----------
+    Decodes a page cursor made by encode_page_cursor.
+
+    @type cursor: str
+
+    @return: the keyset the page starts after, the number of lanes used and
+             the lanes in use, as given to encode_page_cursor.
+    @rtype: [(datetime.time, unicode, int), int, [(int, int)]]
+
+    @raise ValueError: if the cursor is not a valid page cursor, or was not
+           made by encode_page_cursor.
+    """
+    try:
+        [start_time, name, event_id, lane_count, busy_lanes] = signing.loads(
+            str(cursor), salt=_CURSOR_SALT)
+        after = (datetime.datetime.strptime(start_time, '%H:%M:%S').time(),
+                 unicode(name), int(event_id))
+        lane_count = int(lane_count)
+        busy_lanes = [(int(end), int(lane)) for (end, lane) in busy_lanes]
+    except (signing.BadSignature, TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid page cursor')
+    if not all(0 <= lane < lane_count for (end, lane) in busy_lanes) or \
+            len(set(lane for (end, lane) in busy_lanes)) != len(busy_lanes):
+        raise ValueError('Invalid page cursor')
+    return [after, lane_count, busy_lanes]
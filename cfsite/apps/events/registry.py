@@ -0,0 +1,299 @@
+import threading
+import time
+from django.conf import settings
+from cfsite.apps.events.models import Category, Location, CF_CATEGORIES
+
+# Category logo and verbose names. Order of the list matters and should match
+# category IDs. Pretty clunky...
+DB_TO_CSS_NAME = dict(zip(CF_CATEGORIES, ['arts-culture',
+                                     'classes-workshops',
+                                     'conference',
+                                     'family',
+                                     'food-wine',
+                                     'meetup',
+                                     'music',
+                                     'sports']))
+DB_TO_VERBOSE_NAME = dict(zip(CF_CATEGORIES, ['arts &amp; culture',
+                                         'classes &amp; workshops',
+                                         'conference',
+                                         'family',
+                                         'food &amp; wine',
+                                         'meetup',
+                                         'music',
+                                         'sports']))
+
+
+class Registry(object):
+    """ Registry
+    ----------
+    Base class of the process-wide, in-memory copies of the small tables
+    below, which spare the database a query for every event or request.
+
+    The data is loaded on first use, and kept until the registry is
+    invalidated, which happens whenever a row it is made from is saved or
+    deleted (see signals.py). Since changes made by another process (for
+    example import_events) are not signaled, the data is also reloaded once
+    it is older than max_age seconds.
+    Subclasses define _load_data.
+
+    """
+
+    def __init__(self):
+        """ Registry.__init__()
+        ----------
+        Creates an empty registry. Nothing is loaded until the data is
+        requested.
+
+        """
+        self._lock = threading.Lock()
+        self._data = None
+
+    @property
+    def max_age(self):
+        """ Registry.max_age
+        ----------
+        Age, in seconds, from which the data is reloaded:
+        settings.FACET_REGISTRY_MAX_AGE.
+
+        @rtype: int
+        """
+        return settings.FACET_REGISTRY_MAX_AGE
+
+    def invalidate(self):
+        """ Registry.invalidate()
+        ----------
+        Drops the data held in memory. It will be reloaded from the database
+        the next time it is needed.
+
+        """
+        with self._lock:
+            self._data = None
+
+    def _load_data(self):
+        """ Registry._load_data()
+        ----------
+        Loads the data of the registry from the database, and returns it.
+
+        """
+        raise NotImplementedError
+
+    def _load(self):
+        """ Registry._load()
+        ----------
+        Loads the data of the registry from the database, keeps it and
+        returns it.
+
+        """
+        data = self._load_data()
+        with self._lock:
+            self._data = (time.time(), data)
+        return data
+
+    def _get_data(self):
+        """ Registry._get_data()
+        ----------
+        Returns the data of the registry, loading it if it is missing or too
+        old.
+
+        """
+        data = self._data
+        if data is None or time.time() - data[0] > self.max_age:
+            return self._load()
+        return data[1]
+
+
+class CategoryRegistry(Registry):
+    """ CategoryRegistry
+    ----------
+    A copy of the category table, used to build the category context data of
+    the search results without querying the database for every event.
+
+    The categories are loaded with a single query. Categories created by
+    another process are also picked up the first time one of their IDs is
+    requested.
+
+    """
+
+    def _load_data(self):
+        """ CategoryRegistry._load_data()
+        ----------
+        Loads all the categories from the database and builds the category
+        context data dictionaries, ordered by ID. Unofficial categories are
+        known to the registry but have no context data.
+
+        @return: the category base names by ID, and the category context data
+                 dictionaries.
+        @rtype: (dict, [dict])
+        """
+        base_names = {}
+        category_data = []
+        for (cat_id, base_name) in Category.objects.order_by('id').values_list(
+                'id', 'base_name'):
+            base_names[cat_id] = base_name
+            if base_name in CF_CATEGORIES:  # ignore unofficial category names
+                category_data.append(
+                    dict(css=DB_TO_CSS_NAME[base_name],
+                         name=DB_TO_VERBOSE_NAME[base_name],
+                         id=cat_id)
+                )
+        return base_names, category_data
+
+    def get_category_data(self, cat_id_list=None):
+        """ CategoryRegistry.get_category_data(cat_id_list=None)
+        ----------
+        Returns the list of category context data dictionaries, for all the
+        official categories or only for those with an ID in cat_id_list.
+        The dictionaries are shared and should not be modified.
+
+        @param cat_id_list: a list of categories IDs
+        @type cat_id_list: [int]
+        @return: a list of category description dictionaries, with fields css,
+                 name and id.
+        @rtype: [dict]
+        """
+        (base_names, category_data) = self._get_data()
+        if cat_id_list and not all(cat_id in base_names
+                                   for cat_id in cat_id_list):
+            (base_names, category_data) = self._load()
+
+        if cat_id_list:
+            return [cat for cat in category_data if (cat['id'] in cat_id_list)]
+
+        return category_data
+
+
+class FacetRegistry(Registry):
+    """ FacetRegistry
+    ----------
+    A list of the distinct category names and city names, offered as search
+    choices on the home page and in the admin. Both lists are loaded with
+    one query each.
+
+    """
+
+    def _load_data(self):
+        """ FacetRegistry._load_data()
+        ----------
+        Loads the distinct category and city names from the database, in
+        alphabetical order.
+
+        @return: the category names and the city names.
+        @rtype: ([str], [str])
+        """
+        category_names = list(Category.objects.order_by(
+            'base_name').values_list('base_name', flat=True).distinct())
+        city_names = list(Location.objects.order_by(
+            'city').values_list('city', flat=True).distinct())
+        return category_names, city_names
+
+    def get_category_names(self):
+        """ FacetRegistry.get_category_names()
+        ----------
+        Returns the distinct category base names, in alphabetical order. The
+        list is shared and should not be modified.
+
+        @rtype: [str]
+        """
+        return self._get_data()[0]
+
+    def get_city_names(self):
+        """ FacetRegistry.get_city_names()
+        ----------
+        Returns the distinct city names of the locations, in alphabetical
+        order. The list is shared and should not be modified.
+
+        @rtype: [str]
+        """
+        return self._get_data()[1]
+
+
+def normalize_name(name):
+    """ normalize_name(name)
+    ----------
+    Normalizes a category or city name for comparisons: case is ignored, and
+    so are leading, trailing and repeated spaces.
+
+    @type name: str
+    @rtype: str
+    """
+    return u' '.join(name.lower().split())
+
+
+class NameResolver(Registry):
+    """ NameResolver
+    ----------
+    An index of the category base names and city names, which resolves the
+    names typed by users to category and location IDs without querying the
+    database.
+
+    A name matches all the categories or locations it is part of, like an
+    icontains lookup would, after both are normalized by normalize_name.
+    The index is loaded with one query per table.
+
+    """
+
+    def _load_data(self):
+        """ NameResolver._load_data()
+        ----------
+        Loads the category and location names from the database, and indexes
+        them by normalized name.
+
+        @return: the category and location IDs indexed by normalized name.
+        @rtype: (dict, dict)
+        """
+        category_index = {}
+        for (cat_id, base_name) in Category.objects.order_by(
+                'id').values_list('id', 'base_name'):
+            category_index.setdefault(normalize_name(base_name),
+                                      []).append(cat_id)
+        location_index = {}
+        for (location_id, city) in Location.objects.order_by(
+                'id').values_list('id', 'city'):
+            location_index.setdefault(normalize_name(city),
+                                      []).append(location_id)
+        return category_index, location_index
+
+    def _resolve(self, name, index):
+        """ NameResolver._resolve(name, index)
+        ----------
+        Returns the IDs of all the entries of index whose normalized name
+        contains the normalized name, in increasing order.
+
+        @rtype: [int]
+        """
+        name = normalize_name(name)
+        ids = []
+        for (indexed_name, indexed_ids) in index.iteritems():
+            if name in indexed_name:
+                ids.extend(indexed_ids)
+        return sorted(ids)
+
+    def resolve_category_ids(self, category_name):
+        """ NameResolver.resolve_category_ids(category_name)
+        ----------
+        Returns the IDs of the categories matching a category name. The list
+        is empty if the name is unknown, and has more than one ID if the name
+        is ambiguous.
+
+        @type category_name: str
+        @rtype: [int]
+        """
+        return self._resolve(category_name, self._get_data()[0])
+
+    def resolve_location_ids(self, location_name):
+        """ NameResolver.resolve_location_ids(location_name)
+        ----------
+        Returns the IDs of the locations matching a city name. The list is
+        empty if the name is unknown, and has more than one ID if the name is
+        ambiguous.
+
+        @type location_name: str
+        @rtype: [int]
+        """
+        return self._resolve(location_name, self._get_data()[1])
+
+
+# The registries shared by the whole process.
+category_registry = CategoryRegistry()
+facet_registry = FacetRegistry()
+name_resolver = NameResolver()
@@ -0,0 +1,292 @@
+import hashlib
+import json
+import time
+from django.conf import settings
+from django.core.cache import cache
+from cfsite.apps.events.dates import get_span_dates
+
+# Search results are cached per (location, date, categories searched for),
+# under a key which includes the data version of that day. Writing an event
+# bumps the version of all the days it covers, so stale results are simply
+# never looked up again. Versions are only seen by the processes sharing the
+# cache they are stored in: in production, the cache must be shared by the web
+# workers and the processes writing events, such as import_events (see
+# settings/prod.py).
+# Versions are millisecond timestamps: a version evicted from the cache comes
+# back as a newer one, which can never match results cached before.
+_VERSION_KEY = 'cf:search:version:%d:%s'
+_GENERATION_KEY = 'cf:search:generation'
+# Version of the format of the cached results, part of their keys: bump it
+# when the data returned by format_sr_data_from_event_list changes.
+_RESULTS_FORMAT = 4
+_RESULTS_KEY = 'cf:search:results:%d:%s:%d:%d:%s:' + str(_RESULTS_FORMAT)
+
+# The HTML of each event of the search results is cached too, under a key
+# made of the event ID, the version of its data and the time bounds of the
+# day. Fragments only depend on these, so they never need to be invalidated.
+_FRAGMENT_KEY = 'cf:search:fragment:%d:%s:%s:%s:%d'
+
+# Version of the template events are rendered with, part of the fragment
+# keys: bump it when search_results_body_content_event.html changes.
+EVENT_FRAGMENT_TEMPLATE_VERSION = 1
+
+
+def _now_version():
+    """ _now_version()
+    ----------
+    Returns a new data version, based on the current time.
+
+    @rtype: int
+    """
+    return int(time.time() * 1000)
+
+
+def _get_or_create_version(key):
+    """ _get_or_create_version(key)
+    ----------
+    Returns the version stored under key, storing a new one if there is none.
+
+    @rtype: int
+    """
+    version = cache.get(key)
+    if version is None:
+        version = _now_version()
+        if not cache.add(key, version, None):
+            # Someone else created it in the meantime.
+            version = cache.get(key, version)
+    return version
+
+
+def _bump_version(key):
+    """ _bump_version(key)
+    ----------
+    Replaces the version stored under key by a newer one.
+
+    """
+    old_version = cache.get(key) or 0
+    cache.set(key, max(_now_version(), old_version + 1), None)
+
+
+def get_data_version(location_id, date):
+    """ get_data_version(location_id, date)
+    ----------
+    Returns the version of the events data of a location on a date. It
+    changes every time an event of that day is saved or deleted, or when a
+    category changes.
+
+    @param location_id: ID of the location
+    @type location_id: int
+
+    @param date: date of the events
+    @type date: datetime.date
+
+    @return: version of the data, a timestamp in milliseconds.
+    @rtype: int
+    """
+    return max(_get_or_create_version(_VERSION_KEY % (location_id,
+                                                      date.isoformat())),
+               _get_or_create_version(_GENERATION_KEY))
+
+
+def _get_categories_key_part(category_ids):
+    """ _get_categories_key_part(category_ids)
+    ----------
+    Returns the part of the search results keys identifying the categories
+    searched for.
+
+    @rtype: str
+    """
+    if not category_ids:
+        return 'all'
+    return '-'.join(str(category_id) for category_id in
+                    sorted(set(category_ids)))
+
+
+def get_search_results_key(location_id, date, category_ids=None):
+    """ get_search_results_key(location_id, date, category_ids=None)
+    ----------
+    Returns the cache key under which the current search results of a
+    location on a date are stored.
+
+    @param location_id: ID of the location
+    @type location_id: int
+
+    @param date: date of the search
+    @type date: datetime.date
+
+    @param category_ids: IDs of the categories searched for, all of them if
+           None or empty.
+    @type category_ids: [int]
+
+    @rtype: str
+    """
+    return _RESULTS_KEY % (
+        location_id, date.isoformat(),
+        _get_or_create_version(_VERSION_KEY % (location_id, date.isoformat())),
+        _get_or_create_version(_GENERATION_KEY),
+        _get_categories_key_part(category_ids))
+
+
+def get_search_results_keys(location_id, dates, category_ids=None):
+    """ get_search_results_keys(location_id, dates, category_ids=None)
+    ----------
+    Returns the cache keys under which the current search results of a
+    location on each of the dates are stored. The data versions of all the
+    dates are fetched at once.
+
+    @param location_id: ID of the location
+    @type location_id: int
+
+    @param dates: dates of the search
+    @type dates: [datetime.date]
+
+    @param category_ids: IDs of the categories searched for, all of them if
+           None or empty.
+    @type category_ids: [int]
+
+    @return: the keys, in the order of the dates.
+    @rtype: [str]
+    """
+    version_keys = [_VERSION_KEY % (location_id, d.isoformat())
+                    for d in dates]
+    versions = cache.get_many(version_keys)
+    generation = _get_or_create_version(_GENERATION_KEY)
+    keys = []
+    for (d, version_key) in zip(dates, version_keys):
+        version = versions.get(version_key)
+        if version is None:
+            version = _get_or_create_version(version_key)
+        keys.append(_RESULTS_KEY % (location_id, d.isoformat(), version,
+                                    generation,
+                                    _get_categories_key_part(category_ids)))
+    return keys
+
+
+def get_search_results(key):
+    """ get_search_results(key)
+    ----------
+    Returns the search results cached under key, or None.
+
+    """
+    return cache.get(key)
+
+
+def set_search_results(key, sr_data):
+    """ set_search_results(key, sr_data)
+    ----------
+    Caches search results under key.
+
+    """
+    cache.set(key, sr_data, settings.SEARCH_RESULTS_CACHE_TIMEOUT)
+
+
+def get_many_search_results(keys):
+    """ get_many_search_results(keys)
+    ----------
+    Returns the search results cached under any of the keys, in a dictionary
+    indexed by key. Keys without results are left out.
+
+    @rtype: dict
+    """
+    return cache.get_many(keys)
+
+
+def set_many_search_results(sr_data_by_key):
+    """ set_many_search_results(sr_data_by_key)
+    ----------
+    Caches several search results at once, each under its key.
+
+    @param sr_data_by_key: search results, indexed by key.
+    @type sr_data_by_key: dict
+    """
+    cache.set_many(sr_data_by_key, settings.SEARCH_RESULTS_CACHE_TIMEOUT)
+
+
+def invalidate_dates(location_id, start_date, end_date=None):
+    """ invalidate_dates(location_id, start_date, end_date=None)
+    ----------
+    Invalidates the cached search results of a location for every date
+    between start_date and end_date (included), up to MAX_EVENT_DAYS dates.
+
+    @param location_id: ID of the location
+    @type location_id: int
+
+    @param start_date: first date to invalidate
+    @type start_date: datetime.date
+
+    @param end_date: last date to invalidate, optional.
+    @type end_date: datetime.date
+    """
+    if location_id is None or start_date is None:
+        return
+    for date in get_span_dates(start_date, end_date):
+        _bump_version(_VERSION_KEY % (location_id, date.isoformat()))
+
+
+def invalidate_all():
+    """ invalidate_all()
+    ----------
+    Invalidates all the cached search results, for example because category
+    data changed.
+
+    """
+    _bump_version(_GENERATION_KEY)
+
+
+def get_event_data_version(event_data):
+    """ get_event_data_version(event_data)
+    ----------
+    Returns the version of the template data of an event: a digest of all
+    its fields, which changes whenever the rendered event would.
+
+    @param event_data: the event data, as returned by format_event_data.
+    @type event_data: dict
+
+    @rtype: str
+    """
+    return hashlib.md5(json.dumps(event_data, sort_keys=True)).hexdigest()
+
+
+def get_event_fragment_key(event_data, min_time, max_time):
+    """ get_event_fragment_key(event_data, min_time, max_time)
+    ----------
+    Returns the cache key under which the rendered HTML of an event is
+    stored.
+
+    @param event_data: the event data, with its id and version fields.
+    @type event_data: dict
+
+    @param min_time: minimum time of the time bar of the day, as in the
+           time_header data.
+    @type min_time: str
+
+    @param max_time: maximum time of the time bar of the day.
+    @type max_time: str
+
+    @rtype: str
+    """
+    return _FRAGMENT_KEY % (event_data['id'], event_data['version'],
+                            min_time, max_time,
+                            EVENT_FRAGMENT_TEMPLATE_VERSION)
+
+
+def get_event_fragments(keys):
+    """ get_event_fragments(keys)
+    ----------
+    Returns the event fragments cached under any of the keys, in a
+    dictionary indexed by key. Keys without fragments are left out.
+
+    @rtype: dict
+    """
+    return cache.get_many(keys)
+
+
+def set_event_fragments(fragments_by_key):
+    """ set_event_fragments(fragments_by_key)
+    ----------
+    Caches several event fragments at once, each under its key.
+
+    @param fragments_by_key: rendered HTML of the events, indexed by key.
+    @type fragments_by_key: dict
+    """
+    cache.set_many(fragments_by_key, settings.EVENT_FRAGMENT_CACHE_TIMEOUT)
@@ -0,0 +1,178 @@
+from django.db import connection
+from django.db.models.signals import post_save, pre_delete, post_delete, \
+    m2m_changed, post_syncdb
+from django.dispatch import receiver
+from cfsite.apps.events.models import Category, Location, Event, DayEvent
+from cfsite.apps.events.fulltext import get_fulltext_index
+from cfsite.apps.events.registry import category_registry, facet_registry, \
+    name_resolver
+from cfsite.apps.events import search_cache
+from cfsite.apps.events.suggest import suggestion_index
+
+# Keep the in-memory and cached data derived from the database in sync with it.
+# This module is imported by the package __init__.py so that the receivers are
+# always connected.
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_registry(sender, **kwargs):
+    """ invalidate_category_registry(sender, **kwargs)
+    ----------
+    Drops the registry categories and all the cached search results whenever
+    a category changes.
+
+    """
+    category_registry.invalidate()
+    facet_registry.invalidate()
+    name_resolver.invalidate()
+    suggestion_index.invalidate_places()
+    search_cache.invalidate_all()
+
+
+@receiver([post_save, post_delete], sender=Location)
+def invalidate_facet_registry(sender, **kwargs):
+    """ invalidate_facet_registry(sender, **kwargs)
+    ----------
+    Drops the registry city names, the resolver index and the suggested city
+    names whenever a location changes.
+
+    """
+    facet_registry.invalidate()
+    name_resolver.invalidate()
+    suggestion_index.invalidate_places()
+
+
+@receiver(pre_delete, sender=Category)
+def remember_deleted_category_events(sender, instance, **kwargs):
+    """ remember_deleted_category_events(sender, instance, **kwargs)
+    ----------
+    Remembers the events of a category about to be deleted, whose DayEvents
+    list it, before the deletion removes them from the category.
+
+    """
+    instance._deleted_event_ids = list(
+        instance.event_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def update_deleted_category_day_events(sender, instance, **kwargs):
+    """ update_deleted_category_day_events(sender, instance, **kwargs)
+    ----------
+    Removes a deleted category from the DayEvents of its events.
+
+    """
+    DayEvent.objects.update_categories(
+        getattr(instance, '_deleted_event_ids', []))
+
+
+@receiver(post_save, sender=Event)
+def update_saved_event_days(sender, instance, **kwargs):
+    """ update_saved_event_days(sender, instance, **kwargs)
+    ----------
+    Rewrites the DayEvents of a saved event, which copy its data, and
+    invalidates the cached search results of all the days it covers, as well
+    as the days it covered before if it was moved.
+    Events are saved by import_events, the Gdocs controller and the admin
+    alike, this keeps the DayEvents in sync with all of them.
+
+    """
+    span = instance.span
+    DayEvent.objects.update_for_event(instance)
+    if instance._saved_span is not None and instance._saved_span != span:
+        search_cache.invalidate_dates(*instance._saved_span)
+    search_cache.invalidate_dates(*span)
+    instance._saved_span = span
+
+
+@receiver(post_delete, sender=Event)
+def invalidate_deleted_event_search_results(sender, instance, **kwargs):
+    """ invalidate_deleted_event_search_results(sender, instance, **kwargs)
+    ----------
+    Invalidates the cached search results of all the days a deleted event
+    covered.
+
+    """
+    search_cache.invalidate_dates(*(instance._saved_span or instance.span))
+
+
+@receiver(post_save, sender=Event)
+def index_saved_event(sender, instance, **kwargs):
+    """ index_saved_event(sender, instance, **kwargs)
+    ----------
+    Refreshes the name and description of a saved event in the full text
+    index.
+
+    """
+    get_fulltext_index().index_events(connection.cursor(), [instance])
+
+
+@receiver(post_delete, sender=Event)
+def unindex_deleted_event(sender, instance, **kwargs):
+    """ unindex_deleted_event(sender, instance, **kwargs)
+    ----------
+    Removes a deleted event from the full text index.
+
+    """
+    get_fulltext_index().unindex_event(connection.cursor(), instance.id)
+
+
+@receiver(post_save, sender=Event)
+def update_suggested_event(sender, instance, **kwargs):
+    """ update_suggested_event(sender, instance, **kwargs)
+    ----------
+    Keeps the name of a saved event up to date in the suggestion index.
+
+    """
+    suggestion_index.update_event(instance)
+
+
+@receiver(post_delete, sender=Event)
+def remove_suggested_event(sender, instance, **kwargs):
+    """ remove_suggested_event(sender, instance, **kwargs)
+    ----------
+    Removes a deleted event from the suggestion index.
+
+    """
+    suggestion_index.remove_event(instance.id)
+
+
+@receiver(post_syncdb)
+def create_fulltext_index(sender, **kwargs):
+    """ create_fulltext_index(sender, **kwargs)
+    ----------
+    Creates the full text index of the events, once their table exists.
+    syncdb does not know about it, since it is not a model.
+
+    """
+    if sender.__name__ == Event.__module__:
+        get_fulltext_index().create(connection.cursor())
+
+
+@receiver(m2m_changed, sender=Event.category.through)
+def invalidate_event_categories_search_results(sender, instance, action,
+                                               reverse, **kwargs):
+    """ invalidate_event_categories_search_results(sender, instance, action,
+                                                   reverse, **kwargs)
+    ----------
+    Refreshes the category IDs listed in the DayEvents of the events whose
+    categories change, and invalidates the cached search results of the days
+    an event covers. Changes made from the category side of the relationship
+    can affect any day, and invalidate all the results.
+
+    """
+    if reverse and action == 'pre_clear':
+        # The events losing the category are only known before the clear.
+        instance._cleared_event_ids = list(
+            instance.event_set.values_list('id', flat=True))
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        if action == 'post_clear':
+            event_ids = getattr(instance, '_cleared_event_ids', [])
+        else:
+            event_ids = kwargs['pk_set']
+        DayEvent.objects.update_categories(event_ids)
+        search_cache.invalidate_all()
+    else:
+        DayEvent.objects.update_categories([instance.id])
+        search_cache.invalidate_dates(*instance.span)
@@ -0,0 +1,392 @@
+import datetime
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Q
+from cfsite.apps.events.models import Category, Location, Event
+from cfsite.apps.events.registry import normalize_name
+
+# Keys are only indexed up to this many characters. Longer prefixes are
+# looked up with their first MAX_KEY_LEN characters, and the candidates found
+# are then checked against the whole prefix.
+MAX_KEY_LEN = 12
+
+# Maximum number of suggestions of each kind returned for a query.
+MAX_SUGGESTIONS = 10
+
+logger = logging.getLogger('cfsite.suggest')
+
+
+def get_name_keys(name):
+    """ get_name_keys(name)
+    ----------
+    Returns the keys a name is indexed under: the normalized name, starting
+    at each of its words, so that typing any word of a name suggests it.
+
+    @type name: str
+    @rtype: set
+    """
+    words = normalize_name(name).split(u' ')
+    return set(u' '.join(words[i:]) for i in range(len(words)))
+
+
+class PrefixTrie(object):
+    """ PrefixTrie
+    ----------
+    A prefix tree of names. Each name is stored under all its keys (see
+    get_name_keys), with a count, so that several events sharing a name are
+    only suggested once, and a name is only removed along with its last
+    event.
+    Nodes are dictionaries mapping the next character of the key to the
+    child node. The names whose key ends at a node, and their counts, are
+    stored under the None key.
+
+    """
+
+    def __init__(self):
+        """ PrefixTrie.__init__()
+        ----------
+        Creates an empty trie.
+
+        """
+        self._root = {}
+
+    def add(self, name):
+        """ PrefixTrie.add(name)
+        ----------
+        Adds one occurrence of a name to the trie.
+
+        @type name: str
+        """
+        for key in get_name_keys(name):
+            node = self._root
+            for char in key[:MAX_KEY_LEN]:
+                node = node.setdefault(char, {})
+            names = node.setdefault(None, {})
+            names[name] = names.get(name, 0) + 1
+
+    def remove(self, name):
+        """ PrefixTrie.remove(name)
+        ----------
+        Removes one occurrence of a name from the trie. Nodes left without any
+        name below them are removed too.
+
+        @type name: str
+        """
+        for key in get_name_keys(name):
+            path = [self._root]
+            for char in key[:MAX_KEY_LEN]:
+                node = path[-1].get(char)
+                if node is None:
+                    break
+                path.append(node)
+            else:
+                names = path[-1].get(None, {})
+                if names.get(name, 0) > 1:
+                    names[name] -= 1
+                    continue
+                names.pop(name, None)
+                if not names:
+                    path[-1].pop(None, None)
+                # Prune the empty nodes, from the bottom up.
+                for (depth, char) in reversed(list(enumerate(
+                        key[:MAX_KEY_LEN]))):
+                    if path[depth + 1]:
+                        break
+                    del path[depth][char]
+
+    def search(self, prefix, limit=MAX_SUGGESTIONS):
+        """ PrefixTrie.search(prefix, limit=MAX_SUGGESTIONS)
+        ----------
+        Returns the names having a word starting with prefix, in alphabetical
+        order of their matching keys.
+        Only the nodes leading to the first limit names are visited, so that
+        the time taken does not depend on the size of the trie.
+
+        @type prefix: str
+
+        @param limit: maximum number of names returned
+        @type limit: int
+
+        @rtype: [str]
+        """
+        prefix = normalize_name(prefix)
+        node = self._root
+        for char in prefix[:MAX_KEY_LEN]:
+            node = node.get(char)
+            if node is None:
+                return []
+
+        results = []
+        seen = set()
+        # Depth first search, children in alphabetical order.
+        stack = [node]
+        while stack and len(results) < limit:
+            node = stack.pop()
+            for name in sorted(node.get(None, ())):
+                if name in seen:
+                    continue
+                if len(prefix) > MAX_KEY_LEN and not any(
+                        key.startswith(prefix) for key in get_name_keys(name)):
+                    continue
+                seen.add(name)
+                results.append(name)
+                if len(results) == limit:
+                    break
+            stack.extend(node[char] for char in
+                         sorted((c for c in node if c is not None),
+                                reverse=True))
+        return results
+
+
+class SuggestionIndex(object):
+    """ SuggestionIndex
+    ----------
+    A process-wide, in-memory index of the names users can search for: the
+    names of the upcoming valid events, the city names and the category base
+    names, each in its own PrefixTrie. It answers the typeahead queries of
+    the suggest API without querying the database.
+
+    The index is built when the process starts (see warm), or else on first
+    use. Events are then added, renamed or removed as they are saved or
+    deleted (see signals.py), and the city and category tries are rebuilt
+    whenever a Location or a Category changes. Signals only reach the index
+    of the process saving the event: events saved by another process (the
+    crawlers, or another web worker) only show up once the whole index is
+    rebuilt, which happens once it is older than
+    settings.SUGGEST_INDEX_MAX_AGE seconds, also dropping the past events.
+    The tries are built from the database without holding the lock of the
+    index: while the index is rebuilt, the other threads keep answering from
+    the previous one, and the events signaled meanwhile are applied to the
+    new one once it is built.
+
+    """
+
+    def __init__(self):
+        """ SuggestionIndex.__init__()
+        ----------
+        Creates an empty index. Nothing is loaded until the index is warmed
+        or a suggestion is requested.
+
+        """
+        self._lock = threading.RLock()
+        # Held by the thread building the event trie.
+        self._build_lock = threading.Lock()
+        self._built_at = None
+        self._event_trie = None
+        self._event_names = None
+        # Updates signaled while the event trie is built, or None.
+        self._pending_updates = None
+        self._place_tries = None
+        self._places_version = 0
+
+    def invalidate(self):
+        """ SuggestionIndex.invalidate()
+        ----------
+        Drops the whole index. It will be rebuilt the next time it is needed.
+
+        """
+        with self._lock:
+            self._event_trie = None
+            self._event_names = None
+            self._place_tries = None
+            self._places_version += 1
+
+    def invalidate_places(self):
+        """ SuggestionIndex.invalidate_places()
+        ----------
+        Drops the city and category tries. They will be rebuilt the next time
+        they are needed.
+
+        """
+        with self._lock:
+            self._place_tries = None
+            self._places_version += 1
+
+    def warm(self):
+        """ SuggestionIndex.warm()
+        ----------
+        Builds the index now, unless it is already built and fresh, so that
+        the first suggestions requested are not kept waiting for it. If the
+        database cannot be read, the error is logged and the index is left
+        to be built on demand.
+
+        """
+        try:
+            self._get_tries()
+        except DatabaseError:
+            logger.exception('Could not warm the suggestion index')
+
+    def _is_fresh(self):
+        """ SuggestionIndex._is_fresh()
+        ----------
+        Returns whether the event trie is built and younger than
+        settings.SUGGEST_INDEX_MAX_AGE seconds.
+
+        @rtype: bool
+        """
+        return self._event_trie is not None and \
+            time.time() - self._built_at <= settings.SUGGEST_INDEX_MAX_AGE
+
+    def _build_events(self, wait):
+        """ SuggestionIndex._build_events(wait)
+        ----------
+        Builds the trie of the upcoming valid events from the database, and
+        swaps it in once built. Only one thread builds it at a time.
+
+        @param wait: whether to wait for the thread already building the
+                     trie, if any, rather than returning right away.
+        @type wait: bool
+        """
+        if not self._build_lock.acquire(wait):
+            return
+        try:
+            with self._lock:
+                if self._is_fresh():
+                    return
+                self._pending_updates = []
+            today = datetime.date.today()
+            event_names = dict(Event.objects.filter(
+                Q(event_end_date__gte=today) |
+                Q(event_end_date__isnull=True, event_start_date__gte=today),
+                is_valid_event=True
+            ).values_list('id', 'name'))
+            event_trie = PrefixTrie()
+            for name in event_names.itervalues():
+                event_trie.add(name)
+            with self._lock:
+                (pending_updates, self._pending_updates) = \
+                    (self._pending_updates, None)
+                self._event_trie = event_trie
+                self._event_names = event_names
+                self._built_at = time.time()
+                for (update, arg) in pending_updates:
+                    update(arg)
+                self._place_tries = None
+                self._places_version += 1
+        finally:
+            with self._lock:
+                self._pending_updates = None
+            self._build_lock.release()
+
+    def _build_places(self):
+        """ SuggestionIndex._build_places()
+        ----------
+        Builds the city and category tries from the database, and returns
+        them. They are kept unless they were invalidated meanwhile.
+
+        @return: the city trie and the category trie.
+        @rtype: (PrefixTrie, PrefixTrie)
+        """
+        with self._lock:
+            places_version = self._places_version
+        location_trie = PrefixTrie()
+        for city in Location.objects.order_by('city').values_list(
+                'city', flat=True).distinct():
+            location_trie.add(city)
+        category_trie = PrefixTrie()
+        for base_name in Category.objects.values_list(
+                'base_name', flat=True).distinct():
+            category_trie.add(base_name)
+        place_tries = (location_trie, category_trie)
+        with self._lock:
+            if self._places_version == places_version:
+                self._place_tries = place_tries
+        return place_tries
+
+    def _get_tries(self):
+        """ SuggestionIndex._get_tries()
+        ----------
+        Returns the tries of the index, building them if needed. A stale
+        event trie is only waited for if there is no previous one to answer
+        from.
+
+        @return: the city trie, the category trie and the event trie.
+        @rtype: (PrefixTrie, PrefixTrie, PrefixTrie)
+        """
+        event_trie = None
+        while event_trie is None:
+            if not self._is_fresh():
+                self._build_events(wait=self._event_trie is None)
+            with self._lock:
+                event_trie = self._event_trie
+                place_tries = self._place_tries
+        if place_tries is None:
+            place_tries = self._build_places()
+        return place_tries + (event_trie,)
+
+    def get_suggestions(self, query, limit=MAX_SUGGESTIONS):
+        """ SuggestionIndex.get_suggestions(query, limit=MAX_SUGGESTIONS)
+        ----------
+        Returns the city names, category names and upcoming event names
+        having a word starting with query.
+
+        @type query: str
+
+        @param limit: maximum number of names of each kind returned
+        @type limit: int
+
+        @return: a dictionary with fields locations, categories and events,
+                 each a list of names.
+        @rtype: dict
+        """
+        (location_trie, category_trie, event_trie) = self._get_tries()
+        # The tries are searched under the lock, since the event trie is
+        # updated in place.
+        with self._lock:
+            return dict(locations=location_trie.search(query, limit),
+                        categories=category_trie.search(query, limit),
+                        events=event_trie.search(query, limit))
+
+    def update_event(self, event):
+        """ SuggestionIndex.update_event(event)
+        ----------
+        Updates the index after an event was saved: its previous name is
+        removed, and its current name added if the event is valid and
+        upcoming. Nothing is done until the index is built.
+
+        @type event: Event
+        """
+        with self._lock:
+            if self._pending_updates is not None:
+                self._pending_updates.append((self.update_event, event))
+            if self._event_trie is None:
+                return
+            self._remove_name(event.id)
+            (location_id, start_date, end_date) = event.span
+            if event.is_valid_event and \
+                    (end_date or start_date) >= datetime.date.today():
+                self._event_trie.add(event.name)
+                self._event_names[event.id] = event.name
+
+    def remove_event(self, event_id):
+        """ SuggestionIndex.remove_event(event_id)
+        ----------
+        Removes an event from the index, if it is indexed.
+
+        @type event_id: int
+        """
+        with self._lock:
+            if self._pending_updates is not None:
+                self._pending_updates.append((self.remove_event, event_id))
+            if self._event_trie is None:
+                return
+            self._remove_name(event_id)
+
+    def _remove_name(self, event_id):
+        """ SuggestionIndex._remove_name(event_id)
+        ----------
+        Removes the name of an event from the event trie, if it is indexed.
+        Called with the lock held.
+
+        @type event_id: int
+        """
+        name = self._event_names.pop(event_id, None)
+        if name is not None:
+            self._event_trie.remove(name)
+
+
+# The index shared by the whole process.
+suggestion_index = SuggestionIndex()
@@ -0,0 +1,32 @@
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles.templatetags.staticfiles import static
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+
+@register.simple_tag
+def static_bundle(bundle_name):
+    """ static_bundle(bundle_name)
+    ----------
+    Renders the tags including a bundle of settings.STATIC_BUNDLES: a single
+    tag for the bundle if settings.STATIC_BUNDLES_ENABLED is set, one tag per
+    file of the bundle otherwise.
+    Bundles whose name ends with .css are included with link tags, the other
+    ones with script tags.
+
+    Usage: {% load static_bundles %}{% static_bundle "css/index.bundle.css" %}
+
+    @type bundle_name: str
+    @rtype: str
+    """
+    if settings.STATIC_BUNDLES_ENABLED:
+        names = [bundle_name]
+    else:
+        names = settings.STATIC_BUNDLES[bundle_name]
+    if bundle_name.endswith('.css'):
+        tag = u'<link href="{0}" rel="stylesheet">'
+    else:
+        tag = u'<script src="{0}"></script>'
+    return format_html_join(u'\n', tag, ((static(name),) for name in names))
@@ -1,3 +1,1230 @@
+import base64
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from StringIO import StringIO
+from datetime import date, time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import get_cache
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import DatabaseError, connection
+from django.db.models import Max
+from django.template import Context, Template
 from django.test import TestCase
+from django.test.utils import override_settings
+from cfsite.assets import PrecompressedStaticFiles, gzip_compress, \
+    minify_css, HASHED_CACHE_CONTROL
+from cfsite.apps.events import fulltext, search_cache, suggest
+from cfsite.apps.events.benchmarks import create_synthetic_events
+from cfsite.apps.events.models import Location, Category, Event, DayEvent, \
+    GeocodedAddress, MUSIC, SPORT
+from cfsite.apps.events.management.commands.rebuild_day_events import \
+    Command as RebuildDayEventsCommand
+from cfsite.apps.events.management.commands.upgrade_schema import \
+    get_upgrade_statements
+from cfsite.apps.events.geo import get_geo_cell, get_bounding_box, \
+    get_geo_cells, get_distance_km
+from cfsite.apps.events.registry import category_registry, facet_registry, \
+    name_resolver
+from cfsite.apps.events.forms import SearchForm
+from cfsite.apps.events.paging import decode_page_cursor
+from cfsite.apps.events.suggest import PrefixTrie, suggestion_index
+from cfsite.apps.events.views import format_sr_data_from_event_list, \
+    get_search_results_data, get_range_search_results_data, \
+    render_event_fragments, \
+    compute_timeline_geometry, time_to_percentage, \
+    duration_from_start_end_time, assign_lanes
 
-# Create your tests here.
+
+def create_location():
+    """Returns the Palo Alto location, creating it if needed."""
+    return Location.objects.get_or_create(
+        city='Palo Alto',
+        state_province='CA',
+        zip_code=94301,
+        country='United States',
+        timezone='US/Pacific',
+        )[0]
+
+
+def create_event(**kwargs):
+    """Saves and returns a valid event, fields can be overridden."""
+    fields = dict(name='dummy event',
+                  event_location=create_location(),
+                  event_start_date=date(2014, 5, 10),
+                  event_start_time=time(18, 0),
+                  is_valid_event=True)
+    fields.update(kwargs)
+    ev = Event(**fields)
+    ev.save()
+    return ev
+
+
+# Number of events of the fixture day the query budgets are checked on.
+FIXTURE_DAY_EVENTS = 500
+
+
+def create_fixture_day(day=date(2014, 5, 10), n_events=FIXTURE_DAY_EVENTS):
+    """Saves n_events events on a day, spread over categories and times."""
+    categories = [Category.objects.get_or_create(base_name=MUSIC)[0],
+                  Category.objects.get_or_create(base_name=SPORT)[0]]
+    for i in range(n_events):
+        ev = create_event(name='fixture event %d' % i,
+                          event_start_date=day,
+                          event_start_time=time(8 + i % 14, i % 4 * 15),
+                          event_end_time=time(9 + i % 14, i % 4 * 15),
+                          description='description of event %d' % i)
+        ev.category.add(categories[i % len(categories)])
+
+
+class QueryBudgetMixin(object):
+    """Checks the queries reported by QueryStatsMiddleware against budgets."""
+
+    def assertQueryBudget(self, budget, path, data=None):
+        """Gets path, failing if the view runs more than budget queries."""
+        response = self.client.get(path, data or {})
+        self.assertEqual(response.status_code, 200)
+        stats = response['X-Query-Stats']
+        n_queries = int(re.search(r'queries=(\d+)', stats).group(1))
+        self.assertTrue(n_queries <= budget,
+                        'Query budget of %d exceeded: %s' % (budget, stats))
+        return response
+
+
+class EventDescriptionTestCase(TestCase):
+    def test_plain_text_description_is_formatted_on_save(self):
+        """Plain text descriptions are split into paragraphs on save."""
+        ev = create_event(description='first line\nsecond line')
+        ev = Event.objects.get(id=ev.id)
+        self.assertEqual(ev.description_short, 'first line\nsecond line')
+        self.assertEqual(ev.description_formatted,
+                         '<p>first line</p><p>second line</p>')
+        self.assertFalse(ev.description_has_images)
+
+    def test_html_description_is_stripped_for_preview(self):
+        """HTML descriptions are kept, and the preview has no tags."""
+        description = '<b>%s</b>' % ('a' * 150)
+        ev = create_event(description=description)
+        self.assertEqual(ev.description_short, 'a' * 100)
+        self.assertEqual(ev.description_formatted, description)
+
+    def test_description_with_images(self):
+        """Descriptions with images are flagged and not displayed."""
+        ev = create_event(description='<p>hi</p><img src="a.png">')
+        self.assertTrue(ev.description_has_images)
+        self.assertEqual(ev.description_formatted,
+                         'Please visit event website for a description.')
+
+    def test_description_change_refreshes_derived_fields(self):
+        """Changing the description and saving updates the derived fields."""
+        ev = create_event()
+        self.assertEqual(ev.description_short, 'No description for this event.')
+        ev = Event.objects.get(id=ev.id)
+        ev.description = 'new description'
+        ev.save(update_fields=['description'])
+        ev = Event.objects.get(id=ev.id)
+        self.assertEqual(ev.description_short, 'new description')
+        self.assertEqual(ev.description_formatted, '<p>new description</p>')
+
+
+class TimelineGeometryTestCase(TestCase):
+    def test_batch_matches_per_event_helpers(self):
+        """Batch positions and durations match the per-event helpers."""
+        bounds = [(time(0, 0), time(23, 59)), (time(10, 0), time(14, 0)),
+                  (time(18, 0), time(20, 0))]
+        starts = range(0, 24*60, 7)
+        ends = [min(s + 95, 23*60 + 59) for s in starts]
+        dates = [date(2014, 5, 10)] * len(starts)
+        for (t_min, t_max) in bounds:
+            geometry = compute_timeline_geometry(starts, ends, dates,
+                                                 t_min, t_max)
+            for (s, e, g) in zip(starts, ends, geometry):
+                start_time = time(s // 60, s % 60)
+                end_time = time(e // 60, e % 60)
+                self.assertEqual(
+                    repr(g[1]),
+                    repr(time_to_percentage(start_time, t_min, t_max)))
+                self.assertEqual(
+                    repr([g[2], g[3], g[4]]),
+                    repr(duration_from_start_end_time(start_time, end_time,
+                                                      t_min, t_max)))
+                self.assertEqual(g[0], start_time.strftime('%I:%M %p'))
+                self.assertEqual(g[5], 'Sat May 10, ' + g[0])
+
+
+class AssignLanesTestCase(TestCase):
+    def test_overlapping_events_get_different_lanes(self):
+        """Overlapping events never share a lane, free lanes are reused."""
+        intervals = [[600, 720], [660, 700], [700, 800], [720, 780],
+                     [650, 650], [900, 960]]
+        [lanes, lane_count] = assign_lanes(intervals)
+        self.assertEqual(lanes, [0, 1, 1, 0, 1, 0])
+        self.assertEqual(lane_count, 2)
+
+    def test_lanes_in_search_results(self):
+        """Search results carry the lane of each event."""
+        create_event(name='a', event_end_time=time(20, 0))
+        create_event(name='b', event_start_time=time(19, 0),
+                     event_end_time=time(21, 0))
+        create_event(name='c', event_start_time=time(20, 0),
+                     event_end_time=time(21, 0))
+        sr_data = format_sr_data_from_event_list(
+            list(Event.objects.all()), date(2014, 5, 10), 'Palo Alto')
+        self.assertEqual([e['lane'] for e in sr_data['events']], [0, 1, 0])
+        self.assertEqual(sr_data['lane_count'], 2)
+
+
+class ImportOrderTestCase(TestCase):
+    def test_modules_import_first(self):
+        """
+        Every module of the app can be imported first, and the signal
+        receivers are then connected.
+        """
+        for module in ['models', 'registry', 'search_cache', 'suggest',
+                       'signals', 'forms', 'views']:
+            process = subprocess.Popen(
+                [sys.executable, '-c',
+                 'import cfsite.apps.events.%s\n'
+                 'from django.db.models.signals import post_save\n'
+                 'from cfsite.apps.events.models import Event\n'
+                 'print(post_save.has_listeners(Event))' % module],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            (out, err) = process.communicate()
+            self.assertEqual(process.returncode, 0, err)
+            self.assertEqual(out.strip(), 'True', module)
+
+
+class CategoryRegistryTestCase(TestCase):
+    def setUp(self):
+        self.music = Category.objects.create(base_name=MUSIC)
+        self.sport = Category.objects.create(base_name=SPORT)
+        category_registry.invalidate()
+
+    def test_search_results_use_constant_number_of_queries(self):
+        """Rendering data does not query categories event by event."""
+        for i in range(10):
+            ev = create_event(name='event %d' % i)
+            ev.category.add(self.music if i % 2 else self.sport)
+        event_list = Event.objects.filter(
+            event_start_date=date(2014, 5, 10)).prefetch_related('category')
+        # Events, their categories, and the registry loading its categories.
+        with self.assertNumQueries(3):
+            sr_data = format_sr_data_from_event_list(
+                event_list, date(2014, 5, 10), 'Palo Alto')
+        self.assertEqual(len(sr_data['events']), 10)
+        self.assertEqual(sr_data['events'][1]['category_list'],
+                         [self.music.id])
+        self.assertEqual(sr_data['events'][1]['category_logo']['id'],
+                         self.music.id)
+
+    def test_category_changes_invalidate_registry(self):
+        """Saving or deleting a category reloads the registry."""
+        self.assertEqual(len(category_registry.get_category_data()), 2)
+        self.sport.delete()
+        self.assertEqual([c['id'] for c in category_registry.get_category_data()],
+                         [self.music.id])
+
+    def test_registry_expires(self):
+        """Changes which are not signaled are picked up once it is old."""
+        self.assertEqual(len(category_registry.get_category_data()), 2)
+        Category.objects.filter(id=self.sport.id).update(base_name='Other')
+        self.assertEqual(len(category_registry.get_category_data()), 2)
+        with override_settings(FACET_REGISTRY_MAX_AGE=-1):
+            self.assertEqual(
+                [c['id'] for c in category_registry.get_category_data()],
+                [self.music.id])
+
+
+class FacetRegistryTestCase(TestCase):
+    def setUp(self):
+        create_location()
+        Category.objects.create(base_name=MUSIC)
+        Category.objects.create(base_name=MUSIC, sub_category='jazz')
+
+    def test_home_page_does_not_query_when_warm(self):
+        """Category and city names are loaded once, without duplicates."""
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+        self.assertEqual(response.context['category_list'], [MUSIC])
+        self.assertEqual(response.context['location_list'], ['Palo Alto'])
+
+    def test_changes_invalidate_facets(self):
+        """Saving a location or a category reloads the names."""
+        self.assertEqual(facet_registry.get_city_names(), ['Palo Alto'])
+        Location.objects.create(city='Menlo Park', state_province='CA',
+                                zip_code=94025, country='United States',
+                                timezone='US/Pacific')
+        Category.objects.create(base_name=SPORT)
+        self.assertEqual(facet_registry.get_city_names(),
+                         ['Menlo Park', 'Palo Alto'])
+        self.assertEqual(facet_registry.get_category_names(), [MUSIC, SPORT])
+
+
+class NameResolverTestCase(TestCase):
+    def setUp(self):
+        self.location = create_location()
+        self.music = Category.objects.create(base_name=MUSIC)
+        self.jazz = Category.objects.create(base_name=MUSIC,
+                                            sub_category='jazz')
+        self.sport = Category.objects.create(base_name=SPORT)
+
+    def test_names_are_resolved_like_icontains(self):
+        """Names match the IDs of all the names they are part of."""
+        self.assertEqual(name_resolver.resolve_location_ids(' palo  ALTO'),
+                         [self.location.id])
+        self.assertEqual(name_resolver.resolve_category_ids('SPO'),
+                         [self.sport.id])
+        self.assertEqual(name_resolver.resolve_category_ids('music'),
+                         [self.music.id, self.jazz.id])
+        self.assertEqual(name_resolver.resolve_location_ids('Paris'), [])
+
+    def test_form_validation_does_not_query(self):
+        """A search is validated from memory, with the same errors."""
+        name_resolver.resolve_location_ids('warm up')
+        with self.assertNumQueries(0):
+            form = SearchForm({'category': 'spo', 'date': '2014-05-10',
+                               'location': 'Palo Alto'})
+            self.assertTrue(form.is_valid())
+            self.assertEqual(form.get_category_id(), self.sport.id)
+            self.assertEqual(form.get_location_id(), self.location.id)
+            form = SearchForm({'category': 'music', 'date': '2014-05-10',
+                               'location': 'Paris'})
+            self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['category'], [
+            "Ooops. We couldn't understand what type of events you're "
+            "looking for."])
+        self.assertEqual(form.errors['location'], [
+            "Crazyfish is not available at the location specified."])
+
+    def test_changes_refresh_the_resolver(self):
+        """New locations can be resolved as soon as they are saved."""
+        name_resolver.resolve_location_ids('warm up')
+        menlo_park = Location.objects.create(
+            city='Menlo Park', state_province='CA', zip_code=94025,
+            country='United States', timezone='US/Pacific')
+        self.assertEqual(name_resolver.resolve_location_ids('menlo'),
+                         [menlo_park.id])
+
+
+class SearchResultsCacheTestCase(TestCase):
+    def setUp(self):
+        # The test settings use a dummy cache, which never caches anything.
+        self.dummy_cache = search_cache.cache
+        search_cache.cache = get_cache(
+            'django.core.cache.backends.locmem.LocMemCache')
+        self.location = create_location()
+
+    def tearDown(self):
+        search_cache.cache.clear()
+        search_cache.cache = self.dummy_cache
+
+    def search(self, day):
+        return get_search_results_data(day, self.location.id, 'Palo Alto')
+
+    def test_repeat_search_is_served_from_cache(self):
+        """A second search for the same day does not query the database."""
+        create_event()
+        self.assertEqual(len(self.search(date(2014, 5, 10))['events']), 1)
+        with self.assertNumQueries(0):
+            sr_data = self.search(date(2014, 5, 10))
+        self.assertEqual(len(sr_data['events']), 1)
+
+    def test_saving_event_invalidates_its_days(self):
+        """Adding, moving and deleting events is visible immediately."""
+        self.search(date(2014, 5, 10))
+        self.search(date(2014, 5, 11))
+        ev = create_event()
+        self.assertEqual(len(self.search(date(2014, 5, 10))['events']), 1)
+        self.assertEqual(len(self.search(date(2014, 5, 11))['events']), 0)
+
+        ev.event_start_date = date(2014, 5, 11)
+        ev.save()
+        self.assertEqual(len(self.search(date(2014, 5, 10))['events']), 0)
+        self.assertEqual(len(self.search(date(2014, 5, 11))['events']), 1)
+
+        ev.delete()
+        self.assertEqual(len(self.search(date(2014, 5, 11))['events']), 0)
+
+    def test_range_search_uses_one_query_and_the_cache(self):
+        """A range is searched at once, and cached day by day."""
+        create_event(event_end_date=date(2014, 5, 11))
+        create_event(event_start_date=date(2014, 5, 12))
+        self.search(date(2014, 5, 11))
+        category_registry.invalidate()
+        # Registry, time bounds, first page of the two days having events
+        # and not cached yet, and their descriptions.
+        with self.assertNumQueries(5):
+            sr_data_list = get_range_search_results_data(
+                date(2014, 5, 10), date(2014, 5, 13), self.location.id,
+                'Palo Alto')
+        self.assertEqual([len(sr_data['events']) for sr_data in sr_data_list],
+                         [1, 1, 1, 0])
+        self.assertEqual([sr_data['uid'] for sr_data in sr_data_list],
+                         [0, 1, 2, 3])
+        with self.assertNumQueries(0):
+            get_range_search_results_data(date(2014, 5, 10),
+                                          date(2014, 5, 13),
+                                          self.location.id, 'Palo Alto')
+
+    def test_multi_day_event_bumps_every_day(self):
+        """All the days covered by an event get a new data version."""
+        days = [date(2014, 5, d) for d in (9, 10, 11, 12, 13)]
+        versions = [search_cache.get_data_version(self.location.id, d)
+                    for d in days]
+        create_event(event_end_date=date(2014, 5, 12))
+        new_versions = [search_cache.get_data_version(self.location.id, d)
+                        for d in days]
+        self.assertEqual([a != b for (a, b) in zip(versions, new_versions)],
+                         [False, True, True, True, False])
+
+
+class ApiEventsTestCase(TestCase):
+    def setUp(self):
+        self.dummy_cache = search_cache.cache
+        search_cache.cache = get_cache(
+            'django.core.cache.backends.locmem.LocMemCache')
+        create_event(name='first event')
+
+    def tearDown(self):
+        search_cache.cache.clear()
+        search_cache.cache = self.dummy_cache
+
+    def test_events_json(self):
+        """The API returns the events of the day as JSON."""
+        response = self.client.get('/api/events/', {'date': '2014-05-10'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = json.loads(response.content)
+        self.assertEqual(data['date'], '2014-05-10')
+        self.assertEqual([e['name'] for e in data['events']], ['first event'])
+
+    def test_invalid_request(self):
+        """Invalid requests get the form errors."""
+        response = self.client.get('/api/events/', {'date': 'tomorrow'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date', json.loads(response.content)['errors'])
+
+    def test_conditional_get(self):
+        """Unchanged days get a 304, until one of their events changes."""
+        response = self.client.get('/api/events/', {'date': '2014-05-10'})
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        response = self.client.get('/api/events/', {'date': '2014-05-10'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        create_event(name='second event')
+        response = self.client.get('/api/events/', {'date': '2014-05-10'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)['events']), 2)
+
+    def test_conditional_get_across_processes(self):
+        """
+        Events saved by another process change the ETag of their days, as
+        long as the cache is shared, as it is in production.
+        """
+        call_command('createcachetable', 'cf_test_cache')
+        web_cache = get_cache('django.core.cache.backends.db.DatabaseCache',
+                              LOCATION='cf_test_cache')
+        search_cache.cache = web_cache
+        response = self.client.get('/api/events/', {'date': '2014-05-10'})
+        etag = response['ETag']
+
+        # import_events runs in its own process, with its own cache object.
+        search_cache.cache = get_cache(
+            'django.core.cache.backends.db.DatabaseCache',
+            LOCATION='cf_test_cache')
+        create_event(name='imported event')
+        search_cache.cache = web_cache
+
+        response = self.client.get('/api/events/', {'date': '2014-05-10'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(json.loads(response.content)['events']), 2)
+
+
+class SearchForEventsTestCase(TestCase):
+    def test_only_valid_events_of_location_and_date(self):
+        """Invalid events and events elsewhere or on other days are ignored."""
+        location = create_location()
+        other_location = Location.objects.create(
+            city='Stanford', state_province='CA', zip_code=94305,
+            country='United States', timezone='US/Pacific')
+        ev = create_event(name='b', event_start_time=time(20, 0))
+        ev_early = create_event(name='a', event_start_time=time(9, 0))
+        create_event(is_valid_event=False)
+        create_event(event_location=other_location)
+        create_event(event_start_date=date(2014, 5, 11))
+        with self.assertNumQueries(1):
+            events = list(Event.objects.search_for_events(date(2014, 5, 10),
+                                                          location.id))
+        self.assertEqual(events, [ev_early, ev])
+
+    def test_multi_day_events_are_listed_every_day(self):
+        """Events are returned on every day between their start and end."""
+        location = create_location()
+        ev = create_event(event_end_date=date(2014, 5, 12))
+        for day in (9, 10, 11, 12, 13):
+            events = list(Event.objects.search_for_events(date(2014, 5, day),
+                                                          location.id))
+            self.assertEqual(events, [ev] if 10 <= day <= 12 else [])
+
+        # Shortening the event removes it from the days it no longer covers.
+        ev.event_end_date = date(2014, 5, 11)
+        ev.save()
+        self.assertEqual(
+            list(Event.objects.search_for_events(date(2014, 5, 12),
+                                                 location.id)), [])
+
+    def test_search_by_day(self):
+        """A range of days is searched with a single query."""
+        location = create_location()
+        ev = create_event(event_end_date=date(2014, 5, 11))
+        ev_late = create_event(name='late', event_start_date=date(2014, 5, 11),
+                               event_start_time=time(21, 0))
+        create_event(event_start_date=date(2014, 5, 13))
+        with self.assertNumQueries(2):
+            events_by_day = Event.objects.search_for_events_by_day(
+                date(2014, 5, 9), date(2014, 5, 12), location.id)
+        self.assertEqual(events_by_day,
+                         [(date(2014, 5, 9), []),
+                          (date(2014, 5, 10), [ev]),
+                          (date(2014, 5, 11), [ev, ev_late]),
+                          (date(2014, 5, 12), [])])
+
+    def test_day_events_follow_event_changes(self):
+        """DayEvents copy the data of their event, and are kept in sync."""
+        location = create_location()
+        music = Category.objects.create(base_name=MUSIC)
+        sport = Category.objects.create(base_name=SPORT)
+        ev = create_event(event_end_date=date(2014, 5, 11),
+                          event_end_time=time(20, 0), price=12.5,
+                          description='<p>Some <b>music</b></p>')
+        ev.category.add(music)
+        ev.name = 'renamed'
+        ev.save()
+        sport.event_set.add(ev)
+        with self.assertNumQueries(2):
+            days = DayEvent.objects.search_by_day(
+                date(2014, 5, 10), date(2014, 5, 11), location.id)
+        day_events = [day_events[0] for (d, day_events) in days]
+        self.assertEqual([day_event.name for day_event in day_events],
+                         ['renamed', 'renamed'])
+        self.assertEqual([day_event.start_minutes for day_event in day_events],
+                         [18*60, 18*60])
+        self.assertEqual(day_events[0].end_minutes, 23*60 + 59)
+        self.assertEqual(day_events[0].price, 12.5)
+        self.assertEqual(sorted(day_events[0].get_category_ids()),
+                         [music.id, sport.id])
+        self.assertEqual(day_events[0].description_formatted,
+                         ev.description_formatted)
+
+        music.delete()
+        [(d, day_events)] = DayEvent.objects.search_by_day(
+            date(2014, 5, 10), date(2014, 5, 10), location.id)
+        self.assertEqual(day_events[0].get_category_ids(), [sport.id])
+
+        # Search results are the same whether they are formatted from the
+        # events or from their DayEvents.
+        self.assertEqual(
+            format_sr_data_from_event_list(day_events, date(2014, 5, 10),
+                                           'Palo Alto'),
+            format_sr_data_from_event_list([Event.objects.get(id=ev.id)],
+                                           date(2014, 5, 10), 'Palo Alto'))
+
+    def test_last_day_of_multi_day_event(self):
+        """On its last day, an event is displayed until its end time."""
+        location = create_location()
+        ev = create_event(event_start_date=date(2014, 5, 9),
+                          event_end_date=date(2014, 5, 10),
+                          event_end_time=time(20, 0))
+        [(d, day_events)] = DayEvent.objects.search_by_day(
+            date(2014, 5, 10), date(2014, 5, 10), location.id)
+        self.assertEqual(day_events[0].end_minutes, 20*60)
+        for event_list in [day_events, [ev]]:
+            sr_data = format_sr_data_from_event_list(
+                event_list, date(2014, 5, 10), 'Palo Alto')
+            self.assertNotEqual(sr_data['time_header']['max_time'], '24:00')
+            self.assertEqual(sr_data['events'][0]['duration_minutes'], 120)
+            self.assertLessEqual(
+                sr_data['events'][0]['duration_percent'], 100)
+
+
+@override_settings(SEARCH_RESULTS_PAGE_SIZE=3)
+class SearchPagesTestCase(TestCase):
+    def setUp(self):
+        self.location = create_location()
+        # Events sharing their start time, and even their name, are still
+        # ordered, by ID.
+        for (i, hour) in enumerate([18, 9, 12, 12, 12, 20, 9, 15]):
+            create_event(name='event %d' % (i % 2),
+                         event_start_time=time(hour, 0),
+                         event_end_time=time(min(hour + 3, 23), 0))
+        create_event(name='late', event_start_time=time(21, 0),
+                     event_end_date=date(2014, 5, 11))
+
+    def get_pages(self):
+        pages = [get_search_results_data(date(2014, 5, 10),
+                                         self.location.id, 'Palo Alto')]
+        while pages[-1]['next']:
+            pages.append(get_search_results_data(
+                date(2014, 5, 10), self.location.id, 'Palo Alto',
+                decode_page_cursor(pages[-1]['next'])))
+        return pages
+
+    def test_pages_cover_the_day(self):
+        """Pages follow each other, and are laid out like the whole day."""
+        pages = self.get_pages()
+        self.assertEqual([len(page['events']) for page in pages], [3, 3, 3])
+        [(d, day_events)] = DayEvent.objects.search_by_day(
+            date(2014, 5, 10), date(2014, 5, 10), self.location.id)
+        self.assertEqual([e['id'] for page in pages for e in page['events']],
+                         [day_event.event_id for day_event in day_events])
+        sr_data = format_sr_data_from_event_list(day_events,
+                                                 date(2014, 5, 10),
+                                                 'Palo Alto')
+        for page in pages:
+            self.assertEqual(page['event_count'], 9)
+            self.assertEqual(page['time_header'], sr_data['time_header'])
+        self.assertEqual(pages[-1]['lane_count'], sr_data['lane_count'])
+
+        # Overlapping events never share a lane, whatever their pages.
+        intervals = dict((day_event.event_id, (day_event.start_minutes,
+                                               day_event.end_minutes))
+                         for day_event in day_events)
+        events = [e for page in pages for e in page['events']]
+        for (i, a) in enumerate(events):
+            for b in events[i + 1:]:
+                if intervals[b['id']][0] < intervals[a['id']][1]:
+                    self.assertNotEqual(a['lane'], b['lane'])
+
+    def test_more_events_are_loaded_by_ajax(self):
+        """The search page links to the next page, served as JSON."""
+        response = self.client.get('/search/', {'date': 'Sat May 10 2014'})
+        cursor = response.context['sr_data_list'][0]['next']
+        self.assertContains(response, 'data-next="%s"' % cursor)
+        response = self.client.get('/search/more/', {'date': '2014-05-10',
+                                                     'after': cursor})
+        data = json.loads(response.content)
+        self.assertEqual(data['html'].count('<div class="event"'), 3)
+        self.assertEqual(data['html'].count('<div class="separator">'), 2)
+        self.assertTrue(data['next'])
+
+        response = self.client.get('/search/more/', {'date': '2014-05-10',
+                                                     'after': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('after', json.loads(response.content)['errors'])
+
+    def test_forged_cursor_is_rejected(self):
+        """Cursors not made by the server are rejected, however valid."""
+        response = self.client.get('/search/', {'date': 'Sat May 10 2014'})
+        cursor = response.context['sr_data_list'][0]['next']
+        [after, lane_count, busy_lanes] = decode_page_cursor(cursor)
+        forged = base64.urlsafe_b64encode(json.dumps(
+            [after[0].strftime('%H:%M:%S'), after[1], after[2], 10 ** 12,
+             busy_lanes]))
+        (payload, signature) = cursor.rsplit(':', 1)
+        tampered = '%s:%s%s' % (payload, 'B' if signature[0] == 'A' else 'A',
+                                signature[1:])
+        for after in [forged, payload + ':' + forged, tampered]:
+            response = self.client.get('/search/more/',
+                                       {'date': '2014-05-10', 'after': after})
+            self.assertEqual(response.status_code, 400)
+
+
+class SearchViewTestCase(TestCase):
+    def test_range_search_renders_one_tab_per_day(self):
+        """Each day of the range gets its tab, the first one is selected."""
+        create_event()
+        response = self.client.get('/search/', {'date': 'Sat May 10 2014',
+                                                'end_date': 'Mon May 12 2014'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['sr_data_list']), 3)
+        self.assertContains(response, 'class="results results-events selected"',
+                            count=1)
+        self.assertContains(response, 'class="results results-events"',
+                            count=2)
+
+    def test_range_ending_before_start_is_refused(self):
+        """Invalid ranges redirect to the home page."""
+        create_location()
+        response = self.client.get('/search/', {'date': 'Sat May 10 2014',
+                                                'end_date': 'Fri May 9 2014'})
+        self.assertEqual(response.status_code, 302)
+
+
+class CategorySearchTestCase(TestCase):
+    def setUp(self):
+        self.dummy_cache = search_cache.cache
+        search_cache.cache = get_cache(
+            'django.core.cache.backends.locmem.LocMemCache')
+        self.location = create_location()
+        self.music = Category.objects.create(base_name=MUSIC)
+        self.sport = Category.objects.create(base_name=SPORT)
+        self.concert = create_event(name='concert')
+        self.concert.category.add(self.music)
+        self.game = create_event(name='game')
+        self.game.category.add(self.sport)
+        self.festival = create_event(name='festival')
+        self.festival.category.add(self.music, self.sport)
+        create_event(name='uncategorized')
+        name_resolver.invalidate()
+
+    def tearDown(self):
+        search_cache.cache.clear()
+        search_cache.cache = self.dummy_cache
+
+    def search(self, category):
+        response = self.client.get('/search/', {'date': 'Sat May 10 2014',
+                                                'category': category})
+        return [e['name'] for e in
+                response.context['sr_data_list'][0]['events']]
+
+    def test_search_by_categories(self):
+        """Only the events of the categories searched for are returned."""
+        self.assertEqual(self.search('all'),
+                         ['concert', 'festival', 'game', 'uncategorized'])
+        self.assertEqual(self.search('music'), ['concert', 'festival'])
+        self.assertEqual(self.search('music, sport'),
+                         ['concert', 'festival', 'game'])
+        self.assertEqual(
+            list(Event.objects.search_for_events(
+                date(2014, 5, 10), self.location.id, [self.sport.id])),
+            [self.festival, self.game])
+
+        response = self.client.get('/search/', {'date': 'Sat May 10 2014',
+                                                'category': 'music, opera'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_api_by_categories(self):
+        """The API filters by category too, with its own ETags."""
+        response = self.client.get('/api/events/', {'date': '2014-05-10'})
+        etag = response['ETag']
+        response = self.client.get('/api/events/', {'date': '2014-05-10',
+                                                    'category': 'sport'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([e['name'] for e in
+                          json.loads(response.content)['events']],
+                         ['festival', 'game'])
+
+
+class KeywordSearchTestCase(TestCase):
+    def test_keyword_search_is_ranked(self):
+        """Events matching in their name come first, descriptions count."""
+        ev_desc = create_event(name='evening',
+                               description='<p>Live <b>jazz</b> band</p>')
+        ev_name = create_event(name='Jazz night')
+        create_event(name='Rock concert', description='no jazz here',
+                     is_valid_event=False)
+        create_event(name='Rock concert')
+        self.assertEqual(Event.objects.search_by_keyword('jazz'),
+                         [ev_name, ev_desc])
+        self.assertEqual(Event.objects.search_by_keyword('JAZZ nig'),
+                         [ev_name])
+        self.assertEqual(Event.objects.search_by_keyword('"*'), [])
+
+    def test_keyword_search_follows_saves_and_deletes(self):
+        """The index is updated when events are saved or deleted."""
+        ev = create_event(name='Jazz night')
+        ev.name = 'Blues night'
+        ev.save()
+        self.assertEqual(Event.objects.search_by_keyword('jazz'), [])
+        self.assertEqual(Event.objects.search_by_keyword('blues'), [ev])
+        ev.delete()
+        self.assertEqual(Event.objects.search_by_keyword('blues'), [])
+
+    def test_keyword_search_with_date_and_location(self):
+        """Keyword searches combine with the date and location filters."""
+        location = create_location()
+        ev = create_event(name='Jazz night', event_end_date=date(2014, 5, 11))
+        create_event(name='Jazz night', event_start_date=date(2014, 5, 12))
+        self.assertEqual(Event.objects.search_by_keyword(
+            'jazz', date(2014, 5, 11), location.id), [ev])
+        self.assertEqual(Event.objects.search_by_keyword(
+            'jazz', date(2014, 5, 11), location.id + 1), [])
+        self.assertEqual(len(Event.objects.search_by_keyword(
+            'jazz', location_id=location.id)), 2)
+
+    def test_name_search(self):
+        """Name searches use the index, and ignore the descriptions."""
+        ev = create_event(name='Jazz night')
+        create_event(name='evening', description='jazz band')
+        create_event(name='Jazz brunch', is_valid_event=False)
+        self.assertEqual(Event.objects.name_count('JAZZ'), 1)
+        self.assertEqual(list(Event.objects.search_name_by_keyword('ja nig')),
+                         [ev])
+        self.assertEqual(Event.objects.name_count('band'), 0)
+        self.assertEqual(fulltext.FullTextIndex().search(
+            'jazz', limit=None, names_only=True), [ev.id])
+
+
+class SQLiteWithoutFTS5TestCase(TestCase):
+    def setUp(self):
+        self.has_fts5 = fulltext.sqlite_has_fts5()
+        fulltext._sqlite_has_fts5 = False
+
+    def tearDown(self):
+        fulltext._sqlite_has_fts5 = self.has_fts5
+
+    def test_like_fallback(self):
+        """Without FTS5, events are saved and searched with LIKE."""
+        self.assertTrue(self.has_fts5)
+        self.assertEqual(type(fulltext.get_fulltext_index()),
+                         fulltext.FullTextIndex)
+        ev = create_event(name='Jazz night')
+        self.assertEqual(Event.objects.search_by_keyword('jazz'), [ev])
+
+
+class RecordingCursor(object):
+    """Records the SQL executed through it, and finds nothing."""
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, params=()):
+        self.executed.append((sql, list(params)))
+
+    def executemany(self, sql, param_list):
+        self.executed += [(sql, list(params)) for params in param_list]
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+
+class PostgresFullTextIndexTestCase(TestCase):
+    def setUp(self):
+        self.cursor = RecordingCursor()
+        self.index = fulltext.PostgresFullTextIndex()
+        self.connection = fulltext.connection
+        fake_connection = type('FakeConnection', (object,), {})()
+        fake_connection.ops = self.connection.ops
+        fake_connection.cursor = lambda: self.cursor
+        fulltext.connection = fake_connection
+
+    def tearDown(self):
+        fulltext.connection = self.connection
+
+    def test_create(self):
+        """The column and its GIN index are added if missing."""
+        self.index.create(self.cursor)
+        self.assertEqual([sql for (sql, params) in self.cursor.executed[1:]], [
+            'ALTER TABLE events_event ADD COLUMN search_vector tsvector',
+            'CREATE INDEX events_event_search_vector ON events_event '
+            'USING gin(search_vector)'])
+
+    def test_index_events(self):
+        """Names are weighted A and descriptions B, without their tags."""
+        ev = Event(id=7, name='Jazz night', description='<p>Live jazz</p>')
+        self.index.index_events(self.cursor, [ev])
+        self.assertEqual(self.cursor.executed, [(
+            "UPDATE events_event SET search_vector = "
+            "setweight(to_tsvector('english', %s), 'A') || "
+            "setweight(to_tsvector('english', %s), 'B') WHERE id = %s",
+            ['Jazz night', 'Live jazz', 7])])
+
+    def test_search(self):
+        """Searches are ranked prefix queries, filtered by day and place."""
+        self.index.search('Jazz nig', date(2014, 5, 10), 3)
+        self.index.search('jazz', limit=None, names_only=True)
+        self.assertEqual(self.cursor.executed, [
+            ("SELECT e.id FROM events_event e "
+             "JOIN events_dayevent d ON d.event_id = e.id, "
+             "to_tsquery('english', %s) query "
+             "WHERE e.search_vector @@ query "
+             "AND e.is_valid_event = %s AND d.date = %s "
+             "AND d.event_location_id = %s "
+             "ORDER BY ts_rank(e.search_vector, query) DESC, e.id LIMIT %s",
+             ['jazz:* & nig:*', True, '2014-05-10', 3, 100]),
+            ("SELECT e.id FROM events_event e , "
+             "to_tsquery('english', %s) query "
+             "WHERE e.search_vector @@ query AND e.is_valid_event = %s "
+             "ORDER BY ts_rank(e.search_vector, query) DESC, e.id",
+             ['jazz:*A', True])])
+
+
+class SuggestTestCase(TestCase):
+    def tearDown(self):
+        suggestion_index.invalidate()
+
+    def test_prefix_trie(self):
+        """Names are found from the start of any word, and can be removed."""
+        trie = PrefixTrie()
+        for name in ['Jazz Night', 'jazz brunch', 'Jazz Night',
+                     'An extraordinarily long name']:
+            trie.add(name)
+        self.assertEqual(trie.search('JA'), ['jazz brunch', 'Jazz Night'])
+        self.assertEqual(trie.search('nig'), ['Jazz Night'])
+        self.assertEqual(trie.search('extraordinarily l'),
+                         ['An extraordinarily long name'])
+        self.assertEqual(trie.search('extraordinarily s'), [])
+        self.assertEqual(trie.search('jazz', limit=1), ['jazz brunch'])
+        trie.remove('Jazz Night')
+        self.assertEqual(trie.search('night'), ['Jazz Night'])
+        trie.remove('Jazz Night')
+        trie.remove('jazz brunch')
+        self.assertEqual(trie.search('j'), [])
+        trie.remove('An extraordinarily long name')
+        self.assertEqual(trie._root, {})
+
+    def test_suggest_api(self):
+        """Upcoming events are suggested, and follow saves and deletes."""
+        suggestion_index.invalidate()
+        today = date.today()
+        create_event(name='Jazz night', event_start_date=today)
+        create_event(name='Past jazz', event_start_date=date(2014, 5, 10))
+        Category.objects.create(base_name=MUSIC)
+        response = self.client.get('/api/suggest/', {'q': 'pa'})
+        data = json.loads(response.content)
+        self.assertEqual(data['locations'], ['Palo Alto'])
+        self.assertEqual(data['events'], [])
+
+        ev = create_event(name='Jazz brunch', event_start_date=today)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/suggest/', {'q': 'jaz'})
+        self.assertEqual(json.loads(response.content)['events'],
+                         ['Jazz brunch', 'Jazz night'])
+        ev.delete()
+        response = self.client.get('/api/suggest/', {'q': 'mu'})
+        data = json.loads(response.content)
+        self.assertEqual(data['categories'], [MUSIC])
+        self.assertEqual(suggestion_index.get_suggestions('jazz')['events'],
+                         ['Jazz night'])
+
+    def test_warmed_index(self):
+        """A warmed index answers without querying, until it gets old."""
+        create_event(name='Jazz night', event_start_date=date.today())
+        suggestion_index.warm()
+        with self.assertNumQueries(0):
+            self.assertEqual(suggestion_index.get_suggestions('ja')['events'],
+                             ['Jazz night'])
+        with override_settings(SUGGEST_INDEX_MAX_AGE=-1):
+            with self.assertNumQueries(3):
+                suggestion_index.get_suggestions('ja')
+
+    def test_warm_without_database(self):
+        """A database which cannot be read leaves the index to be built."""
+        class BrokenTrie(PrefixTrie):
+            def __init__(self):
+                raise DatabaseError('no such table: events_event')
+        suggest.PrefixTrie = BrokenTrie
+        try:
+            suggestion_index.warm()
+        finally:
+            suggest.PrefixTrie = PrefixTrie
+        create_event(name='Jazz night', event_start_date=date.today())
+        self.assertEqual(suggestion_index.get_suggestions('ja')['events'],
+                         ['Jazz night'])
+
+    def test_events_saved_while_building(self):
+        """Events saved while the index is built are applied to it."""
+        class SaveEventTrie(PrefixTrie):
+            # The events are loaded, and the event trie is being built.
+            def __init__(self):
+                suggest.PrefixTrie = PrefixTrie
+                create_event(name='Jazz brunch', event_start_date=date.today())
+                super(SaveEventTrie, self).__init__()
+        suggest.PrefixTrie = SaveEventTrie
+        try:
+            suggestion_index.warm()
+        finally:
+            suggest.PrefixTrie = PrefixTrie
+        self.assertEqual(suggestion_index.get_suggestions('ja')['events'],
+                         ['Jazz brunch'])
+
+
+class GeoSearchTestCase(TestCase):
+    # Palo Alto downtown, Stanford campus and San Francisco.
+    PALO_ALTO = (37.4443, -122.1598)
+    STANFORD = (37.4275, -122.1697)
+    SAN_FRANCISCO = (37.7749, -122.4194)
+
+    def test_grid_cells(self):
+        """The cells of a bounding box contain all the points in the box."""
+        self.assertAlmostEqual(get_distance_km(*(self.PALO_ALTO +
+                                                 self.SAN_FRANCISCO)),
+                               43.3, places=1)
+        cells = get_geo_cells(get_bounding_box(self.PALO_ALTO[0],
+                                               self.PALO_ALTO[1], 5))
+        self.assertIn(get_geo_cell(*self.PALO_ALTO), cells)
+        self.assertIn(get_geo_cell(*self.STANFORD), cells)
+        self.assertNotIn(get_geo_cell(*self.SAN_FRANCISCO), cells)
+        self.assertIsNone(get_geo_cells(get_bounding_box(0, 0, 1000)))
+        self.assertIsNone(get_geo_cell(None, None))
+
+    def test_search_near(self):
+        """Events within the radius are returned, closest first."""
+        ev_far = create_event(latitude=self.STANFORD[0],
+                              longitude=self.STANFORD[1])
+        ev_close = create_event(latitude=self.PALO_ALTO[0],
+                                longitude=self.PALO_ALTO[1],
+                                event_start_date=date(2014, 5, 9),
+                                event_end_date=date(2014, 5, 10))
+        create_event(latitude=self.SAN_FRANCISCO[0],
+                     longitude=self.SAN_FRANCISCO[1])
+        create_event()
+        events = Event.objects.search_near(date(2014, 5, 10), 37.445,
+                                           -122.16, 5)
+        self.assertEqual(events, [ev_close, ev_far])
+        self.assertLess(events[0].distance_km, 0.1)
+        self.assertEqual(Event.objects.search_near(date(2014, 5, 10), 37.445,
+                                                   -122.16, 1), [ev_close])
+        self.assertEqual(len(Event.objects.search_near(
+            date(2014, 5, 10), 37.445, -122.16, 1000)), 3)
+
+        # Moving an event moves it in the spatial index.
+        ev_far.latitude, ev_far.longitude = self.SAN_FRANCISCO
+        ev_far.save()
+        self.assertEqual(Event.objects.search_near(date(2014, 5, 10), 37.445,
+                                                   -122.16, 5), [ev_close])
+
+    def test_geocoding_table(self):
+        """Addresses are geocoded from the table, in any spelling."""
+        GeocodedAddress.objects.remember('250 University Ave.', 37.4467,
+                                         -122.1611)
+        self.assertEqual(GeocodedAddress.objects.geocode('250 university ave'),
+                         (37.4467, -122.1611))
+        GeocodedAddress.objects.remember('250  University Ave', 37.4468,
+                                         -122.1612)
+        self.assertEqual(GeocodedAddress.objects.count(), 1)
+        self.assertEqual(GeocodedAddress.objects.geocode('250 University Ave'),
+                         (37.4468, -122.1612))
+        self.assertIsNone(GeocodedAddress.objects.geocode('1 Main St'))
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        create_fixture_day()
+        category_registry.invalidate()
+        facet_registry.invalidate()
+        name_resolver.invalidate()
+
+    def test_stats_header(self):
+        """Responses report their view and the time spent in SQL."""
+        response = self.client.get('/')
+        self.assertTrue(re.match(
+            r'view=cfsite\.apps\.events\.views\.home; queries=\d+; '
+            r'time=[\d.]+ms; slowest=', response['X-Query-Stats']))
+
+    @override_settings(QUERY_STATS_ENABLED=False)
+    def test_stats_disabled(self):
+        """Queries are only reported where enabled."""
+        response = self.client.get('/')
+        self.assertFalse(response.has_header('X-Query-Stats'))
+
+    def test_home_budget(self):
+        self.assertQueryBudget(2, '/')
+
+    def test_search_budget(self):
+        response = self.assertQueryBudget(6, '/search/',
+                                          {'date': 'Sat May 10 2014'})
+        sr_data = response.context['sr_data_list'][0]
+        self.assertEqual(len(sr_data['events']),
+                         settings.SEARCH_RESULTS_PAGE_SIZE)
+        self.assertEqual(sr_data['event_count'], FIXTURE_DAY_EVENTS)
+
+    def test_admin_changelist_budget(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.assertQueryBudget(8, '/admin/events/event/')
+
+
+class SyntheticEventsTestCase(TestCase):
+    def test_synthetic_events_are_complete(self):
+        """Generated events get their categories, days and derived fields."""
+        create_synthetic_events(300, seed=1)
+        events = list(Event.objects.prefetch_related('category'))
+        self.assertEqual(len(events), 300)
+        self.assertTrue(all(event.category.all() for event in events))
+        self.assertEqual(DayEvent.objects.count(),
+                         sum(len(event.dates) for event in events))
+        self.assertTrue(any(len(event.dates) > 1 for event in events))
+        self.assertTrue(any(event.description_has_images for event in events))
+        valid_event = [event for event in events if event.is_valid_event][0]
+        self.assertIn(valid_event, Event.objects.search_by_keyword(
+            valid_event.name, limit=300))
+
+    def test_events_saved_afterwards_get_fresh_ids(self):
+        """The ID sequence is moved past the IDs of the synthetic events."""
+        create_synthetic_events(30, seed=1)
+        last_id = Event.objects.aggregate(Max('id'))['id__max']
+        event = create_event(name='saved afterwards')
+        self.assertGreater(event.id, last_id)
+        self.assertEqual(Event.objects.count(), 31)
+
+
+class RebuildDayEventsTestCase(TestCase):
+    def test_rebuild_in_batches(self):
+        """Missing and stale DayEvents are rebuilt, across batches."""
+        events = [create_event(name='event %d' % i) for i in range(5)]
+        DayEvent.objects.filter(event=events[0]).delete()
+        Event.objects.filter(id=events[1].id).update(
+            event_end_date=date(2014, 5, 12))
+        old_batch_size = RebuildDayEventsCommand.batch_size
+        RebuildDayEventsCommand.batch_size = 2
+        try:
+            out = StringIO()
+            call_command('rebuild_day_events', stdout=out)
+        finally:
+            RebuildDayEventsCommand.batch_size = old_batch_size
+        self.assertEqual(out.getvalue().strip(),
+                         'Listed the days of 5 events')
+        self.assertEqual(DayEvent.objects.count(), 7)
+        self.assertEqual(
+            list(DayEvent.objects.filter(event=events[1])
+                 .order_by('date').values_list('date', flat=True)),
+            [date(2014, 5, 10), date(2014, 5, 11), date(2014, 5, 12)])
+
+
+class UpgradeSchemaTestCase(TestCase):
+    def setUp(self):
+        self.cursor = connection.cursor()
+        self.cursor.execute('ALTER TABLE events_event DROP COLUMN geo_cell')
+        self.indexes = connection.creation.sql_indexes_for_model(DayEvent,
+                                                                 no_style())
+        for sql in self.indexes:
+            self.cursor.execute(
+                'DROP INDEX %s' % re.match(r'CREATE INDEX (\S+)', sql).group(1))
+
+    def get_columns(self, table):
+        return [row[0] for row in connection.introspection
+                .get_table_description(self.cursor, table)]
+
+    def test_print_sql(self):
+        """--sql lists the missing column and indexes without adding them."""
+        out = StringIO()
+        call_command('upgrade_schema', sql=True, stdout=out)
+        self.assertIn('ADD COLUMN "geo_cell"', out.getvalue())
+        self.assertEqual(out.getvalue().count('CREATE INDEX'),
+                         len(self.indexes))
+        self.assertNotIn('geo_cell', self.get_columns('events_event'))
+
+    def test_upgrade(self):
+        """The missing column and indexes are added, once."""
+        call_command('upgrade_schema', stdout=StringIO())
+        self.assertIn('geo_cell', self.get_columns('events_event'))
+        for model in (Event, DayEvent):
+            self.assertEqual(
+                get_upgrade_statements(self.cursor, model), [])
+        ev = create_event(latitude=37.44, longitude=-122.16)
+        self.assertEqual(Event.objects.get(geo_cell=ev.geo_cell), ev)
+
+
+class EventFragmentCacheTestCase(TestCase):
+    def setUp(self):
+        self.dummy_cache = search_cache.cache
+        search_cache.cache = get_cache(
+            'django.core.cache.backends.locmem.LocMemCache')
+        self.location = create_location()
+
+    def tearDown(self):
+        search_cache.cache.clear()
+        search_cache.cache = self.dummy_cache
+
+    def render(self):
+        self.sr_data = render_event_fragments(get_range_search_results_data(
+            date(2014, 5, 10), date(2014, 5, 10), self.location.id,
+            'Palo Alto'))[0]
+        return self.sr_data['events']
+
+    def test_fragments_are_rendered_once(self):
+        """Events are rendered on the first search, then read from cache."""
+        ev = create_event(name='first event')
+        create_event(name='second event')
+        events = self.render()
+        self.assertEqual(len(events), 2)
+        self.assertIn('first event', events[0]['html'])
+        key = search_cache.get_event_fragment_key(
+            events[0], self.sr_data['time_header']['min_time'],
+            self.sr_data['time_header']['max_time'])
+        self.assertEqual(search_cache.cache.get(key), events[0]['html'])
+
+        search_cache.cache.set(key, 'cached fragment')
+        self.assertEqual([e['html'] for e in self.render()],
+                         ['cached fragment', events[1]['html']])
+
+        ev.name = 'renamed event'
+        ev.save()
+        events = self.render()
+        self.assertIn('renamed event', events[0]['html'])
+
+    def test_search_page_stitches_fragments(self):
+        """The search page shows the fragments of all the events."""
+        for i in range(3):
+            create_event(name='event %d' % i)
+        response = self.client.get('/search/', {'date': 'Sat May 10 2014'})
+        for i in range(3):
+            self.assertContains(response, 'event %d' % i, count=2)
+        self.assertContains(response, '<div class="separator">', count=2)
+
+
+class StaticAssetsTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'js'))
+        self.content = 'var a = 1;\n' * 100
+        for name in ['js/cf.js', 'js/cf.0123456789ab.js']:
+            with open(os.path.join(self.root, name), 'wb') as f:
+                f.write(self.content)
+        with open(os.path.join(self.root, 'js/cf.0123456789ab.js.gz'),
+                  'wb') as f:
+            f.write(gzip_compress(self.content))
+        self.app = PrecompressedStaticFiles(
+            lambda environ, start_response: ['site'], self.root, '/static/')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def get(self, path, accept_encoding=''):
+        response = {}
+
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+        body = ''.join(self.app({'PATH_INFO': path, 'REQUEST_METHOD': 'GET',
+                                 'HTTP_ACCEPT_ENCODING': accept_encoding},
+                                start_response))
+        return response.get('status'), response.get('headers'), body
+
+    def test_precompressed_variants_are_served(self):
+        """Hashed files are cached for good, compressed when accepted."""
+        (status, headers, body) = self.get('/static/js/cf.0123456789ab.js',
+                                           'gzip, deflate')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Cache-Control'], HASHED_CACHE_CONTROL)
+        self.assertEqual(body, gzip_compress(self.content))
+
+        (status, headers, body) = self.get('/static/js/cf.0123456789ab.js',
+                                           'gzip;q=0')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(body, self.content)
+        (status, headers, body) = self.get('/static/js/cf.js', 'gzip')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertNotEqual(headers['Cache-Control'], HASHED_CACHE_CONTROL)
+
+        self.assertEqual(self.get('/static/../js/cf.js')[0], '404 NOT FOUND')
+        self.assertEqual(self.get('/search/')[2], 'site')
+
+    def test_bundles_and_minification(self):
+        """Bundles are included as one file once built."""
+        self.assertEqual(minify_css('/* c */ a , b {\n  color: red;\n}\n'),
+                         'a,b{color: red}')
+        template = Template('{% load static_bundles %}'
+                            '{% static_bundle "css/search.bundle.css" %}')
+        self.assertEqual(template.render(Context()).count('<link'), 2)
+        with override_settings(STATIC_BUNDLES_ENABLED=True):
+            self.assertEqual(template.render(Context()),
+                             '<link href="/static/css/search.bundle.css" '
+                             'rel="stylesheet">')
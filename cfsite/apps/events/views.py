@@ -2,31 +2,30 @@ __author__ = "Georges Goetz"
 __email__ = "ggoetz@stanford.edu"
 __status__ = "Prototype"
 
-import datetime, math
+import datetime, math, json, heapq, hashlib
+from django.conf import settings
 from django.shortcuts import render
-from django.http import HttpResponseRedirect
-from cfsite.apps.events.models import Location, Category, Event, CF_CATEGORIES
+from django.template import Context
+from django.template.loader import get_template
+from django.http import HttpResponse, HttpResponseRedirect
+from django.utils.cache import patch_cache_control
+from django.utils.encoding import force_text
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import condition, require_GET
+from cfsite.apps.events.models import Location, Category, Event, DayEvent, \
+    get_display_minutes
 from cfsite.apps.events.forms import SearchForm
-from cfsite.apps.crawlers.parsers import MLStripper, MLTagDetector, MLFormatter
-
-# Category logo and verbose names. Order of the list matters and should match
-# category IDs. Pretty clunky...
-DB_TO_CSS_NAME = dict(zip(CF_CATEGORIES, ['arts-culture',
-                                     'classes-workshops',
-                                     'conference',
-                                     'family',
-                                     'food-wine',
-                                     'meetup',
-                                     'music',
-                                     'sports']))
-DB_TO_VERBOSE_NAME = dict(zip(CF_CATEGORIES, ['arts &amp; culture',
-                                         'classes &amp; workshops',
-                                         'conference',
-                                         'family',
-                                         'food &amp; wine',
-                                         'meetup',
-                                         'music',
-                                         'sports']))
+from cfsite.apps.events import search_cache
+from cfsite.apps.events.paging import encode_page_cursor
+from cfsite.apps.events.suggest import suggestion_index, MAX_SUGGESTIONS
+from cfsite.apps.events.registry import category_registry, facet_registry, \
+    DB_TO_CSS_NAME, DB_TO_VERBOSE_NAME
+
+
+# Day and month names, for display purposes
+WEEKDAY_NUM_TO_STR = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+MONTH_NUM_TO_STR = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug',
+                    'Sep', 'Oct', 'Nov', 'Dec']
 
 
 # The event related views are here.
@@ -39,9 +38,10 @@ def home(request):
     invalid data, and if so, resets the user's valid data.
 
     """
-    # Set approved list of categories and locations.
-    category_list = list(set([c.base_name for c in Category.objects.all()]))
-    location_list = list(set([c.city for c in Location.objects.all()]))
+    # Set approved list of categories and locations. They are served from
+    # memory, see FacetRegistry.
+    category_list = facet_registry.get_category_names()
+    location_list = facet_registry.get_city_names()
 
     # parse GET request if it exists.
     # If it exists, it comes from a redirect from the search() view, due to
@@ -75,40 +75,227 @@ def search(request):
     """
     if request.method == 'GET':
         formatted_request = format_search_get_request(request.GET)
-        print formatted_request
         form = SearchForm(formatted_request)
         is_good_form = form.is_valid()
-        print form.errors
     else:
         form = SearchForm()
         is_good_form = form.is_valid()
 
     # If no errors in the form, we can proceed with the search
     if is_good_form:
-        event_list = Event.objects.search_for_events(
-            form.get_date(),
-            form.get_location_id()
-        )
-
-        search_results_data = format_sr_data_from_event_list(event_list,
-                                                             form.get_date(),
-                                                             form.get_location())
+        sr_data_list = get_range_search_results_data(form.get_date(),
+                                                     form.get_end_date(),
+                                                     form.get_location_id(),
+                                                     form.get_location(),
+                                                     form.get_category_ids())
+        sr_data_list = render_event_fragments(sr_data_list)
         return render(request, 'search_results.html',
-                      {'sr_data': search_results_data, })
+                      {'sr_data_list': sr_data_list,
+                       'category_requested': form.get_category()})
     # If errors, redirect to the home page.
     else:
         return HttpResponseRedirect('/?' + request.GET.urlencode())
 
 
+def get_api_search_form(request):
+    """ get_api_search_form(request)
+    ----------
+    Returns the validated SearchForm of an API request. The form is built
+    only once per request, since the conditional GET helpers and the view
+    all need it.
+
+    """
+    if not hasattr(request, 'cf_search_form'):
+        form = SearchForm(format_api_get_request(request.GET))
+        form.is_valid()
+        request.cf_search_form = form
+    return request.cf_search_form
+
+
+def get_api_data_version(request):
+    """ get_api_data_version(request)
+    ----------
+    Returns the data version of the day requested through the API, or None
+    if the request is invalid. Versions live in the cache, which must be
+    shared with the processes importing events for the ETag and
+    Last-Modified headers to change with their imports (see search_cache).
+
+    """
+    form = get_api_search_form(request)
+    if form.errors:
+        return None
+    if not hasattr(request, 'cf_data_version'):
+        request.cf_data_version = search_cache.get_data_version(
+            form.get_location_id(), form.get_date())
+    return request.cf_data_version
+
+
+def api_events_etag(request):
+    """ api_events_etag(request)
+    ----------
+    Returns the ETag of the events requested through the API: the location,
+    date and data version of that day, the categories requested, and a
+    digest of the page cursor for pages after the first. None if the request
+    is invalid.
+
+    """
+    version = get_api_data_version(request)
+    if version is None:
+        return None
+    form = get_api_search_form(request)
+    etag = '%d-%s-%d-%s' % (form.get_location_id(),
+                            form.get_date().isoformat(), version,
+                            '.'.join(str(category_id) for category_id in
+                                     form.get_category_ids()) or 'all')
+    if form.get_page_cursor() is not None:
+        etag += '-' + hashlib.md5(request.GET['after']).hexdigest()
+    return etag
+
+
+def api_events_last_modified(request):
+    """ api_events_last_modified(request)
+    ----------
+    Returns the last time the events requested through the API changed,
+    from the data version of that day. None if the request is invalid.
+
+    """
+    version = get_api_data_version(request)
+    if version is None:
+        return None
+    return datetime.datetime.utcfromtimestamp(version / 1000.0)
+
+
+@require_GET
+@condition(etag_func=api_events_etag,
+           last_modified_func=api_events_last_modified)
+def api_events(request):
+    """ api_events(request)
+    ----------
+    JSON version of the search. Validates the request like search() does,
+    and returns the events of the day as compact JSON, with the same event
+    data the search results page is rendered from. Events can be restricted
+    to several categories, with their names separated by commas.
+    Events come by pages of settings.SEARCH_RESULTS_PAGE_SIZE, like on the
+    search results page: the next field is the cursor to send as the after
+    parameter to get the next page, null on the last page.
+    Responses carry an ETag and a Last-Modified header, so that clients can
+    revalidate them: a 304 is returned as long as the events of that day
+    did not change.
+    Invalid requests get a 400 response with the form errors.
+
+    """
+    form = get_api_search_form(request)
+    if form.errors:
+        return get_form_errors_response(form)
+
+    sr_data = get_search_results_data(form.get_date(),
+                                      form.get_location_id(),
+                                      form.get_location(),
+                                      form.get_page_cursor(),
+                                      form.get_category_ids())
+    api_data = dict(date=form.get_date().isoformat(),
+                    location=form.get_location(),
+                    categories=sr_data['categories'],
+                    time_header=sr_data['time_header'],
+                    lane_count=sr_data['lane_count'],
+                    event_count=sr_data['event_count'],
+                    next=sr_data['next'],
+                    events=sr_data['events'])
+    response = HttpResponse(json.dumps(api_data, separators=(',', ':')),
+                            content_type='application/json')
+    # Clients should always revalidate, the data can change at any time.
+    patch_cache_control(response, max_age=0, must_revalidate=True)
+    return response
+
+
+@require_GET
+def search_more(request):
+    """ search_more(request)
+    ----------
+    Loads the next page of the events of a search results tab, as the user
+    scrolls down. The request is validated like API requests are (ISO
+    dates), with the page cursor of the tab as the after parameter and the
+    categories of the search.
+    Returns as compact JSON the events of the page, rendered like on the
+    search results page, the cursor of the page after it (null on the last
+    page) and the number of lanes the events of the tab now take.
+    Invalid requests get a 400 response with the form errors.
+
+    """
+    form = SearchForm(format_api_get_request(request.GET))
+    if not form.is_valid():
+        return get_form_errors_response(form)
+
+    sr_data = get_search_results_data(form.get_date(),
+                                      form.get_location_id(),
+                                      form.get_location(),
+                                      form.get_page_cursor(),
+                                      form.get_category_ids())
+    [sr_data] = render_event_fragments([sr_data])
+    html = get_template('search_results_body_content_events.html').render(
+        Context({'event_list': sr_data['events']}))
+    return HttpResponse(json.dumps(dict(html=html,
+                                        next=sr_data['next'],
+                                        lane_count=sr_data['lane_count']),
+                                   separators=(',', ':')),
+                        content_type='application/json')
+
+
+@require_GET
+def api_suggest(request):
+    """ api_suggest(request)
+    ----------
+    Typeahead suggestions for the search boxes. Returns as compact JSON the
+    city names, category names and upcoming event names having a word
+    starting with the q parameter, at most MAX_SUGGESTIONS of each, or the
+    number requested with the limit parameter if it is lower.
+    Suggestions are served from memory, see SuggestionIndex.
+
+    """
+    query = request.GET.get('q', u'')
+    try:
+        limit = min(int(request.GET.get('limit', MAX_SUGGESTIONS)),
+                    MAX_SUGGESTIONS)
+    except ValueError:
+        limit = MAX_SUGGESTIONS
+
+    if query.strip() and limit > 0:
+        suggestions = suggestion_index.get_suggestions(query, limit)
+    else:
+        suggestions = dict(locations=[], categories=[], events=[])
+    suggestions['query'] = query
+    return HttpResponse(json.dumps(suggestions, separators=(',', ':')),
+                        content_type='application/json')
+
+
 # Helper functions underneath
+def get_form_errors_response(form):
+    """ get_form_errors_response(form)
+    ----------
+    Returns the 400 response of the JSON views to an invalid request: the
+    errors of each field of the form, as compact JSON.
+
+    @type form: SearchForm
+    @rtype: HttpResponse
+    """
+    errors = dict((field, [force_text(e) for e in field_errors])
+                  for (field, field_errors) in form.errors.items())
+    return HttpResponse(json.dumps({'errors': errors},
+                                   separators=(',', ':')),
+                        content_type='application/json', status=400)
+
+
 def format_search_get_request(get_request):
     """ format_search_get_request(get_request)
     ----------
     Formats a get request from the index.html into a dictionary the SearchForm
     has a chance of understanding. The date field especially is not formatted
     correctly by default and needs to be changed accordingly.
-    For the prototype, this function forces the user to search for 'all' events
-    on 'Palo Alto'.
+    For the prototype, this function forces the user to search for events
+    on 'Palo Alto'. The category defaults to 'all'.
+
+    The optional end_date field, for searches covering several days, is
+    formatted like the date field.
 
     @param get_request: QueryDict representing the user's GET request.
 
@@ -118,70 +305,343 @@ def format_search_get_request(get_request):
     new_dict = get_request.dict()
 
     try:
-        # Force category to 'all' here
-        new_dict[u'category'] = u'all'
+        # Search all the categories unless some were selected
+        if not new_dict.get(u'category'):
+            new_dict[u'category'] = u'all'
 
         # Force location to 'Palo Alto' here
         new_dict[u'location'] = u'Palo Alto'
 
-        # Format date field here
-        date_str = new_dict[u'date'].split(u' ')
-        if len(date_str) != 4:
-            new_dict[u'date'] = ''
-        else:
-            month_str_to_num = dict(Jan=1, Feb=2, Mar=3, Apr=4, May=5, Jun=6,
-                                    Jul=7, Aug=8, Sep=9, Oct=10, Nov=11,
-                                    Dec=12)
-            new_dict[u'date'] = datetime.date(int(date_str[3]),
-                                              month_str_to_num[date_str[1]],
-                                              int(date_str[2]))
+        # Format date fields here
+        month_str_to_num = dict(Jan=1, Feb=2, Mar=3, Apr=4, May=5, Jun=6,
+                                Jul=7, Aug=8, Sep=9, Oct=10, Nov=11,
+                                Dec=12)
+        for field in [u'date', u'end_date']:
+            if field not in new_dict:
+                continue
+            date_str = new_dict[field].split(u' ')
+            if len(date_str) != 4:
+                new_dict[field] = ''
+            else:
+                new_dict[field] = datetime.date(int(date_str[3]),
+                                                month_str_to_num[date_str[1]],
+                                                int(date_str[2]))
     finally:
         return new_dict
 
 
-def format_sr_data_from_event_list(event_list, date, location):
+def get_search_results_data(date, location_id, location, page_cursor=None,
+                            category_ids=None):
+    """ get_search_results_data(date, location_id, location, page_cursor=None,
+                                category_ids=None)
+    ----------
+    Returns the search_results template contextual data for a page of the
+    events of a location on a date, restricted to some categories if
+    requested. The first page is served from the search results cache when
+    the events of that day have not changed since it was computed.
+
+    @param date: date of the search
+    @type date: datetime.date
+
+    @param location_id: ID of the location of the search
+    @type location_id: int
+
+    @param location: name of the location, as requested by the user
+    @type location: str
+
+    @param page_cursor: decoded cursor of the page (see decode_page_cursor),
+           None for the first page.
+
+    @param category_ids: IDs of the categories of the search, all of them if
+           None or empty.
+    @type category_ids: [int]
+
+    @return: the search_results template contextual data.
+    @rtype: dict
+    """
+    if page_cursor is not None:
+        return format_sr_data_pages([date], location_id, location,
+                                    page_cursor=page_cursor,
+                                    category_ids=category_ids)[date]
+
+    key = search_cache.get_search_results_key(location_id, date,
+                                              category_ids)
+    sr_data = search_cache.get_search_results(key)
+    if sr_data is None:
+        sr_data = format_sr_data_pages([date], location_id, location,
+                                       category_ids=category_ids)[date]
+        search_cache.set_search_results(key, sr_data)
+    else:
+        # The cached data may have been requested with another spelling of
+        # the location name.
+        sr_data = dict(sr_data, location_requested=location)
+    return sr_data
+
+
+def get_range_search_results_data(start_date, end_date, location_id,
+                                  location, category_ids=None):
+    """ get_range_search_results_data(start_date, end_date, location_id,
+                                      location, category_ids=None)
+    ----------
+    Returns the search_results template contextual data for the first page
+    of the events of each day from start_date to end_date (included), one
+    results tab per day. Events can be restricted to some categories.
+    Days are served from the search results cache when possible. The other
+    days are formatted together, sharing the same category data, see
+    format_sr_data_pages.
+
+    @param start_date: first date of the search
+    @type start_date: datetime.date
+
+    @param end_date: last date of the search
+    @type end_date: datetime.date
+
+    @param location_id: ID of the location of the search
+    @type location_id: int
+
+    @param location: name of the location, as requested by the user
+    @type location: str
+
+    @param category_ids: IDs of the categories of the search, all of them if
+           None or empty.
+    @type category_ids: [int]
+
+    @return: the search_results template contextual data of every day, in
+             chronological order. Each day has its own tab uid, its index.
+    @rtype: [dict]
+    """
+    n_days = (end_date - start_date).days + 1
+    dates = [start_date + datetime.timedelta(days=i) for i in range(n_days)]
+    keys = search_cache.get_search_results_keys(location_id, dates,
+                                                category_ids)
+    sr_data_by_key = search_cache.get_many_search_results(keys)
+
+    missing_dates = [d for (d, key) in zip(dates, keys)
+                     if key not in sr_data_by_key]
+    if missing_dates:
+        sr_data_by_date = format_sr_data_pages(missing_dates, location_id,
+                                               location,
+                                               category_ids=category_ids)
+        key_by_date = dict(zip(dates, keys))
+        new_sr_data_by_key = dict((key_by_date[d], sr_data)
+                                  for (d, sr_data) in sr_data_by_date.items())
+        search_cache.set_many_search_results(new_sr_data_by_key)
+        sr_data_by_key.update(new_sr_data_by_key)
+
+    # The cached data may have been requested with another spelling of the
+    # location name, and was cached with another tab uid.
+    return [dict(sr_data_by_key[key], location_requested=location, uid=i)
+            for (i, key) in enumerate(keys)]
+
+
+def format_sr_data_pages(dates, location_id, location, categories_val=None,
+                         page_cursor=None, category_ids=None):
+    """ format_sr_data_pages(dates, location_id, location,
+                             categories_val=None, page_cursor=None,
+                             category_ids=None)
+    ----------
+    Returns the search_results template contextual data for a page of the
+    events of a location on each of the dates, settings.SEARCH_RESULTS_PAGE_SIZE
+    events at most.
+    When categories are given, only their events are read from the
+    database: the DayEvents are filtered on the category index of the
+    events categories table (see get_category_event_ids), and the category
+    IDs of each event come with its DayEvent.
+    The number of events and the time bounds of every day are read with a
+    single aggregate query, so that the time header is the same on all the
+    pages of a day. Pages are then read from the DayEvent table, one keyset
+    query per day having events, and the formatted descriptions of all of
+    them with a last query.
+    Each page comes with the cursor of the next one, if any: its next field.
+
+    @param dates: dates of the search, in chronological order.
+    @type dates: [datetime.date]
+
+    @param location_id: ID of the location of the search
+    @type location_id: int
+
+    @param location: name of the location, as requested by the user
+    @type location: str
+
+    @param categories_val: the category data for the JS helper, as returned
+           by build_category_data(). Optional.
+    @type categories_val: [dict]
+
+    @param page_cursor: decoded cursor of the page (see decode_page_cursor)
+           when a single date is searched, None for the first pages.
+
+    @param category_ids: IDs of the categories of the search, all of them if
+           None or empty.
+    @type category_ids: [int]
+
+    @return: the search_results template contextual data, indexed by date.
+    @rtype: dict
+    """
+    if categories_val is None:
+        categories_val = build_category_data()
+    if page_cursor is None:
+        page_cursor = [None, 0, []]
+    [after, lane_count, busy_lanes] = page_cursor
+    page_size = settings.SEARCH_RESULTS_PAGE_SIZE
+
+    day_bounds = DayEvent.objects.get_day_bounds(dates[0], dates[-1],
+                                                 location_id, category_ids)
+    pages = {}
+    for d in dates:
+        if d in day_bounds:
+            # One more event than the page holds tells if there is another
+            # page.
+            pages[d] = DayEvent.objects.search_page(d, location_id, after,
+                                                    page_size + 1,
+                                                    category_ids)
+        else:
+            pages[d] = []
+    DayEvent.objects.set_descriptions(
+        [day_event for page in pages.values() for day_event in
+         page[:page_size]])
+
+    sr_data_by_date = {}
+    for d in dates:
+        if d in day_bounds:
+            time_bounds = calculate_day_time_bounds(day_bounds[d], d)
+            event_count = day_bounds[d]['count']
+        else:
+            time_bounds = None
+            event_count = 0
+        page_busy_lanes = list(busy_lanes)
+        sr_data = format_sr_data_from_event_list(
+            pages[d][:page_size], d, location, categories_val, time_bounds,
+            page_busy_lanes, lane_count)
+        if len(pages[d]) > page_size:
+            last = pages[d][page_size - 1]
+            # Lanes free by the start of the last event are free for all the
+            # events of the next page.
+            next_val = encode_page_cursor(
+                (last.event_start_time, last.name, last.event_id),
+                sr_data['lane_count'],
+                [(end, lane) for (end, lane) in page_busy_lanes
+                 if end > last.start_minutes])
+        else:
+            next_val = None
+        sr_data.update(date=d.isoformat(),
+                       event_count=event_count,
+                       next=next_val)
+        sr_data_by_date[d] = sr_data
+    return sr_data_by_date
+
+
+def render_event_fragments(sr_data_list):
+    """ render_event_fragments(sr_data_list)
+    ----------
+    Renders the HTML of every event of the search results, so that the
+    events graph template only has to stitch them together.
+    The fragments of all the events are fetched from the cache at once. The
+    missing ones are rendered with search_results_body_content_event.html,
+    and cached at once.
+
+    @param sr_data_list: the search_results template contextual data of
+           every day, as returned by get_range_search_results_data.
+    @type sr_data_list: [dict]
+
+    @return: a copy of sr_data_list, in which each event has an html field.
+    @rtype: [dict]
+    """
+    keys_list = [[search_cache.get_event_fragment_key(
+                  event_data, sr_data['time_header']['min_time'],
+                  sr_data['time_header']['max_time'])
+                  for event_data in sr_data['events']]
+                 for sr_data in sr_data_list]
+    fragments = search_cache.get_event_fragments(
+        [key for keys in keys_list for key in keys])
+
+    new_fragments = {}
+    template = get_template('search_results_body_content_event.html')
+    for (sr_data, keys) in zip(sr_data_list, keys_list):
+        for (event_data, key) in zip(sr_data['events'], keys):
+            if key not in fragments and key not in new_fragments:
+                new_fragments[key] = template.render(
+                    Context({'event': event_data}))
+    if new_fragments:
+        search_cache.set_event_fragments(new_fragments)
+        fragments.update(new_fragments)
+
+    return [dict(sr_data, events=[dict(event_data,
+                                       html=mark_safe(fragments[key]))
+                                  for (event_data, key)
+                                  in zip(sr_data['events'], keys)])
+            for (sr_data, keys) in zip(sr_data_list, keys_list)]
+
+
+def format_api_get_request(get_request):
+    """ format_api_get_request(get_request)
+    ----------
+    Formats a GET request made to the API into a dictionary the SearchForm
+    understands. Unlike the search page, the API expects dates in the ISO
+    format (2014-05-10). Location and category default to 'Palo Alto' and
+    'all'.
+
+    @param get_request: QueryDict representing the API GET request.
+
+    @return: dict representing the formatted GET request.
+    @rtype: dict
+    """
+    new_dict = get_request.dict()
+    new_dict.setdefault(u'category', u'all')
+    new_dict.setdefault(u'location', u'Palo Alto')
+    return new_dict
+
+
+def format_sr_data_from_event_list(event_list, date, location,
+                                   categories_val=None, time_bounds=None,
+                                   busy_lanes=None, lane_count=0):
     """ format_sr_data_from_event_list
     ----------
     This function creates the search_results template contextual data from
     a list of events.
+    The list can be a page of the events of the day: the time bounds of the
+    whole day and the lanes taken by the events of the previous pages are
+    then given, so that all the pages are laid out alike.
 
-    @param event_list: an array of event matching the user's query.
-    @type event_list: [Event]
+    @param event_list: an array of event matching the user's query, as
+           events or as their DayEvents on the date of the search.
+    @type event_list: [Event] or [DayEvent]
 
     @param date: date of the search
     @type date: datetime.date()
 
+    @param categories_val: the category data for the JS helper, as returned
+           by build_category_data(). Optional, so that searches covering
+           several days can build it only once.
+    @type categories_val: [dict]
+
+    @param time_bounds: the minimum and maximum times of the time header, as
+           returned by calculate_day_time_bounds. Optional, computed from the
+           events if not provided.
+    @type time_bounds: [datetime.time, datetime.time]
+
+    @param busy_lanes: lanes in use at the end of the previous pages, see
+           assign_lanes. Updated with the events of the list.
+    @type busy_lanes: [(int, int)]
+
+    @param lane_count: number of lanes used by the previous pages.
+    @type lane_count: int
+
     @return: the search_results template contextual data.
     @rtype: dict
     """
-    # unique tab ID: unless the request was made through AJAX, this can be 0
+    # unique tab ID: tabs are numbered by the views rendering several of them
     uid_val = 0
 
     # format categories for the JS helper
-    categories_val = build_category_data()
-
-    if event_list:
-        # for everything: need to know what limits of the time filter are
-        t_min = min([event.event_start_time for event in event_list])
+    if categories_val is None:
+        categories_val = build_category_data()
 
-        # end time is optional, but start time is not, so we are guaranteed some
-        # non-None tmax
-        # t_max can also be the maximum event start time of an event that does not
-        # have duration information
-        # finally, if an event ends a day after, t_max should be midnight
-        all_event_end_dates = filter(None,
-                                     list(set([event.event_end_date
-                                     for event in event_list])))
-        if all_event_end_dates and max(all_event_end_dates) > date:
-                t_max = datetime.time(23, 59)
-        else:
-            t_max1 = max([event.event_start_time for event in event_list])
-            times = filter(None, [event.event_end_time for event in event_list])
-            times.append(t_max1)
-            t_max = max(times)
-
-        # Set the minimum and maximum values of the time header
-        [t_min, t_max] = calculate_bounds_time_data(t_min, t_max)
+    if event_list or time_bounds:
+        # Position all the events on the time bar in one batch. This also
+        # determines what limits of the time filter are.
+        [t_min, t_max, timeline_data] = calculate_timeline_data(event_list,
+                                                                date,
+                                                                time_bounds)
 
         # format the time header
         time_header_val = format_time_header_data_from_min_max(
@@ -189,14 +649,26 @@ def format_sr_data_from_event_list(event_list, date, location):
         )
 
         # format event list
-        events_val = []
-        for event in event_list:
-            events_val.append(format_event_data(event, t_min, t_max))
+        events_val = [format_event_data(event, t_min, t_max, event_timeline)
+                      for (event, event_timeline)
+                      in zip(event_list, timeline_data)]
+
+        # Lay out the events in lanes, so that overlapping events never share
+        # a lane.
+        [lanes, lane_count_val] = assign_lanes(
+            [get_event_minutes(event, date) for event in event_list],
+            busy_lanes,
+            lane_count)
+        for (event_data, lane) in zip(events_val, lanes):
+            event_data['lane'] = lane
+            event_data['version'] = search_cache.get_event_data_version(
+                event_data)
 
         # format the lines
         lines_val = [t["pos"] for t in time_header_val["times_val_and_pos"]]
     else:
         events_val = []
+        lane_count_val = lane_count
         # Arbitrary t_min and t_max
         t_min = datetime.time(10, 00)
         t_max = datetime.time(22, 00)
@@ -211,80 +683,48 @@ def format_sr_data_from_event_list(event_list, date, location):
                    categories=categories_val,
                    events=events_val,
                    time_header=time_header_val,
-                   lines=lines_val
+                   lines=lines_val,
+                   lane_count=lane_count_val
                    )
     return sr_data
 
 
-def format_event_data(event, t_min, t_max):
-    """ format_event_data(event, t_min, t_max)
+def format_event_data(event, t_min, t_max, event_timeline=None):
+    """ format_event_data(event, t_min, t_max, event_timeline=None)
     ----------
     Formats the data from a single event into a dictionary that can be used
     to render correctly event data.
 
-    @param event: an Event object.
-    @type event: Event
+    @param event: an Event object, or one of its DayEvents.
+    @type event: Event or DayEvent
 
     @param t_min: minimum time that is displayed on the time slider control
     @type t_min: datetime.time
 
     @param t_max: maximum time displayed on the time slider control
     @type t_max: datetime.time
+
+    @param event_timeline: the position, duration and display strings of the
+           event, as computed by calculate_timeline_data. Optional, computed
+           for this event alone if not provided.
+    @type event_timeline: tuple
     """
-    # First thing to do: format the description string.
-    # Strip the HTML tags from the description for the preview
-    if event.description:
-        s = MLStripper()
-        s.feed(event.description)
-        description_short_val = s.get_data()[0:100]
-        # Detect if description is HTML or not
-        t_detect = MLTagDetector()
-        t_detect.feed(event.description)
-        if not t_detect.get_tags():
-            # If not tags, it is not and need to be formatted.
-            formatter = MLFormatter()
-            formatter.feed(event.description)
-            description_formatted_val = formatter.get_formatted_string()
-        else:
-            if t_detect.get_tags().find('<img>') >= 0:
-                description_formatted_val = 'Please visit event website for a description.'
-            else:
-                description_formatted_val = event.description
-    else:
-        description_short_val = 'No description for this event.'
-        description_formatted_val = '<p>No description for this event.</p>'
+    # The description strings are computed when the event is saved. Events
+    # saved before this was the case get them computed on the fly.
+    if isinstance(event, Event) and not event.description_formatted:
+        event.format_description()
+    description_short_val = event.description_short
+    description_formatted_val = event.description_formatted
 
     # Then: format start, end time, duration
-    start_time_val = event.event_start_time.strftime('%I:%M %p')
-    start_time_val_percent = time_to_percentage(
-        event.event_start_time, t_min, t_max
-    )
-    # Check if the end date is after the start date
-    # If so, display event end at midnight
-    if event.event_end_date and (event.event_end_date > event.event_start_date):
-        [duration_minutes_val, duration_str_val, duration_percent_val] = \
-            duration_from_start_end_time(
-                event.event_start_time, datetime.time(23, 59), t_min, t_max
-            )
-    else:
-        if event.event_end_time:
-            [duration_minutes_val, duration_str_val, duration_percent_val] = \
-                duration_from_start_end_time(
-                    event.event_start_time, event.event_end_time, t_min, t_max
-                )
-        else:
-            [duration_minutes_val, duration_str_val, duration_percent_val] = \
-                duration_from_start_end_time(
-                    event.event_start_time, event.event_start_time, t_min, t_max
-                )
-
-    # Format the datetime string for display purposes
-    weekday_num_to_str = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-    month_num_to_str = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug',
-                        'Sep', 'Oct', 'Nov', 'Dec']
-    datetime_val = weekday_num_to_str[event.event_start_date.weekday()] + ' ' \
-                   + month_num_to_str[event.event_start_date.month - 1] + ' ' \
-                   + str(event.event_start_date.day) + ', ' + start_time_val
+    if event_timeline is None:
+        [start_minutes, end_minutes] = get_event_minutes(event)
+        event_timeline = compute_timeline_geometry(
+            [start_minutes], [end_minutes], [event.event_start_date],
+            t_min, t_max
+        )[0]
+    [start_time_val, start_time_val_percent, duration_minutes_val,
+     duration_str_val, duration_percent_val, datetime_val] = event_timeline
 
     # Check if price is here or not
     if event.price is not None:
@@ -294,7 +734,8 @@ def format_event_data(event, t_min, t_max):
 
     # Format the category data
     # Don't forget to remove the 'other' category which doesn't have a logo.
-    cat_data = build_category_data([cat.id for cat in event.category.all()])
+    category_list_val = event.get_category_ids()
+    cat_data = build_category_data(category_list_val)
     # If there is more than one category we arbitrarily select the first
     # category for display
     if cat_data:
@@ -302,7 +743,8 @@ def format_event_data(event, t_min, t_max):
 
     # Build the final event template context dictionary
     ecd = dict(
-        category_list=[cat.id for cat in event.category.all()],
+        id=event.event_id if isinstance(event, DayEvent) else event.id,
+        category_list=category_list_val,
         name=event.name,
         description_short=description_short_val,
         description_formatted=description_formatted_val,
@@ -329,6 +771,293 @@ def format_event_data(event, t_min, t_max):
     return ecd
 
 
+def calculate_day_time_bounds(day_bounds, date):
+    """ calculate_day_time_bounds(day_bounds, date)
+    ----------
+    Returns the bounds of the time header of a day from the bounds of the
+    times of its events, as returned by DayEventManager.get_day_bounds. They
+    are the bounds calculate_timeline_data sets from the events themselves.
+
+    @param day_bounds: the bounds of the times of the events of the day.
+    @type day_bounds: dict
+
+    @param date: date of the search
+    @type date: datetime.date
+
+    @return: the minimum and maximum times of the time header.
+    @rtype: [datetime.time, datetime.time]
+    """
+    t_min = day_bounds['min_start_time']
+    t_max = day_bounds['max_start_time']
+    if day_bounds['max_end_time'] and day_bounds['max_end_time'] > t_max:
+        t_max = day_bounds['max_end_time']
+    if day_bounds['max_end_date'] and day_bounds['max_end_date'] > date:
+        t_max = datetime.time(23, 59)
+    return calculate_bounds_time_data(t_min, t_max)
+
+
+def calculate_timeline_data(event_list, date, time_bounds=None):
+    """ calculate_timeline_data(event_list, date, time_bounds=None)
+    ----------
+    Positions all the events of a day on the time bar at once. A single pass
+    over the events collects their start and end times in minutes, from which
+    the bounds of the time header are set (see calculate_bounds_time_data),
+    then compute_timeline_geometry computes the positions, durations and
+    display strings of all the events.
+
+    @param event_list: the events of the day, there should be at least one
+           unless time_bounds is given.
+    @type event_list: [Event] or [DayEvent]
+
+    @param date: date of the search
+    @type date: datetime.date
+
+    @param time_bounds: the minimum and maximum times of the time header,
+           when the events are only a page of the events of the day.
+           Optional, computed from the events if not provided.
+    @type time_bounds: [datetime.time, datetime.time]
+
+    @return: the minimum and maximum times of the time header, and the
+             timeline data of each event (see compute_timeline_geometry).
+    @rtype: [datetime.time, datetime.time, [tuple]]
+    """
+    start_minutes = []
+    end_minutes = []
+    start_dates = []
+    t_min = None
+    t_max = None
+    ends_after_date = False
+    for event in event_list:
+        [event_start_minutes, event_end_minutes] = get_event_minutes(event,
+                                                                     date)
+        start_minutes.append(event_start_minutes)
+        end_minutes.append(event_end_minutes)
+        start_dates.append(event.event_start_date)
+
+        # end time is optional, but start time is not, so we are guaranteed
+        # some non-None t_max
+        # t_max can also be the maximum event start time of an event that does
+        # not have duration information
+        if t_min is None or event.event_start_time < t_min:
+            t_min = event.event_start_time
+        if t_max is None or event.event_start_time > t_max:
+            t_max = event.event_start_time
+        if event.event_end_time and event.event_end_time > t_max:
+            t_max = event.event_end_time
+        # finally, if an event ends a day after, t_max should be midnight
+        if event.event_end_date and event.event_end_date > date:
+            ends_after_date = True
+    if ends_after_date:
+        t_max = datetime.time(23, 59)
+
+    # Set the minimum and maximum values of the time header
+    if time_bounds is not None:
+        [t_min, t_max] = time_bounds
+    else:
+        [t_min, t_max] = calculate_bounds_time_data(t_min, t_max)
+
+    return [t_min, t_max,
+            compute_timeline_geometry(start_minutes, end_minutes, start_dates,
+                                      t_min, t_max)]
+
+
+def get_event_minutes(event, date=None):
+    """ get_event_minutes(event, date=None)
+    ----------
+    Returns the start and end time of an event as it is displayed on the time
+    bar of a date, in minutes. Events continuing after that date are
+    displayed until midnight, and events without an end time have no
+    duration (see get_display_minutes). DayEvents store them for their date,
+    they are computed for events.
+
+    @param event: an Event object, or one of its DayEvents.
+    @type event: Event or DayEvent
+
+    @param date: date of the time bar, the start date of events if None.
+    @type date: datetime.date
+
+    @return: start and end minutes
+    @rtype: [int, int]
+    """
+    if isinstance(event, DayEvent):
+        return [event.start_minutes, event.end_minutes]
+    return get_display_minutes(event.event_start_date, event.event_start_time,
+                               event.event_end_date, event.event_end_time,
+                               date)
+
+
+def compute_timeline_geometry(start_minutes, end_minutes, start_dates,
+                              t_min, t_max):
+    """ compute_timeline_geometry(start_minutes, end_minutes, start_dates,
+                                  t_min, t_max)
+    ----------
+    Computes the position and duration of a batch of events on the time bar,
+    along with their display strings. The events are given as arrays, which
+    are processed column by column, so that the time bar bounds are
+    converted only once for the whole batch.
+    The results are identical to those of time_to_percentage and
+    duration_from_start_end_time.
+
+    @param start_minutes: start time of each event, in minutes
+    @type start_minutes: [int]
+
+    @param end_minutes: end time of each event, in minutes
+    @type end_minutes: [int]
+
+    @param start_dates: start date of each event
+    @type start_dates: [datetime.date]
+
+    @param t_min: minimum time displayed on the time control
+    @type t_min: datetime.time
+
+    @param t_max: maximum time displayed on the time control
+    @type t_max: datetime.time
+
+    @return: for each event, the start time string, start time percentage,
+             duration in minutes, duration string, duration percentage and
+             verbose date and time string, in this order.
+    @rtype: [tuple]
+    """
+    # Convert the bounds to minutes, with the caveat that 23:59 for t_max
+    # actually means 24:00.
+    if t_max == datetime.time(23, 59):
+        t_max = 24*60
+    else:
+        t_max = t_max.hour*60 + t_max.minute
+    t_min = t_min.hour*60 + t_min.minute
+    width = float(t_max - t_min)
+
+    # Start time percentages, rounded to 0 or 100 if out of the time bar
+    start_percent = [round(float(s - t_min)/width*100, 1)
+                     for s in start_minutes]
+    start_percent = [0 if p < 0 else (100 if p > 100 else p)
+                     for p in start_percent]
+
+    # Durations
+    duration_minutes = [e - s for (s, e) in zip(start_minutes, end_minutes)]
+    duration_percent = [round(float(d)/width*100, 1)
+                        for d in duration_minutes]
+    duration_str = [format_duration_string(d) for d in duration_minutes]
+
+    # Display strings. Most events of a day share their start date.
+    start_str = [format_minutes_string(s) for s in start_minutes]
+    date_str = dict((d, format_date_string(d)) for d in set(start_dates))
+    datetime_str = [date_str[d] + ', ' + t
+                    for (d, t) in zip(start_dates, start_str)]
+
+    return zip(start_str, start_percent, duration_minutes, duration_str,
+               duration_percent, datetime_str)
+
+
+def assign_lanes(intervals, busy_lanes=None, lane_count=0):
+    """ assign_lanes(intervals, busy_lanes=None, lane_count=0)
+    ----------
+    Assigns each event of a day to a lane of the events graph, so that events
+    whose times overlap are never in the same lane, using as few lanes as
+    possible. This colours the interval graph of the events greedily, in
+    order of start time: each event takes the lowest lane which is free when
+    it starts. A heap of lane end times and a heap of free lanes make this
+    O(n log n).
+    Events without duration still take a minute of their lane, so that they
+    are not drawn over other events.
+    The events of a day can be laid out page by page, in order of start
+    time: the lanes in use at the end of a page are then passed on to the
+    next one.
+
+    @param intervals: start and end times of the events, in minutes
+    @type intervals: [[int, int]]
+
+    @param busy_lanes: (end time, lane) of the lanes in use before the first
+           event, taken by the events of the previous pages. Optional, the
+           list is updated in place with the lanes in use after the last
+           event.
+    @type busy_lanes: [(int, int)]
+
+    @param lane_count: number of lanes used by the previous pages.
+    @type lane_count: int
+
+    @return: the lane of each event (0-based, in the order of intervals), and
+             the number of lanes used, previous pages included.
+    @rtype: [[int], int]
+    """
+    lanes = [0] * len(intervals)
+    if busy_lanes is None:
+        busy_lanes = []
+    # heap of (end time, lane) of the lanes in use
+    heapq.heapify(busy_lanes)
+    # heap of the lanes free again
+    free_lanes = sorted(set(range(lane_count)) -
+                        set(lane for (end, lane) in busy_lanes))
+    order = sorted(range(len(intervals)), key=lambda i: intervals[i])
+    for i in order:
+        [start, end] = intervals[i]
+        while busy_lanes and busy_lanes[0][0] <= start:
+            heapq.heappush(free_lanes, heapq.heappop(busy_lanes)[1])
+        if free_lanes:
+            lane = heapq.heappop(free_lanes)
+        else:
+            lane = lane_count
+            lane_count += 1
+        lanes[i] = lane
+        heapq.heappush(busy_lanes, (max(end, start + 1), lane))
+    return [lanes, lane_count]
+
+
+def format_duration_string(duration_minutes):
+    """ format_duration_string(duration_minutes)
+    ----------
+    Formats a duration for display (examples: 45m, 1h, 2h30).
+
+    @param duration_minutes: duration in minutes
+    @type duration_minutes: int
+
+    @rtype: str
+    """
+    if duration_minutes // 60 >= 1:
+        (hours, minutes) = divmod(duration_minutes, 60)
+        if minutes:
+            return "%dh%02d" % (hours, minutes)
+        else:
+            return "%dh" % hours
+    else:
+        return "%02dm" % duration_minutes
+
+
+def format_minutes_string(minutes):
+    """ format_minutes_string(minutes)
+    ----------
+    Formats a time of the day given in minutes the way event start times are
+    displayed (example: 07:30 PM). Strings are computed once and memoized.
+
+    @param minutes: time of the day, in minutes
+    @type minutes: int
+
+    @rtype: str
+    """
+    try:
+        return _MINUTES_STRINGS[minutes]
+    except KeyError:
+        time_str = datetime.time(minutes // 60, minutes % 60).strftime(
+            '%I:%M %p')
+        _MINUTES_STRINGS[minutes] = time_str
+        return time_str
+_MINUTES_STRINGS = {}
+
+
+def format_date_string(e_date):
+    """ format_date_string(e_date)
+    ----------
+    Formats a date for display (example: Sat May 10).
+
+    @param e_date: the date
+    @type e_date: datetime.date
+
+    @rtype: str
+    """
+    return WEEKDAY_NUM_TO_STR[e_date.weekday()] + ' ' \
+        + MONTH_NUM_TO_STR[e_date.month - 1] + ' ' + str(e_date.day)
+
+
 def format_time_header_data_from_min_max(t_min, t_max, e_date):
     """ format_time_header_data_from_min_max(t_min, t_max, e_date)
     ----------
@@ -356,11 +1085,7 @@ def format_time_header_data_from_min_max(t_min, t_max, e_date):
         max_time_val = t_max.strftime('%H:%M')
 
     # Format the date string
-    weekday_num_to_str = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-    month_num_to_str = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug',
-                        'Sep', 'Oct', 'Nov', 'Dec']
-    date_val = weekday_num_to_str[e_date.weekday()] + ' ' \
-               + month_num_to_str[e_date.month - 1] + ' ' + str(e_date.day)
+    date_val = format_date_string(e_date)
 
     # Get the lines and their name and position
     times_data_pos = format_lines_data(t_min, t_max)
@@ -471,7 +1196,9 @@ def build_category_data(cat_id_list=None):
     """ build_category_data
     ----------
     Builds the list of category context data dictionaries. Category id's
-    will be consistent with those in the database.
+    will be consistent with those in the database. The data comes from the
+    in-memory category registry, so this does not query the database once
+    the registry is loaded.
 
     @param cat_id_list: a list of categories IDs
     @type cat_id_list: [int]
@@ -479,18 +1206,7 @@ def build_category_data(cat_id_list=None):
              and name.
     @rtype: [dict]
     """
-    cat_data = []
-    for cat in Category.objects.all().order_by('id'):
-        if cat.base_name in CF_CATEGORIES: # ignore unofficial category names
-            cat_data.append(
-                dict(css=DB_TO_CSS_NAME[cat.base_name],
-                     name=DB_TO_VERBOSE_NAME[cat.base_name],
-                    id=cat.id)
-            )
-    if cat_id_list:
-        return [cat for cat in cat_data if (cat['id'] in cat_id_list)]
-
-    return cat_data
+    return category_registry.get_category_data(cat_id_list)
 
 
 def time_to_percentage(time_val, t_min, t_max):
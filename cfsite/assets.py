@@ -0,0 +1,307 @@
+import email.utils
+import gzip
+import mimetypes
+import os
+import re
+from StringIO import StringIO
+from django.conf import settings
+from django.contrib.staticfiles.storage import CachedStaticFilesStorage
+from django.core.files.base import ContentFile
+
+# Optional dependencies: without them, JS bundles are only concatenated, and
+# no brotli variants are written.
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Files with these extensions get precompressed variants.
+COMPRESSED_EXTENSIONS = ('.css', '.js', '.svg', '.eot', '.ttf', '.html',
+                         '.txt', '.json', '.xml')
+
+# Variants only saving less than this fraction of the file are not written.
+MIN_COMPRESSION_GAIN = 0.05
+
+# Names of the files hashed by CachedStaticFilesStorage, like
+# css/cf.0123456789ab.css. Their content never changes.
+_HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+
+# Cache-Control headers of the hashed files, and of the others.
+HASHED_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+UNHASHED_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+
+# Encodings of the precompressed variants, in order of preference, and the
+# extensions of their files.
+_VARIANTS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def minify_css(css):
+    """ minify_css(css)
+    ----------
+    Removes the comments and the unnecessary whitespace of a stylesheet.
+    Comments starting with /*! (licenses) are kept. Strings are not parsed: a
+    comment start inside a string, which the site stylesheets do not have,
+    would be taken for a comment.
+
+    @type css: str
+    @rtype: str
+    """
+    css = re.sub(r'/\*(?!!).*?\*/', '', css, flags=re.DOTALL)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js):
+    """ minify_js(js)
+    ----------
+    Minifies a script with rjsmin, or returns it unchanged if rjsmin is not
+    installed.
+
+    @type js: str
+    @rtype: str
+    """
+    if rjsmin is None:
+        return js
+    return rjsmin.jsmin(js)
+
+
+def gzip_compress(data):
+    """ gzip_compress(data)
+    ----------
+    Returns data compressed with gzip. The output only depends on data, so
+    that collecting the same files twice gives the same variants.
+
+    @type data: str
+    @rtype: str
+    """
+    buf = StringIO()
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buf, compresslevel=9,
+                       mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+class BundledStaticFilesStorage(CachedStaticFilesStorage):
+    """ BundledStaticFilesStorage
+    ----------
+    Static files storage run by collectstatic, in three steps:
+        - the bundles of settings.STATIC_BUNDLES are built: the files of
+        each bundle are concatenated and minified into a single file.
+        - all the files, bundles included, are given names containing a
+        hash of their content, and the references to other static files in
+        the stylesheets are rewritten (see CachedStaticFilesStorage). The
+        static template tag then renders the hashed names.
+        - gzip and brotli variants of the text files are written next to
+        them, with .gz and .br extensions, for PrecompressedStaticFiles to
+        serve.
+
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        """ BundledStaticFilesStorage.post_process(paths, dry_run=False,
+                                                   **options)
+        ----------
+        Builds the bundles, hashes the files and writes their compressed
+        variants. Yields the names of the processed files, like
+        CachedStaticFilesStorage.
+
+        """
+        if dry_run:
+            return
+        for name in self.build_bundles():
+            paths[name] = (self, name)
+
+        for (name, hashed_name, processed) in super(
+                BundledStaticFilesStorage, self).post_process(paths, dry_run,
+                                                              **options):
+            if not isinstance(processed, Exception):
+                for compressed_name in [name, hashed_name]:
+                    if compressed_name:
+                        self.compress(compressed_name)
+            yield name, hashed_name, processed
+
+    def build_bundles(self):
+        """ BundledStaticFilesStorage.build_bundles()
+        ----------
+        Writes the bundles of settings.STATIC_BUNDLES from the collected
+        files.
+
+        @return: the names of the bundles.
+        @rtype: [str]
+        """
+        for (bundle_name, names) in sorted(settings.STATIC_BUNDLES.items()):
+            contents = []
+            for name in names:
+                with self.open(name) as f:
+                    contents.append(f.read())
+            if bundle_name.endswith('.css'):
+                content = minify_css('\n'.join(contents))
+            else:
+                # Scripts are separated by semicolons, so that a script
+                # without a final one does not run into the next.
+                content = ';\n'.join(minify_js(c) for c in contents)
+            self._replace(bundle_name, content)
+        return sorted(settings.STATIC_BUNDLES)
+
+    def compress(self, name):
+        """ BundledStaticFilesStorage.compress(name)
+        ----------
+        Writes the gzip and, if available, brotli variants of a file, when
+        it is worth compressing.
+
+        """
+        if not name.endswith(COMPRESSED_EXTENSIONS):
+            return
+        with self.open(name) as f:
+            content = f.read()
+        variants = [('.gz', gzip_compress(content))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(content)))
+        for (extension, compressed) in variants:
+            if len(compressed) < len(content) * (1 - MIN_COMPRESSION_GAIN):
+                self._replace(name + extension, compressed)
+            elif self.exists(name + extension):
+                self.delete(name + extension)
+
+    def _replace(self, name, content):
+        """ BundledStaticFilesStorage._replace(name, content)
+        ----------
+        Saves content under name, replacing the file already there if any.
+
+        """
+        if self.exists(name):
+            self.delete(name)
+        self._save(name, ContentFile(content))
+
+
+def get_accepted_encodings(accept_encoding):
+    """ get_accepted_encodings(accept_encoding)
+    ----------
+    Returns the content codings accepted according to an Accept-Encoding
+    header. Codings given a zero quality are left out.
+
+    @type accept_encoding: str
+    @rtype: set
+    """
+    encodings = set()
+    for coding in accept_encoding.split(','):
+        parts = coding.strip().split(';')
+        quality = 1.0
+        for param in parts[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if parts[0] and quality > 0:
+            encodings.add(parts[0].strip().lower())
+    return encodings
+
+
+class PrecompressedStaticFiles(object):
+    """ PrecompressedStaticFiles
+    ----------
+    WSGI application serving the collected static files, and passing the
+    other requests to the site application.
+
+    The brotli or gzip variant of a file written by BundledStaticFilesStorage
+    is sent to the clients accepting it. Hashed files are cached by clients
+    and proxies for a year. Other files must be revalidated, with
+    If-Modified-Since, before each use.
+
+    """
+
+    def __init__(self, application, root=None, prefix=None):
+        """ PrecompressedStaticFiles.__init__(application, root=None,
+                                              prefix=None)
+        ----------
+        @param application: WSGI application of the site.
+
+        @param root: directory of the static files, settings.STATIC_ROOT by
+               default.
+        @type root: str
+
+        @param prefix: URL prefix of the static files, settings.STATIC_URL by
+               default.
+        @type prefix: str
+        """
+        self.application = application
+        self.root = os.path.abspath(root or settings.STATIC_ROOT)
+        self.prefix = prefix or settings.STATIC_URL
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.prefix):
+            return self.application(environ, start_response)
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            start_response('405 METHOD NOT ALLOWED',
+                           [('Allow', 'GET, HEAD'),
+                            ('Content-Type', 'text/plain')])
+            return ['Method not allowed']
+
+        name = path[len(self.prefix):]
+        full_path = os.path.abspath(os.path.join(self.root, name))
+        if not full_path.startswith(self.root + os.sep) or \
+                not os.path.isfile(full_path):
+            start_response('404 NOT FOUND', [('Content-Type', 'text/plain')])
+            return ['Not found']
+
+        headers = [('Vary', 'Accept-Encoding')]
+        (content_type, encoding) = mimetypes.guess_type(full_path)
+        headers.append(('Content-Type',
+                        content_type or 'application/octet-stream'))
+        if _HASHED_NAME_RE.search(name):
+            headers.append(('Cache-Control', HASHED_CACHE_CONTROL))
+        else:
+            headers.append(('Cache-Control', UNHASHED_CACHE_CONTROL))
+
+        mtime = int(os.path.getmtime(full_path))
+        headers.append(('Last-Modified', email.utils.formatdate(
+            mtime, usegmt=True)))
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            since = email.utils.parsedate_tz(if_modified_since)
+            if since is not None and \
+                    email.utils.mktime_tz(since) >= mtime:
+                start_response('304 NOT MODIFIED', headers)
+                return []
+
+        accepted = get_accepted_encodings(
+            environ.get('HTTP_ACCEPT_ENCODING', ''))
+        for (coding, extension) in _VARIANTS:
+            if coding in accepted and os.path.isfile(full_path + extension):
+                full_path += extension
+                headers.append(('Content-Encoding', coding))
+                break
+
+        headers.append(('Content-Length', str(os.path.getsize(full_path))))
+        start_response('200 OK', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        f = open(full_path, 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(f)
+        return _iter_file(f)
+
+
+def _iter_file(f, block_size=64 * 1024):
+    """ _iter_file(f, block_size=64 * 1024)
+    ----------
+    Yields the content of a file by blocks, and closes it.
+
+    """
+    try:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield block
+    finally:
+        f.close()
@@ -0,0 +1,92 @@
+import logging
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('cfsite.queries')
+
+
+class QueryStatsMiddleware(object):
+    """ QueryStatsMiddleware
+    ----------
+    Records the SQL queries run while serving each request, on all the
+    databases, and reports them:
+        - in the X-Query-Stats response header: the view, the number of
+        queries, the total SQL time and the durations of the slowest queries.
+        - in a log line of the cfsite.queries logger, which also gives the
+        SQL of the slowest queries.
+    The number of slowest queries reported is settings.QUERY_STATS_SLOWEST.
+    The middleware is only used if settings.QUERY_STATS_ENABLED is set, and
+    should come first in MIDDLEWARE_CLASSES, to see the queries of the other
+    middleware too.
+
+    Queries are recorded with the debug cursor of the connections, which
+    Django otherwise only uses when DEBUG is set.
+
+    """
+
+    def __init__(self):
+        """ QueryStatsMiddleware.__init__()
+        ----------
+        Leaves the middleware out unless settings.QUERY_STATS_ENABLED is
+        set.
+
+        """
+        if not settings.QUERY_STATS_ENABLED:
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        """ QueryStatsMiddleware.process_request(request)
+        ----------
+        Starts recording the queries of the request.
+
+        """
+        request.cf_query_stats = dict(view=None, connections=[])
+        for connection in connections.all():
+            request.cf_query_stats['connections'].append(
+                (connection, connection.use_debug_cursor,
+                 len(connection.queries)))
+            connection.use_debug_cursor = True
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """ QueryStatsMiddleware.process_view(request, view_func, view_args,
+                                              view_kwargs)
+        ----------
+        Remembers which view serves the request.
+
+        """
+        if hasattr(request, 'cf_query_stats'):
+            request.cf_query_stats['view'] = '%s.%s' % (
+                view_func.__module__, getattr(view_func, '__name__',
+                                              view_func.__class__.__name__))
+
+    def process_response(self, request, response):
+        """ QueryStatsMiddleware.process_response(request, response)
+        ----------
+        Stops recording the queries of the request, and reports them.
+
+        """
+        stats = getattr(request, 'cf_query_stats', None)
+        if stats is None:
+            return response
+
+        queries = []
+        for (connection, use_debug_cursor, n_queries) in stats['connections']:
+            queries += connection.queries[n_queries:]
+            connection.use_debug_cursor = use_debug_cursor
+        durations = [(float(query['time']) * 1000, query['sql'])
+                     for query in queries]
+        total_time = sum(duration for (duration, sql) in durations)
+        slowest = sorted(durations, reverse=True)[
+            :settings.QUERY_STATS_SLOWEST]
+
+        response['X-Query-Stats'] = \
+            'view=%s; queries=%d; time=%.1fms; slowest=%s' % (
+                stats['view'], len(queries), total_time,
+                ','.join('%.1fms' % duration for (duration, sql) in slowest))
+        logger.info('%s %s view=%s queries=%d time=%.1fms slowest=[%s]',
+                    request.method, request.path, stats['view'],
+                    len(queries), total_time,
+                    '; '.join('%.1fms %s' % (duration, sql[:200])
+                              for (duration, sql) in slowest))
+        return response
@@ -95,6 +95,27 @@ STATICFILES_FINDERS = (
     'django.contrib.staticfiles.finders.AppDirectoriesFinder',
     #'django.contrib.staticfiles.finders.DefaultStorageFinder',
 )
+
+# Bundles of static files built by collectstatic with
+# cfsite.assets.BundledStaticFilesStorage: each bundle is made of the files
+# listed, concatenated in that order and minified. Templates include them
+# with the static_bundle tag.
+STATIC_BUNDLES = {
+    'css/index.bundle.css': ['css/bootstrap.min.css',
+                             'css/bootstrap-theme.min.css',
+                             'css/datepicker.css',
+                             'css/crazyfish.css'],
+    'js/index.bundle.js': ['js/bootstrap.min.js',
+                           'js/cf_utils.js',
+                           'js/bootstrap-datepicker.js'],
+    'css/search.bundle.css': ['css/cf.css',
+                              'css/cf-animations.css'],
+    'js/search.bundle.js': ['js/cf.js'],
+}
+
+# Whether the static_bundle tag includes the bundles, or each of their files.
+# Bundles only exist once collectstatic built them.
+STATIC_BUNDLES_ENABLED = False
 ########## END STATIC FILE CONFIGURATION
 
 
@@ -115,6 +136,8 @@ TEMPLATE_DIRS = (
 
 ########## MIDDLEWARE CONFIGURATION
 MIDDLEWARE_CLASSES = (
+    # First, so that it sees the queries of the other middleware too.
+    '%s.middleware.QueryStatsMiddleware' % SITE_NAME,
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -122,6 +145,15 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
+
+# Whether QueryStatsMiddleware reports the SQL queries of each request. It
+# keeps the SQL of every query in memory and tells it to any client, so it
+# is only enabled in development.
+QUERY_STATS_ENABLED = False
+
+# Number of slowest SQL queries of each request reported by
+# QueryStatsMiddleware, in the X-Query-Stats header and the cfsite.queries log.
+QUERY_STATS_SLOWEST = 3
 ########## END MIDDLEWARE CONFIGURATION
 
 
@@ -145,6 +177,50 @@ INSTALLED_APPS = (
 ########## END APP CONFIGURATION
 
 
+########## SEARCH CONFIGURATION
+# Number of events of a day shipped with the search results page, and with
+# each of the pages loaded next, as the user scrolls down.
+SEARCH_RESULTS_PAGE_SIZE = 100
+
+# Number of seconds the search results of a day stay cached. Results are
+# invalidated as soon as an event of that day changes, this only bounds how
+# long unused results take up room in the cache.
+SEARCH_RESULTS_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Number of seconds the rendered HTML of each event of the search results
+# stays cached. Fragments of events which changed are never looked up
+# again, this only bounds how long they take up room in the cache.
+EVENT_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Number of seconds the category and city names offered as search choices
+# are kept in memory. They are reloaded as soon as they change in this
+# process, this only bounds how long changes made by other processes take
+# to show up.
+FACET_REGISTRY_MAX_AGE = 60 * 5
+
+# Number of seconds the names suggested while users type are kept in memory
+# before being rebuilt, so that past events are dropped and events saved by
+# other processes show up. Each process has its own index, which only follows
+# the events it saves itself: events saved by import_events, the admin of
+# another web worker or any other process take up to this long to be
+# suggested by this one.
+SUGGEST_INDEX_MAX_AGE = 60 * 60
+########## END SEARCH CONFIGURATION
+
+
+########## CRAWLER CONFIGURATION
+# Number of pages of a paginated source (Eventbrite, Meetup) that
+# import_events fetches at the same time, once the first page told how many
+# there are.
+CRAWLER_PAGE_FAN_OUT = 4
+
+# Directory where import_events remembers the ETag, Last-Modified date and
+# digest of the feeds and pages it imported, so that it only parses them
+# again once they change. None disables the cache.
+CRAWLER_HTTP_CACHE_DIR = normpath(join(SITE_ROOT, 'crawler_cache'))
+########## END CRAWLER CONFIGURATION
+
+
 ########## URL CONFIGURATION
 ROOT_URLCONF = '%s.urls' % SITE_NAME
 ########## END URL CONFIGURATION
@@ -11,6 +11,12 @@ TEMPLATE_DEBUG = DEBUG
 ########## END DEBUG CONFIGURATION
 
 
+########## MIDDLEWARE CONFIGURATION
+# Report the SQL queries of each request, see cfsite.middleware.
+QUERY_STATS_ENABLED = True
+########## END MIDDLEWARE CONFIGURATION
+
+
 ########## EMAIL CONFIGURATION
 EMAIL_BACKEND = 'django.core.mail.backends.dummy.EmailBackend'
 ########## END EMAIL CONFIGURATION
@@ -1,6 +1,7 @@
 """Development settings and globals."""
 
 
+import os
 from common import *
 import dj_database_url
 
@@ -22,8 +23,47 @@ DATABASES = {
 }
 DATABASES['default'] = dj_database_url.config()
 
+
+########## CACHE CONFIGURATION
+# The cache must be shared by all the processes: the web workers, and
+# import_events, the Gdocs controller and the admin, which write events. The
+# data versions of the cached search results, and the ETag and Last-Modified
+# headers of the API, are stored in it (see cfsite.apps.events.search_cache).
+# A per-process cache, which Django falls back to when none is configured,
+# would keep serving the results cached before an import.
+# Memcached answers the many lookups of each search (the data versions of
+# the days and the fragment of every event) in a single round trip. Evicted
+# data versions come back newer, see search_cache. The servers are listed in
+# $MEMCACHE_SERVERS, separated by semicolons.
+# The hashed names of the static files, which BundledStaticFilesStorage
+# looks up in the 'staticfiles' cache for every static template tag, only
+# change with a deployment: they are kept in memory by each process rather
+# than fetched from memcached, and never expire.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.environ.get('MEMCACHE_SERVERS',
+                                   '127.0.0.1:11211').split(';'),
+    },
+    'staticfiles': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'staticfiles',
+        'TIMEOUT': 60 * 60 * 24 * 365,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+########## END CACHE CONFIGURATION
+
 # Honor the 'X-Forwarded-Proto' header for request.is_secure()
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
 # Allow all host headers
-ALLOWED_HOSTS = ['*']
\ No newline at end of file
+ALLOWED_HOSTS = ['*']
+
+
+########## STATIC FILE CONFIGURATION
+# Bundle, fingerprint and precompress the static files on collectstatic. They
+# are served by cfsite.assets.PrecompressedStaticFiles, see wsgi.py.
+STATICFILES_STORAGE = 'cfsite.assets.BundledStaticFilesStorage'
+STATIC_BUNDLES_ENABLED = True
+########## END STATIC FILE CONFIGURATION
@@ -3,6 +3,11 @@
 // Default height of the hit area
 HIT_AREA_DEFAULT_HEIGHT = 40;
 
+// Height in pixels of a lane of the lanes overview, and maximum height of the
+// overview: lanes get thinner on busy days.
+LANE_HEIGHT = 8;
+LANES_OVERVIEW_MAX_HEIGHT = 120;
+
 /**************************** Global variables   *****************************/
 
 // Warning: order of these categories matter, and should match the order
@@ -243,6 +248,7 @@ function getMinAndMaxTimes () {
  *             [3]: price of the events, 0 if the event is free
  *             [4]: start time of the event as a percentage of the time slider
  *             [5]: duration of the event as a percentage of the time slider (ex: 15.5 for 15.5%)
+ *             [6]: lane of the event in the events graph, as laid out by the server
  *
  */
 function getEventArray () {
@@ -273,7 +279,9 @@ function getEventArray () {
         var cDuration = cEventHelper.children( '.event-helper-duration-minutes ' ).html();
         cDuration = durationInMinutesToPercentage(cDuration);
 
-        eventArr.push([i, cCategory, cMagic, cPrice, cStartTime, cDuration]);
+        var cLane = parseInt( cEventHelper.children( '.event-helper-lane' ).html() );
+
+        eventArr.push([i, cCategory, cMagic, cPrice, cStartTime, cDuration, cLane]);
     }
     return eventArr;
 };
@@ -396,6 +404,15 @@ function getActiveTabEventsGraph () {
     return $( '#' + getSelectedTabHtmlId() + ' .results-content .events-table .events-graph ' );
 }
 
+/**
+ * Returns a jQuery object containing the active tab lanes overview.
+ * @return {[jQuery]} A jQuery object containing the active tab lanes overview.
+ *
+ */
+function getActiveTabLanesOverview () {
+    return $( '#' + getSelectedTabHtmlId() + ' .results-content .events-table .lanes-overview ' );
+}
+
 /**
  * Returns a jQuery object containing the active tab no event found warning 
  * element.
@@ -686,6 +703,9 @@ function updateEventGraphOrder ( eventIndexList ) {
 
     // Setting the event table to the new data.
     setActiveTabEventsGraphFromJQObj( newEventsJQ );
+
+    // The overview refers to the events by position
+    renderLanesOverview();
 }
 
 /**
@@ -733,6 +753,9 @@ function updateEventGraphVisibility ( eventIndexList ) {
     if ( indexLastSeparator < allEvents.length - 1) {
         separator.eq(indexLastSeparator).toggle( false );
     }
+
+    // Dimming the hidden events in the overview
+    renderLanesOverview();
     
     // Updating the height of the hit area
     SetHitAreaHeight( HIT_AREA_DEFAULT_HEIGHT + getEventTableHeight() );
@@ -887,6 +910,21 @@ function getIdEventsMatchingFilters () {
 }
 
 
+/**************************** Results tabs       *****************************/
+
+// Display the results of the day whose tab is clicked
+$( '.results-tabs .results-tab' ).click( function() {
+    $( '.results-tabs .results-tab' ).toggleClass( 'selected', false );
+    $( this ).toggleClass( 'selected', true );
+    $( '#results-area .results' ).toggleClass( 'selected', false );
+    $( '#' + $( this ).attr( 'data-tab-id' ) ).toggleClass( 'selected', true );
+
+    // The overview and the time sliders hit area depend on the events of
+    // the tab
+    renderLanesOverview();
+    setHitAreaHeight( HIT_AREA_DEFAULT_HEIGHT + getEventTableHeight() );
+});
+
 /**************************** Filter / sort list *****************************/
 
 // Toggle selection of filter controls
@@ -910,16 +948,136 @@ $( '.sort-logos-wrapper .sort-logos' ).click( function() {
         $( this ).children( '.sort-logo' ).toggleClass( 'descending' );
     }
 
-    // TODO: sort as things get toggled
+    applySelectedSort();
+});
+
+/**
+ * Sorts the events of the active tab with the sorting selected by the user,
+ * if any.
+ *
+ */
+function applySelectedSort () {
+    var selectedLogo = $( '#' + getSelectedTabHtmlId() + ' .sort-logos-wrapper .sort-logos .sort-logo.selected' );
+    if ( selectedLogo.length == 0 ) {
+        return;
+    }
     var cSortMode = getSelectedSortLogoNumId();
-    if ( $( this ).children( '.sort-logo' ).attr('class').indexOf('descending') != -1 ) {
+    if ( selectedLogo.attr('class').indexOf('descending') != -1 ) {
         updateEventGraphOrder( sortEventArrayDescending( getEventArray(), cSortMode) );
     }
     else {
         updateEventGraphOrder( sortEventArrayAscending( getEventArray(), cSortMode) );
     }
+}
+
+/****************************    More events     *****************************/
+
+/**
+ * Loads the next page of events of the active tab from the server, and
+ * appends it to the events graph. The filters and sorting selected by the
+ * user are applied to the new events too.
+ * @param {jQuery} moreEvents: the more-events element of the active tab,
+ *        holding the cursor of the next page.
+ *
+ */
+function loadMoreEvents ( moreEvents ) {
+    // Only one page at a time
+    if ( moreEvents.hasClass( 'loading' ) ) {
+        return;
+    }
+    moreEvents.addClass( 'loading' );
+
+    $.getJSON( '/search/more/', {
+        location: moreEvents.attr( 'data-location' ),
+        category: moreEvents.attr( 'data-category' ),
+        date: moreEvents.attr( 'data-date' ),
+        after: moreEvents.attr( 'data-next' )
+    }).done( function( data ) {
+        var eventsGraph = getActiveTabEventsGraph();
+        if ( data.html.trim().length > 0 ) {
+            // Separate the new events from the ones already there
+            if ( getActiveTabEvents().length > 0 ) {
+                eventsGraph.append( '<div class="separator"></div>' );
+            }
+            eventsGraph.append( data.html );
+        }
+        eventsGraph.attr( 'data-lane-count', data.lane_count );
+
+        if ( data.next ) {
+            moreEvents.attr( 'data-next', data.next );
+            moreEvents.removeClass( 'loading' );
+        }
+        else {
+            moreEvents.remove();
+        }
+
+        updateEventGraphVisibility( getIdEventsMatchingFilters() );
+        applySelectedSort();
+    }).fail( function() {
+        // Let the user try again
+        moreEvents.removeClass( 'loading' );
+    });
+}
+
+// Load the next page of events when the user asks for it...
+$( document ).on( 'click', '.results .more-events', function() {
+    loadMoreEvents( $( this ) );
+});
+
+// ... or scrolls close to the end of the events already there.
+$( window ).scroll( function() {
+    var moreEvents = $( '#' + getSelectedTabHtmlId() + ' .more-events' );
+    if ( moreEvents.length > 0  &&
+         moreEvents.offset().top < $( window ).scrollTop() + 2 * $( window ).height() ) {
+        loadMoreEvents( moreEvents );
+    }
+});
+
+/****************************   Lanes overview   *****************************/
+
+/**
+ * Draws the lanes overview of the active tab: a bar per event, placed in the
+ * lane the server laid the event out in, so that overlapping events never
+ * share a row. Nothing is computed here but the position of each bar. Events
+ * hidden by the filters are dimmed.
+ *
+ */
+function renderLanesOverview () {
+    var laneCount = parseInt( getActiveTabEventsGraph().attr( 'data-lane-count' ) ) || 0;
+    var laneHeight = Math.min( LANE_HEIGHT, LANES_OVERVIEW_MAX_HEIGHT / Math.max( laneCount, 1 ) );
+    var allEvents = getActiveTabEvents();
+    var eventArr = getEventArray();
+    var overview = getActiveTabLanesOverview();
+
+    // Lane in [6], start time in [4] and duration in [5], in percentages.
+    var bars = '';
+    for ( var i = 0; i < eventArr.length; i++ ) {
+        var cEvent = eventArr[i];
+        var cClass = 'lane-bar';
+        if ( allEvents.eq(i).css( 'display' ) == 'none' ) {
+            cClass += ' filtered';
+        }
+        bars += '<div class="' + cClass + '" data-event-index="' + i + '" style="' +
+                'left: ' + numToPercentString( cEvent[4] ) + '; ' +
+                'width: ' + numToPercentString( cEvent[5] ) + '; ' +
+                'top: ' + ( cEvent[6] * laneHeight ) + 'px; ' +
+                'height: ' + Math.max( laneHeight - 1, 1 ) + 'px;"></div>';
+    }
+    overview.children( '.lanes' ).html( bars );
+    overview.height( laneCount * laneHeight );
+}
+
+// Bring the event of a bar into view when the bar is clicked
+$( document ).on( 'click', '.results .lanes-overview .lane-bar', function() {
+    var cEvent = getActiveTabEvents().eq( parseInt( $( this ).attr( 'data-event-index' ) ) );
+    if ( cEvent.css( 'display' ) != 'none' ) {
+        $( window ).scrollTop( cEvent.offset().top - $( window ).height() / 2 );
+    }
 });
 
+// Draw the overview of the tab displayed first
+renderLanesOverview();
+
 /****************************    Times table     *****************************/
 
 // Set the height of the hit area
@@ -1,6 +1,7 @@
 from django.conf.urls import patterns, include, url
 from django.contrib import admin
-from cfsite.apps.events.views import home, search
+from cfsite.apps.events.views import home, search, search_more, \
+    api_events, api_suggest
 
 
 admin.autodiscover()
@@ -12,5 +13,8 @@ urlpatterns = patterns('',
 
     url(r'^$', home, name='home'),
     url(r'^search/$', search),
+    url(r'^search/more/$', search_more),
+    url(r'^api/events/$', api_events),
+    url(r'^api/suggest/$', api_suggest),
     url(r'^admin/', include(admin.site.urls)),
 )
@@ -11,6 +11,15 @@ import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cfsite.settings.prod")
 
 from django.core.wsgi import get_wsgi_application
-from dj_static import Cling
+from cfsite.assets import PrecompressedStaticFiles
 
-application = Cling(get_wsgi_application())
+# The static files are served with their precompressed variants and far
+# future cache headers, see cfsite.assets.
+application = PrecompressedStaticFiles(get_wsgi_application())
+
+# The suggestion index is built once the process starts, rather than by the
+# first typeahead query, see cfsite.apps.events.suggest. A database which
+# cannot be read yet does not stop the process from starting: the index is
+# then built by the first query.
+from cfsite.apps.events.suggest import suggestion_index
+suggestion_index.warm()